@@ -0,0 +1,266 @@
+"""
+Batch evaluation of many independent Racython programs.
+
+A Batch runs a list of programs, like student submissions, each one on its own: every program runs in an empty
+frame on top of the prelude, a copy of topLevelEnv with the prelude program already run in it, so whatever a
+program defines or sets stays in its own frame and no program sees what another one did. The prelude is built once
+per process and never written to after that (vectors in it are shared though, a vector-set! on one of them is seen
+by the programs run after it in the same process).
+
+With more than one worker the programs are split into chunks that run on a pool of worker processes, parallel's
+pool unless the Batch is given its own number of workers, and the Results come back as each chunk is done, not in
+the order of the programs. Every Result says which program it is for.
+
+Each program can be given a timeout, in seconds, and a limit on the steps it takes, the Python function calls made
+while it runs (every call to a closure is at least one in every engine), so a program that never stops is stopped
+either way. Counting steps makes programs run a few times slower, so they are only counted with a limit. Programs
+also run with Python's recursion limit at DEPTH frames instead of racython's, since recursing deeper than that
+(without a tail call) can overflow the C stack and kill the process; a worker that dies anyway fails the programs
+it was running.
+
+A Result is a Result(Number [ListOf Value] String [Or String None] Number [Or Number None]): the index of the
+program, the value of each form that ran, what the program displayed, why the forms after the last value didn't
+run (None if they all did), the seconds it took and the steps it took (None without a step limit).
+
+    python batch.py program.rkt... [--prelude FILE] [--engine ENGINE] [--workers N] [--timeout SECONDS] [--steps N]
+                    [--depth N]
+
+prints a JSON line for each program as soon as it is done, - runs every line of stdin as a program of its own.
+"""
+
+import collections
+import contextlib
+import io
+import pickle
+import signal
+import sys
+import threading
+import time
+import parallel
+import ports
+import racython
+
+Result = collections.namedtuple("Result", "index values output error seconds steps")
+
+DEPTH = 20000
+
+# The prelude env of every (prelude, engine) this process has run programs on
+preludes = {}
+
+
+class Counter(object):
+    """ A profile function counting the calls made while it is set, raising StepLimit once past its limit"""
+    __slots__ = ("limit", "steps")
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.steps = 0
+
+    def __call__(self, frame, event, arg):
+        if event == "call":
+            self.steps += 1
+            if self.steps > self.limit:
+                raise racython.StepLimit("took more than %d steps" % self.limit)
+
+
+def prelude(source, engine="interp"):
+    """ [Or String None] String -> Env
+        The environment programs run on top of, with the given prelude program run in a copy of topLevelEnv.
+        Built the first time this process needs it."""
+    key = (source, engine)
+    env = preludes.get(key)
+    if env is None:
+        env = racython.toEnv(dict(racython.topLevelEnv))
+        if source is not None:
+            # What the prelude displays isn't any program's output
+            with ports.redirect(io.StringIO()), contextlib.redirect_stdout(io.StringIO()):
+                for _ in racython.runStream(io.StringIO(source), engine, env):
+                    pass
+        preludes[key] = env
+    return env
+
+
+def runProgram(index, source, env, engine="interp", timeout=None, steps=None, depth=DEPTH):
+    """ Number String Env String Number Number Number -> Result
+        Runs every form of the given program in a frame of its own on top of env, stopping it after timeout
+        seconds or steps steps, or when it recurses deeper than depth Python frames"""
+    values = []
+    output = io.StringIO()
+    error = None
+    counter = None if steps is None else Counter(steps)
+    # Only the main thread gets signals, elsewhere the timeout can't stop it
+    alarms = timeout is not None and threading.current_thread() is threading.main_thread()
+    limit = sys.getrecursionlimit()
+    start = time.perf_counter()
+    try:
+        # interp prints its errors itself
+        with ports.redirect(output, io.StringIO()), contextlib.redirect_stdout(output):
+            if alarms:
+                def expire(signum, frame):
+                    raise racython.Timeout("took longer than %gs" % timeout)
+                previous = signal.signal(signal.SIGALRM, expire)
+                signal.setitimer(signal.ITIMER_REAL, timeout)
+            if depth is not None:
+                sys.setrecursionlimit(depth)
+            if counter is not None:
+                sys.setprofile(counter)
+            try:
+                for value in racython.runStream(io.StringIO(source), engine, env.child()):
+                    values.append(value)
+            finally:
+                if counter is not None:
+                    sys.setprofile(None)
+                sys.setrecursionlimit(limit)
+                if alarms:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+                    signal.signal(signal.SIGALRM, previous)
+    except SystemExit:
+        # interp has already said why in the output
+        error = "SystemExit: the program exited"
+    except Exception as e:
+        error = "%s: %s" % (type(e).__name__, e)
+    return Result(index, values, output.getvalue(), error, time.perf_counter() - start,
+                  None if counter is None else counter.steps)
+
+
+def work(source, engine, programs, timeout, steps, depth):
+    """ [Or String None] String [ListOf (Number String)] Number Number Number -> [ListOf Result]
+        runProgram in a worker, for every numbered program on the given prelude"""
+    env = prelude(source, engine)
+    results = []
+    for index, program in programs:
+        result = runProgram(index, program, env, engine, timeout, steps, depth)
+        # Values that can't go back to the parent are sent as they print
+        try:
+            pickle.dumps(result)
+        except Exception:
+            result = result._replace(values=[str(value) for value in result.values])
+        results.append(result)
+    return results
+
+
+class Batch(object):
+    """ A prelude, and the engine, workers and limits programs are run on it with"""
+
+    def __init__(self, prelude=None, engine="interp", workers=None, timeout=None, steps=None, depth=DEPTH):
+        self.prelude = prelude
+        self.engine = engine
+        self.timeout = timeout
+        self.steps = steps
+        self.depth = depth
+        self.workers = parallel.WORKERS if workers is None else workers
+        # Its own pool, if given a number of workers
+        self.own = workers is not None
+        self.pool = None
+
+    def getPool(self):
+        """ -> ProcessPoolExecutor
+            The pool programs run on, started the first time it is needed"""
+        if not self.own:
+            return parallel.getPool()
+        if self.pool is None:
+            import concurrent.futures
+            self.pool = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=parallel.startWorker)
+        return self.pool
+
+    def run(self, sources):
+        """ [ListOf String] -> [Generator Result]
+            Runs every program, yielding the Result of each as soon as it is done"""
+        sources = list(sources)
+        if self.workers <= 1 or len(sources) < 2 or parallel.inWorker:
+            env = prelude(self.prelude, self.engine)
+            for index, source in enumerate(sources):
+                yield runProgram(index, source, env, self.engine, self.timeout, self.steps, self.depth)
+            return
+        import concurrent.futures
+        import concurrent.futures.process
+        programs = list(enumerate(sources))
+        size = -(-len(programs) // (self.workers * parallel.CHUNKS))
+        futures = {}
+        for start in range(0, len(programs), size):
+            chunk = programs[start:start + size]
+            futures[self.getPool().submit(work, self.prelude, self.engine, chunk, self.timeout, self.steps,
+                                          self.depth)] = chunk
+        broken = False
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    results = future.result()
+                except concurrent.futures.process.BrokenProcessPool:
+                    # Which of them killed it can't be told, and the pool is no good after that
+                    broken = True
+                    results = [Result(index, [], "", "Crashed: the worker running it died", 0.0, None)
+                               for index, _ in futures[future]]
+                for result in results:
+                    yield result
+        finally:
+            # Whatever hasn't started if the caller stops early
+            for future in futures:
+                future.cancel()
+            if broken:
+                self.resetPool()
+
+    def resetPool(self):
+        """ -> None
+            Drops the pool programs run on, the next program starts a new one"""
+        if self.own:
+            self.close()
+        elif parallel.pool is not None:
+            parallel.pool.shutdown(wait=False)
+            parallel.pool = None
+
+    def close(self):
+        """ -> None
+            Stops the workers of its own pool, if it started one"""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+        return False
+
+
+def runBatch(sources, prelude=None, engine="interp", workers=None, timeout=None, steps=None, depth=DEPTH):
+    """ [ListOf String] [Or String None] String Number Number Number Number -> [ListOf Result]
+        The Result of every program, in the order of sources (see Batch)"""
+    with Batch(prelude, engine, workers, timeout, steps, depth) as batch:
+        return sorted(batch.run(sources), key=lambda result: result.index)
+
+
+if __name__ == "__main__":
+    # Only the command line needs these
+    import argparse
+    import json
+    options = argparse.ArgumentParser(description="Runs many independent Racython programs")
+    options.add_argument("programs", nargs="+", help="files to run, - for every line of stdin")
+    options.add_argument("--prelude", help="program every program runs on top of")
+    options.add_argument("--engine", default="interp")
+    options.add_argument("--workers", type=int)
+    options.add_argument("--timeout", type=float)
+    options.add_argument("--steps", type=int)
+    options.add_argument("--depth", type=int, default=DEPTH)
+    args = options.parse_args()
+    names = []
+    sources = []
+    for name in args.programs:
+        if name == "-":
+            lines = [line for line in sys.stdin.read().splitlines() if line.strip()]
+            names.extend("-:%d" % (number + 1) for number in range(len(lines)))
+            sources.extend(lines)
+        else:
+            names.append(name)
+            sources.append(open(name).read())
+    with Batch(open(args.prelude).read() if args.prelude else None, args.engine, args.workers, args.timeout,
+               args.steps, args.depth) as batch:
+        failed = False
+        for result in batch.run(sources):
+            failed = failed or result.error is not None
+            line = result._asdict()
+            line["program"] = names[result.index]
+            line["values"] = [str(value) for value in result.values]
+            print(json.dumps(line), flush=True)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,441 @@
+""" Benchmarks for the Racython interpreter.
+
+    python benchmark.py [n] [--size N] [--pipeline N] [--json FILE] [--baseline FILE] [--tolerance 0.25] [--startup]
+
+Runs each workload once per engine and reports wall time, closure calls (or steps) per second and the peak
+memory traced while running it:
+    - a tree recursive fib written with self application (a closure defined with define can't see itself)
+    - map, filter and foldr over --size elements (10^5)
+    - building a list of 1/50 of that with cons and summing it with first and rest
+    - a closure made per element of a list of 1/5 of that by map, each one called by foldl
+    - a Brainfuck interpreter printing Hello World with its tape as a list and as a vector, the tape is 100
+      cells long with the pointer starting in the middle, like bf.rkt's (which is 1000 long)
+Then reads a large generated source to measure the reader's throughput, and how fast the program cache loads it
+back. Then displays --size lines and writes --size characters one write-string at a time to a line buffered
+stream (like a terminal), through an unbuffered port that writes out every time, like print did, and through a
+buffered one, reporting characters per second and write system calls (from /proc/self/io, or the times the port
+wrote out where that isn't there). Then makes --size two field structs with define-struct's constructor, with a
+namedtuple and as a two element list, reporting the bytes each one takes and how fast they are made and their
+first field read. Then runs map/filter/build-list/fold pipelines over --pipeline elements (10^6) eagerly and with
+the optimizer fusing them into one pass over a stream, reporting elements per second and peak memory. Last comes
+start up: the best of STARTUP_RUNS fresh processes for a bare python, for what
+-X importtime says import racython takes (with the modules that take longest on their own) and for
+python tarea3.py "(+ 1 2)". --startup runs only that.
+
+--json writes the results to a file, --baseline compares them against a file written that way and exits with 1
+if anything got slower by more than the tolerance. benchmark-baseline.json holds the results of the defaults."""
+
+import argparse
+import collections
+import io
+import json
+import os
+import ports
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import cache
+import racket_functions
+import racython
+import reader
+
+ENGINES = ["interp", "resolve", "compile", "vm"]
+
+FIB = """((fun (fib) (fib fib {n}))
+         (fun (self n) (if0 (< n 2) n (+ (self self (- n 1)) (self self (- n 2))))))"""
+
+LIST = """(with (build (fun (self n acc) (if0 (equal? n 0) acc (self self (- n 1) (cons n acc)))))
+ (with (sum (fun (self lst acc) (if0 (empty? lst) acc (self self (rest lst) (+ acc (first lst))))))
+  (sum sum (build build {n} empty) 0)))"""
+
+MAP_REDUCE = """(foldr + 0 (filter even? (map (fun (x) (* x 3)) (build-list {n} (fun (i) i)))))"""
+
+CLOSURES = """(foldl (fun (f acc) (f acc)) 0 (map (fun (i) (fun (x) (+ x i))) (build-list {n} (fun (i) i))))"""
+
+STARTUP_RUNS = 10
+
+# Each one eagerly and fused, over --pipeline elements: a bulk pipeline, a foldr and a closure bulk can't run
+PIPELINES = {"squares": "(foldl + 0 (map (fun (x) (* x x)) (filter even? (build-list {n} (fun (i) i)))))",
+             "foldr": "(foldr + 0 (map add1 (build-list {n} (fun (i) (* i 3)))))",
+             "closure": "(foldl + 0 (map (fun (x) (if0 (even? x) x 0)) (build-list {n} (fun (i) i))))"}
+
+STRUCTS = ["define-struct", "namedtuple", "list"]
+
+OUTPUT = {"display": "(foldl (fun (i acc) (seqn (display i) acc)) 0 (build-list {n} (fun (i) i)))",
+          "write-string": """(foldl (fun (i acc) (seqn (write-string (integer->char (+ 97 (modulo i 26)))) acc)) 0
+                                    (build-list {n} (fun (i) i)))"""}
+
+HELLO = "++++++++++[>+++++++>++++++++++>+++>+<<<<-]>++.>+.+++++++..+++.>++.<<+++++++++++++++.>.+++.------.--------.>+.>."
+
+BF = """(with (prog (list->vector (list {ops})))
+ (with (jumps (list->vector (list {jumps})))
+  (with (upd (fun (self lst i v) (if0 (equal? i 0) (cons v (rest lst))
+                                      (cons (first lst) (self self (rest lst) (- i 1) v)))))
+   ((fun (step) (step step 0 50 {tape} empty))
+    (fun (self pc ptr tape out)
+      (if0 (equal? pc {length}) (reverse out)
+        (with (op (vector-ref prog pc))
+          (if0 (equal? op 0) (self self (add1 pc) ptr {set[(modulo (add1 {get}) 256)]} out)
+          (if0 (equal? op 1) (self self (add1 pc) ptr {set[(modulo (sub1 {get}) 256)]} out)
+          (if0 (equal? op 2) (self self (add1 pc) (add1 ptr) tape out)
+          (if0 (equal? op 3) (self self (add1 pc) (sub1 ptr) tape out)
+          (if0 (equal? op 4) (self self (if0 (equal? {get} 0) (vector-ref jumps pc) (add1 pc)) ptr tape out)
+          (if0 (equal? op 5) (self self (if0 (equal? {get} 0) (add1 pc) (vector-ref jumps pc)) ptr tape out)
+          (self self (add1 pc) ptr tape (cons {get} out)))))))))))))))"""
+
+TAPES = {"list": {"tape": "(build-list 100 (fun (i) 0))",
+                  "get": "(list-ref tape ptr)",
+                  "set": "(upd upd tape ptr {value})"},
+         "vector": {"tape": "(make-vector 100 0)",
+                    "get": "(vector-ref tape ptr)",
+                    "set": "(seqn (vector-set! tape ptr {value}) tape)"}}
+
+
+def brainfuck(source, tape):
+    """ String String -> String
+        A Racython program running the given Brainfuck source on a "list" or "vector" tape and returning the
+        list of character codes it prints"""
+    ops = ["+-><[].".index(c) for c in source if c in "+-><[]."]
+    jumps = [0] * len(ops)
+    opened = []
+    for pc, op in enumerate(ops):
+        if op == 4:
+            opened.append(pc)
+        elif op == 5:
+            start = opened.pop()
+            jumps[start], jumps[pc] = pc + 1, start + 1
+    get = TAPES[tape]["get"]
+    program = BF.replace("{get}", get).replace("{tape}", TAPES[tape]["tape"])
+    while "{set[" in program:
+        start = program.index("{set[")
+        end = program.index("]}", start)
+        value = program[start + 5:end]
+        program = program[:start] + TAPES[tape]["set"].format(value=value) + program[end + 2:]
+    return program.format(ops=" ".join(map(str, ops)), jumps=" ".join(map(str, jumps)), length=len(ops))
+
+
+SOURCE_FORM = """; form {i}
+(define f{i} (fun (x y) (if0 (< x {i}) (+ x y 1.5) (list "str {i}" 'sym x)))) #| block
+comment |#
+"""
+
+
+def generatedSource(megabytes):
+    """ Number -> String
+        About the given number of megabytes of Racython source, with comments, strings and quotes"""
+    count = int(megabytes * 1e6 / len(SOURCE_FORM.format(i=0)))
+    return "".join(SOURCE_FORM.format(i=i) for i in range(count))
+
+
+def parseThroughput(source):
+    """ String -> Dictionary
+        Reads every form of source and reports the forms read, wall time and megabytes per second"""
+    start = time.perf_counter()
+    forms = sum(1 for _ in reader.read(io.StringIO(source)))
+    elapsed = time.perf_counter() - start
+    return {"forms": forms, "seconds": elapsed, "megabytes_per_second": len(source) / 1e6 / elapsed}
+
+
+def cacheThroughput(source):
+    """ String -> Dictionary
+        Caches the forms of source in a scratch program cache and reports how long loading them back takes"""
+    forms = [form.rexp for form in reader.read(io.StringIO(source))]
+    with tempfile.TemporaryDirectory() as directory:
+        programs = cache.ProgramCache(directory)
+        programs.store(source, forms)
+        start = time.perf_counter()
+        programs.load(source)
+        elapsed = time.perf_counter() - start
+        size = programs.stats()["bytes"]
+    return {"forms": len(forms), "seconds": elapsed, "megabytes_per_second": len(source) / 1e6 / elapsed,
+            "bytes": size}
+
+
+def writeSyscalls():
+    """ -> [Or Number None]
+        How many write system calls this process has made, None if the system doesn't say"""
+    try:
+        with open("/proc/self/io") as io:
+            for line in io:
+                if line.startswith("syscw:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def outputThroughput(source, limit=ports.BUFFER_SIZE):
+    """ String Number -> Dictionary
+        Runs source with its output going to a line buffered stream through a port holding up to limit characters
+        and reports how long it took, the characters written per second and the write system calls made"""
+    with open(os.devnull, "w", buffering=1) as stream:
+        port = ports.OutputPort(stream, limit)
+        before = writeSyscalls()
+        start = time.perf_counter()
+        with ports.redirect(port):
+            racython.run(source, dict(racython.topLevelEnv))
+        elapsed = time.perf_counter() - start
+        after = writeSyscalls()
+    return {"seconds": elapsed, "characters": port.written, "characters_per_second": port.written / elapsed,
+            "writes": port.flushes if before is None else after - before}
+
+
+def brainfuckSteps(source):
+    """ String -> Number
+        Number of Brainfuck instructions executed by running source"""
+    ops = [c for c in source if c in "+-><[]."]
+    jumps = {}
+    opened = []
+    for pc, op in enumerate(ops):
+        if op == "[":
+            opened.append(pc)
+        elif op == "]":
+            start = opened.pop()
+            jumps[start], jumps[pc] = pc, start
+    tape = [0] * 100
+    pc, ptr, steps = 0, 50, 0
+    while pc < len(ops):
+        op = ops[pc]
+        steps += 1
+        if op == "+":
+            tape[ptr] = (tape[ptr] + 1) % 256
+        elif op == "-":
+            tape[ptr] = (tape[ptr] - 1) % 256
+        elif op == ">":
+            ptr += 1
+        elif op == "<":
+            ptr -= 1
+        elif op == "[" and tape[ptr] == 0:
+            pc = jumps[pc]
+        elif op == "]" and tape[ptr] != 0:
+            pc = jumps[pc]
+        pc += 1
+    return steps
+
+
+def fibCalls(n):
+    """ Number -> Number
+        Number of closure applications made by FIB, counting the outer one"""
+    a, b = 1, 1
+    for _ in range(n - 1):
+        a, b = b, a + b + 1
+    return b + 1
+
+
+def structEncoding(encoding):
+    """ String -> Procedure Procedure
+        The constructor of a two field struct in the given encoding, one of STRUCTS, and the accessor of its first
+        field"""
+    if encoding == "define-struct":
+        bindings = dict(racket_functions.makeStruct("posn", ["x", "y"]))
+        return bindings["make-posn"], bindings["posn-x"]
+    if encoding == "namedtuple":
+        # What define-struct was meant to be built on before it was
+        return collections.namedtuple("posn", "x y"), lambda posn: posn[0]
+    return racket_functions.racket_list, racket_functions.racket_first
+
+
+def structThroughput(encoding, size):
+    """ String Number -> Dictionary
+        Makes size structs in the given encoding and reports the bytes each takes (its fields aside) and the
+        constructor and accessor calls per second"""
+    make, access = structEncoding(encoding)
+    zeros = [0] * size
+    # Called from map, so the loop around them costs next to nothing
+    tracemalloc.start()
+    start = time.perf_counter()
+    instances = list(map(make, zeros, zeros))
+    made = time.perf_counter() - start
+    traced = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    collections.deque(map(access, instances), 0)
+    elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "bytes_per_instance": (traced - sys.getsizeof(instances)) / size,
+            "made_per_second": size / made, "accesses_per_second": size / elapsed}
+
+
+def measure(source, calls, engine="interp", optimize=False):
+    """ String Number Engine Boolean -> Dictionary
+        Runs the given program twice, once timed and once under tracemalloc, and reports its result, wall time,
+        calls per second and peak memory"""
+    start = time.perf_counter()
+    value = racython.run(source, engine=engine, optimize=optimize)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    racython.run(source, engine=engine, optimize=optimize)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"value": value, "seconds": elapsed, "calls": calls,
+            "calls_per_second": calls / elapsed, "peak_bytes": peak}
+
+
+def report(name, result, unit="calls"):
+    """ String Dictionary String -> None
+        Prints a single benchmark result"""
+    print("%-32s %10.3fs %12.0f %s/s %10.1f KiB peak  (%s)" % (
+        name, result["seconds"], result["calls_per_second"], unit, result["peak_bytes"] / 1024.0, result["value"]))
+
+
+def workloads(n, size):
+    """ Number Number -> [ListOf (String String Number String)]
+        Name, source, number of calls or steps and unit of every program the suite runs on each engine. size is
+        the length of the list map, filter and foldr go over."""
+    steps = brainfuckSteps(HELLO)
+    # resolve and compile recurse in Python for every call, even tail calls, and tracemalloc walks the whole
+    # Python stack on every allocation, so the list workload is kept short or the traced run takes minutes
+    length = size // 50
+    closures = size // 5
+    return [("fib %d" % n, FIB.format(n=n), fibCalls(n), "calls"),
+            ("list %d" % length, LIST.format(n=length), 2 * length + 2, "calls"),
+            ("map/filter/foldr %d" % size, MAP_REDUCE.format(n=size), 2 * size, "calls"),
+            ("closures %d" % closures, CLOSURES.format(n=closures), 4 * closures, "calls")] + \
+        [("bf %s" % tape, brainfuck(HELLO, tape), steps, "steps") for tape in TAPES]
+
+
+def suite(n=20, size=100000, megabytes=10, engines=ENGINES, pipeline=1000000):
+    """ Number Number Number [ListOf Engine] Number -> Dictionary
+        Runs every workload on every engine, then the reader and the program cache, printing each result as it
+        comes and returning all of them by name"""
+    results = {}
+    for name, source, calls, unit in workloads(n, size):
+        for engine in engines:
+            result = measure(source, calls, engine)
+            if name.startswith("bf"):
+                result["value"] = "".join(map(chr, result["value"])).strip()
+            result["value"] = str(result["value"])
+            report(name + " " + engine, result, unit)
+            results[name + "/" + engine] = result
+    source = generatedSource(megabytes)
+    name = "read %.1f MB" % (len(source) / 1e6)
+    result = parseThroughput(source)
+    print("%-32s %10.3fs %12.2f MB/s  (%d forms)" % (name, result["seconds"], result["megabytes_per_second"],
+                                                   result["forms"]))
+    results[name] = result
+    name = "cached %.1f MB" % (len(source) / 1e6)
+    result = cacheThroughput(source)
+    print("%-32s %10.3fs %12.2f MB/s  (%.1f MB cached)" % (name, result["seconds"], result["megabytes_per_second"],
+                                                         result["bytes"] / 1e6))
+    results[name] = result
+    for kind, template in sorted(OUTPUT.items()):
+        for buffering, limit in (("unbuffered", 0), ("buffered", ports.BUFFER_SIZE)):
+            name = "%s %d %s" % (kind, size, buffering)
+            result = outputThroughput(template.format(n=size), limit)
+            print("%-32s %10.3fs %12.0f chars/s %10d writes" % (name, result["seconds"],
+                                                             result["characters_per_second"], result["writes"]))
+            results[name] = result
+    for encoding in STRUCTS:
+        name = "struct %d %s" % (size, encoding)
+        result = structThroughput(encoding, size)
+        print("%-32s %10.3fs %12.0f reads/s %10.0f made/s %6.1f B each" % (
+            name, result["seconds"], result["accesses_per_second"], result["made_per_second"],
+            result["bytes_per_instance"]))
+        results[name] = result
+    for kind, template in sorted(PIPELINES.items()):
+        for mode in ("eager", "fused"):
+            name = "pipeline %s %d %s" % (kind, pipeline, mode)
+            result = measure(template.format(n=pipeline), pipeline, optimize=mode == "fused")
+            result["value"] = str(result["value"])
+            report(name, result, "elements")
+            results[name] = result
+    return results
+
+
+def importTimes(module):
+    """ String -> Dictionary
+        Microseconds -X importtime reports importing module takes in a fresh process, by module imported, as
+        (self, cumulative)"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module], cwd=here,
+                             stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        fields = line.split("|")
+        if line.startswith("import time:") and fields[0][12:].strip().isdigit():
+            times[fields[2].strip()] = (int(fields[0][12:]), int(fields[1]))
+    return times
+
+
+def wallTime(arguments):
+    """ [ListOf String] -> Number
+        Seconds a fresh process running the given arguments takes"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + arguments, cwd=here, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def startup(runs=STARTUP_RUNS):
+    """ Number -> Dictionary
+        The best of runs fresh processes starting python, importing racython and running a one line program
+        with tarea3.py, printing and returning each by name"""
+    results = {}
+    results["startup python"] = {"seconds": min(wallTime(["-c", "pass"]) for _ in range(runs))}
+    best = None
+    for _ in range(runs):
+        times = importTimes("racython")
+        if best is None or times["racython"][1] < best["racython"][1]:
+            best = times
+    heaviest = sorted(best.items(), key=lambda item: item[1][0], reverse=True)[:8]
+    results["startup import racython"] = {"seconds": best["racython"][1] / 1e6,
+                                          "modules": dict((name, own / 1e6) for name, (own, _) in heaviest)}
+    results["startup tarea3.py"] = {"seconds": min(wallTime(["tarea3.py", "(+ 1 2)"]) for _ in range(runs))}
+    for name in sorted(results):
+        print("%-32s %10.3fs" % (name, results[name]["seconds"]))
+    for module, seconds in heaviest:
+        print("    %-28s %10.3fs" % (module, seconds[0] / 1e6))
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """ Dictionary Dictionary Number -> [ListOf String]
+        Names of the benchmarks that took more than tolerance longer than in the baseline. Benchmarks missing
+        from either side are skipped."""
+    regressions = []
+    for name in sorted(results):
+        if name in baseline:
+            ratio = results[name]["seconds"] / baseline[name]["seconds"]
+            slower = ratio > 1 + tolerance
+            print("%-32s %10.3fs -> %8.3fs %7.2fx%s" % (name, baseline[name]["seconds"], results[name]["seconds"],
+                                                      ratio, "  REGRESSION" if slower else ""))
+            if slower:
+                regressions.append(name)
+    return regressions
+
+
+def main(argv):
+    """ [ListOf String] -> Number
+        Runs the suite from the command line, returning the exit status"""
+    options = argparse.ArgumentParser(description="Benchmarks for the Racython interpreter")
+    options.add_argument("n", nargs="?", type=int, default=20, help="fib argument")
+    options.add_argument("--size", type=int, default=100000,
+                         help="elements for map/filter/foldr, the list and closure workloads use 1/50 and 1/5 of it")
+    options.add_argument("--pipeline", type=int, default=1000000, help="elements for the fused pipelines")
+    options.add_argument("--megabytes", type=float, default=10, help="size of the generated source to read")
+    options.add_argument("--engines", default=",".join(ENGINES), help="comma separated engines to run")
+    options.add_argument("--json", help="write the results to this file")
+    options.add_argument("--baseline", help="compare against the results stored in this file")
+    options.add_argument("--tolerance", type=float, default=0.25, help="slowdown allowed before failing")
+    options.add_argument("--startup", action="store_true", help="only measure start up")
+    args = options.parse_args(argv)
+    results = {} if args.startup else suite(args.n, args.size, args.megabytes, args.engines.split(","),
+                                           args.pipeline)
+    results.update(startup())
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump({"python": platform.python_version(), "results": results}, output, indent=1, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as stored:
+            baseline = json.load(stored)["results"]
+        print()
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("%d regressions" % len(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,324 @@
+"""
+Bulk paths for map, filter, foldl, foldr and build-list.
+
+When the function handed to one of those builtins is an arithmetic primitive (add1, +, even?, ...) or an interp
+closure whose body only does arithmetic on its parameters and numbers, it is turned into a Kernel and run over
+the whole list at once instead of going through racython.apply for every element:
+    - with NumPy installed, lists of at least ARRAY_MINIMUM elements that are only ints or only floats are run as
+      array operations, as long as the ints provably stay within int64 and nothing is divided by zero. NumPy takes
+      longer to import than the whole interpreter, so that only happens the first time a list that long comes.
+    - otherwise the Kernel is compiled into a Python lambda calling the same primitives, which skips the
+      interpreter but gives exactly the same results and errors
+Anything else, and lists shorter than MINIMUM, take the usual path.
+
+A Kernel is one of:
+    - ("arg", Number)                       a parameter
+    - ("const", Number)
+    - ("call", String, Procedure, [ListOf Kernel])
+"""
+
+import functools
+import itertools
+import racython
+
+MINIMUM = 16
+
+ARRAY_MINIMUM = 10000
+
+# Imported by getNumpy, None until then or if it isn't installed
+numpy = None
+numpyLoaded = False
+
+# Largest magnitude int math may reach on int64 arrays, and ints that convert to floats exactly
+INT_LIMIT = 1 << 62
+EXACT = 1 << 53
+
+ARITY = {"+": 2, "-": 2, "*": 2, "/": 2, "modulo": 2, "add1": 1, "sub1": 1, "<": 2, ">": 2, "<=": 2, ">=": 2,
+         "equal?": 2, "odd?": 1, "even?": 1}
+
+COMPARISONS = {"<", ">", "<=", ">=", "equal?"}
+
+primitives = {}
+
+
+class Unsupported(Exception):
+    """ Raised when a function or a list can't take a bulk path"""
+    pass
+
+
+def getNumpy():
+    """ -> [Or Module None]
+        NumPy, imported the first time it is asked for, None if it isn't installed"""
+    global numpy, numpyLoaded
+    if not numpyLoaded:
+        numpyLoaded = True
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+    return numpy
+
+
+def primitiveName(function):
+    """ Procedure -> [Or String None]
+        The name of the topLevelEnv primitive function is, if it is one bulk knows"""
+    if not primitives:
+        for name in ARITY:
+            primitives[id(racython.topLevelEnv[name])] = (name, racython.topLevelEnv[name])
+    found = primitives.get(id(function))
+    if found is None or found[1] is not function:
+        return None
+    return found[0]
+
+
+def kernel(function, arity):
+    """ Procedure Number -> Kernel
+        The Kernel computing function for the given number of arguments, raises Unsupported if there is none"""
+    name = primitiveName(function)
+    if name is not None:
+        if ARITY[name] != arity:
+            raise Unsupported()
+        return ("call", name, function, [("arg", i) for i in range(arity)])
+    if type(function) is not racython.closure or len(function.params) != arity:
+        raise Unsupported()
+    params = dict((param, i) for i, param in enumerate(function.params))
+    env = function.env
+
+    def translate(rexp):
+        if isinstance(rexp, (int, float)) and not isinstance(rexp, bool):
+            return ("const", rexp)
+        if isinstance(rexp, str):
+            if rexp in params:
+                return ("arg", params[rexp])
+            # The closure's env is a snapshot, so a number it holds now is the number it will always hold
+            try:
+                value = env[rexp]
+            except KeyError:
+                raise Unsupported()
+            if type(value) is int or type(value) is float:
+                return ("const", value)
+            raise Unsupported()
+        if not isinstance(rexp, list) or not rexp or not isinstance(rexp[0], str) or rexp[0] in params:
+            raise Unsupported()
+        try:
+            name = primitiveName(env[rexp[0]])
+        except KeyError:
+            raise Unsupported()
+        if name is None or ARITY[name] != len(rexp) - 1:
+            raise Unsupported()
+        return ("call", name, env[rexp[0]], [translate(arg) for arg in rexp[1:]])
+    return translate(function.body)
+
+
+def uses(node, index):
+    """ Kernel Number -> Boolean
+        Whether node reads the given parameter"""
+    if node[0] == "arg":
+        return node[1] == index
+    if node[0] == "call":
+        return any(uses(arg, index) for arg in node[3])
+    return False
+
+
+def compilePython(node, arity):
+    """ Kernel Number -> Procedure
+        A Python lambda computing node by calling the same primitives"""
+    namespace = {}
+
+    def source(node):
+        if node[0] == "arg":
+            return "a%d" % node[1]
+        name = "v%d" % len(namespace)
+        if node[0] == "const":
+            namespace[name] = node[1]
+            return name
+        namespace[name] = node[2]
+        return "%s(%s)" % (name, ", ".join(source(arg) for arg in node[3]))
+    body = source(node)
+    return eval("lambda %s: %s" % (", ".join("a%d" % i for i in range(arity)), body), namespace)
+
+
+def bounds(node, columns):
+    """ Kernel [ListOf (String Number Number)] -> (String Number Number)
+        The kind ("int", "float" or "bool") of node's values and, for ints, the range they fall in, given the
+        same for each column. Raises Unsupported if int64 arrays wouldn't give Python's results."""
+    if node[0] == "arg":
+        return columns[node[1]]
+    if node[0] == "const":
+        value = node[1]
+        if type(value) is float:
+            return "float", None, None
+        if abs(value) >= INT_LIMIT:
+            raise Unsupported()
+        return "int", value, value
+    name = node[1]
+    args = [bounds(arg, columns) for arg in node[3]]
+    kinds = set(kind for kind, _, _ in args)
+    # bool arithmetic in NumPy is logic, not counting
+    if "bool" in kinds:
+        raise Unsupported()
+    if name in COMPARISONS:
+        # Python compares ints with floats exactly, NumPy converts the int first
+        if kinds == {"int", "float"}:
+            for kind, low, high in args:
+                if kind == "int" and max(abs(low), abs(high)) >= EXACT:
+                    raise Unsupported()
+        return "bool", 0, 1
+    if name == "odd?" or name == "even?":
+        return "bool", 0, 1
+    if name == "/":
+        for kind, low, high in args:
+            if kind == "int" and max(abs(low), abs(high)) >= EXACT:
+                raise Unsupported()
+        return "float", None, None
+    if "float" in kinds:
+        return "float", None, None
+    if name == "add1":
+        low, high = args[0][1] + 1, args[0][2] + 1
+    elif name == "sub1":
+        low, high = args[0][1] - 1, args[0][2] - 1
+    elif name == "+":
+        low, high = args[0][1] + args[1][1], args[0][2] + args[1][2]
+    elif name == "-":
+        low, high = args[0][1] - args[1][2], args[0][2] - args[1][1]
+    elif name == "*":
+        products = [a * b for a in args[0][1:] for b in args[1][1:]]
+        low, high = min(products), max(products)
+    else:
+        # modulo is smaller than its divisor
+        limit = max(abs(args[1][1]), abs(args[1][2]))
+        low, high = -limit, limit
+    if max(abs(low), abs(high)) >= INT_LIMIT:
+        raise Unsupported()
+    return "int", low, high
+
+
+def evaluateArrays(node, arrays):
+    """ Kernel [ListOf Array] -> Array
+        Computes node over whole arrays at once"""
+    if node[0] == "arg":
+        return arrays[node[1]]
+    if node[0] == "const":
+        return node[1]
+    name = node[1]
+    args = [evaluateArrays(arg, arrays) for arg in node[3]]
+    if name == "+":
+        return numpy.add(args[0], args[1])
+    if name == "-":
+        return numpy.subtract(args[0], args[1])
+    if name == "*":
+        return numpy.multiply(args[0], args[1])
+    if name == "/" or name == "modulo":
+        # Python raises for these, leave them to the Python path
+        if numpy.any(numpy.equal(args[1], 0)):
+            raise Unsupported()
+        if name == "/":
+            return numpy.true_divide(args[0], args[1])
+        return numpy.remainder(args[0], args[1])
+    if name == "add1":
+        return numpy.add(args[0], 1)
+    if name == "sub1":
+        return numpy.subtract(args[0], 1)
+    if name == "odd?":
+        return numpy.equal(numpy.remainder(args[0], 2), 1)
+    if name == "even?":
+        return numpy.equal(numpy.remainder(args[0], 2), 0)
+    return {"<": numpy.less, ">": numpy.greater, "<=": numpy.less_equal, ">=": numpy.greater_equal,
+            "equal?": numpy.equal}[name](args[0], args[1])
+
+
+def column(values):
+    """ [ListOf Value] -> (String Number Number) Array
+        The kind and range of a list of only ints or only floats and its NumPy array, raises Unsupported for
+        anything else"""
+    kinds = set(map(type, values))
+    if kinds == {int}:
+        low, high = min(values), max(values)
+        if max(abs(low), abs(high)) >= INT_LIMIT:
+            raise Unsupported()
+        return ("int", low, high), numpy.array(values, dtype=numpy.int64)
+    if kinds == {float}:
+        return ("float", None, None), numpy.array(values, dtype=numpy.float64)
+    raise Unsupported()
+
+
+def compute(node, values):
+    """ Kernel [ListOf Value] -> [ListOf Value]
+        node applied to every value, as one array operation if it can be"""
+    if len(values) >= ARRAY_MINIMUM and uses(node, 0) and getNumpy() is not None:
+        try:
+            kind, array = column(values)
+            bounds(node, [kind])
+            return evaluateArrays(node, [array]).tolist()
+        except Unsupported:
+            pass
+    return list(map(compilePython(node, 1), values))
+
+
+def mapped(function, values):
+    """ Procedure [ListOf Value] -> [Or [ListOf Value] None]
+        function applied to every value, None if it has to be done one apply at a time"""
+    if len(values) < MINIMUM:
+        return None
+    try:
+        return compute(kernel(function, 1), values)
+    except Unsupported:
+        return None
+
+
+def filtered(function, values):
+    """ Procedure [ListOf Value] -> [Or [ListOf Value] None]
+        The values function holds for, None if it has to be done one apply at a time"""
+    if len(values) < MINIMUM:
+        return None
+    try:
+        keep = compute(kernel(function, 1), values)
+    except Unsupported:
+        return None
+    return list(itertools.compress(values, keep))
+
+
+def built(count, function):
+    """ Number Procedure -> [Or [ListOf Value] None]
+        function applied to 0 ... count - 1, None if it has to be done one apply at a time"""
+    if type(count) is not int or count < MINIMUM:
+        return None
+    try:
+        node = kernel(function, 1)
+    except Unsupported:
+        return None
+    if ARRAY_MINIMUM <= count < INT_LIMIT and uses(node, 0) and getNumpy() is not None:
+        try:
+            bounds(node, [("int", 0, count - 1)])
+            return evaluateArrays(node, [numpy.arange(count, dtype=numpy.int64)]).tolist()
+        except Unsupported:
+            pass
+    return list(itertools.starmap(compilePython(node, 1), zip(range(count))))
+
+
+def folded(function, base, values, right=False):
+    """ Procedure Value [ListOf Value] Boolean -> [Or (Value) None]
+        The fold of values, in a tuple, or None if it has to be done one apply at a time. Only folds that add or
+        multiply the accumulator with a number computed from the element alone are done in bulk: the elements
+        are computed in one go, then reduced in the fold's order by the same + or *."""
+    if len(values) < MINIMUM:
+        return None
+    try:
+        node = kernel(function, 2)
+    except Unsupported:
+        return None
+    if node[0] != "call" or node[1] not in ("+", "*"):
+        return None
+    left, other = node[3]
+    if left == ("arg", 1):
+        left, other = other, left
+    if other != ("arg", 1) or uses(left, 1):
+        return None
+    elements = values if left == ("arg", 0) else compute(left, values)
+    # + and * only don't care which side the accumulator is on, or in which order they go, for numbers
+    if not set(map(type, elements)) <= {int, float} or type(base) not in (int, float):
+        return None
+    if right:
+        elements = reversed(elements)
+    return (functools.reduce(node[2], elements, base),)
@@ -0,0 +1,156 @@
+"""
+On disk cache of parsed programs for racython.runFile.
+
+An entry holds the top level RExps of one source file, marshalled, in a file named after a hash of the source,
+the version of the entries' format, the reader that parsed it (a hash of reader.py, so a change to the reader never
+gets forms it would no longer read that way) and the Python version (marshal's format depends on it). When the
+cache grows past its size limit the least recently used entries are removed.
+
+The cache lives in $RACYTHON_CACHE, or ~/.cache/racython if that isn't set.
+"""
+
+import marshal
+import os
+import sys
+
+# Of the format of the entries, the reader's own version is in the key too
+VERSION = "1"
+
+MAX_BYTES = 64 * 1024 * 1024
+
+SUFFIX = ".rkc"
+
+readerHash = None
+
+
+def readerVersion():
+    """ -> String
+        A hash of the reader's source, worked out the first time it is needed"""
+    global readerHash
+    if readerHash is None:
+        import hashlib
+        import reader
+        with open(reader.__file__, "rb") as source:
+            readerHash = hashlib.sha256(source.read()).hexdigest()
+    return readerHash
+
+
+def defaultDirectory():
+    """ -> String
+        Where the cache lives unless told otherwise"""
+    return os.environ.get("RACYTHON_CACHE") or os.path.join(os.path.expanduser("~"), ".cache", "racython")
+
+
+class ProgramCache(object):
+    """ A directory of parsed programs keyed by their source, with hit and miss counters"""
+
+    def __init__(self, directory=None, maxBytes=MAX_BYTES):
+        self.directory = directory or defaultDirectory()
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, source):
+        """ String -> String
+            The file the entry for source lives in"""
+        # Imported here so programs that never use the cache don't pay for it
+        import hashlib
+        digest = hashlib.sha256()
+        digest.update(("%s:%s:%d.%d:" % (VERSION, readerVersion(), sys.version_info[0],
+                                         sys.version_info[1])).encode())
+        digest.update(source.encode("utf-8", "surrogatepass"))
+        return os.path.join(self.directory, digest.hexdigest() + SUFFIX)
+
+    def load(self, source):
+        """ String -> [Or [ListOf RExp] None]
+            The parsed forms of source if they are cached, None otherwise"""
+        path = self.path(source)
+        try:
+            with open(path, "rb") as entry:
+                # marshal.load reads the file in small pieces, reading it whole first is several times faster
+                forms = marshal.loads(entry.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Mark the entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return forms
+
+    def store(self, source, forms):
+        """ String [ListOf RExp] -> None
+            Caches the parsed forms of source, then evicts old entries if the cache is too big. Failing to write
+            just means the next run parses again."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Imported here since loading, what most runs do, doesn't need it
+            import tempfile
+            handle, temporary = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        except OSError:
+            return
+        try:
+            with os.fdopen(handle, "wb") as entry:
+                marshal.dump(forms, entry)
+            os.replace(temporary, self.path(source))
+        except (OSError, ValueError):
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    def entries(self):
+        """ -> [ListOf (String Number Number)]
+            Path, size and last use of every entry, least recently used first"""
+        found = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return found
+        for name in names:
+            if name.endswith(SUFFIX):
+                path = os.path.join(self.directory, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                found.append((path, info.st_size, info.st_mtime))
+        found.sort(key=lambda entry: entry[2])
+        return found
+
+    def evict(self):
+        """ -> None
+            Removes the least recently used entries until the cache fits in maxBytes"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        """ -> None
+            Removes every entry"""
+        for path, _, _ in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        """ -> Dictionary
+            Hits and misses since this cache was created, and the entries and bytes it holds right now"""
+        entries = self.entries()
+        return {"hits": self.hits, "misses": self.misses, "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries)}
+
+
+programs = ProgramCache()
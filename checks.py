@@ -0,0 +1,169 @@
+"""
+A check-expect test runner for Racython.
+
+runFile runs a program the way DrRacket does in its test mode: every top level form but check-expect runs first,
+in order, and the checks run after them all. Checks don't stop at the first one that fails, each is run on its
+own and the Summary tells how many passed, how long each took and what went wrong with the ones that didn't.
+
+With more than one core and at least MINIMUM checks, they are split into chunks that run on parallel's pool of
+workers. The environment the definitions left is pickled once and every chunk runs on its own copy of it; if it
+can't be pickled (it holds functions of the compile engine) the checks run in this process. Either way each check
+runs in a frame of its own, so a define inside one isn't seen by the others, and what the checks of a chunk
+display is written to the current output port here once the chunk is back, in the order of the checks.
+
+A Check is a Check(Number Number Boolean Value Value String Number): the line and column the check-expect starts
+at, whether it passed, the actual and expected values, the error evaluating it raised (None if it didn't) and the
+seconds it took.
+
+python checks.py program.rkt [--engine ENGINE] [--timings] runs the program's tests, exiting with 1 if any failed.
+"""
+
+import collections
+import io
+import pickle
+import sys
+import time
+import parallel
+import ports
+import racython
+import reader
+import resolver
+
+Check = collections.namedtuple("Check", "line column passed actual expected error seconds")
+
+MINIMUM = 8
+
+
+class Summary(object):
+    """ The outcome of every check in a program"""
+
+    def __init__(self, checks, seconds):
+        self.checks = checks
+        self.seconds = seconds
+        self.failed = [check for check in checks if not check.passed]
+
+    def report(self, timings=False):
+        """ Boolean -> String
+            The summary DrRacket shows after running tests, with timings also how long each check took"""
+        total = len(self.checks)
+        if not total:
+            lines = ["This program has no tests."]
+        elif not self.failed:
+            lines = ["The only test passed!" if total == 1 else "All %d tests passed!" % total]
+        else:
+            lines = ["Ran %d test%s." % (total, "" if total == 1 else "s"),
+                     "%d of the %d tests failed." % (len(self.failed), total), "", "Check failures:"]
+            for check in self.failed:
+                if check.error is not None:
+                    lines.append("        check-expect encountered the following error instead of the expected "
+                                 "value, %s." % (check.expected,))
+                    lines.append("           :: %s" % check.error)
+                else:
+                    lines.append("        Actual value %s differs from %s, the expected value." %
+                                 (check.actual, check.expected))
+                lines.append("at line %d, column %d" % (check.line, check.column))
+        if timings:
+            lines.append("")
+            for check in sorted(self.checks, key=lambda check: check.seconds, reverse=True):
+                lines.append("%10.3fs  line %d, column %d%s" % (check.seconds, check.line, check.column,
+                                                              "" if check.passed else "  failed"))
+            lines.append("%10.3fs  in all" % self.seconds)
+        return "\n".join(lines)
+
+
+def isCheck(rexp):
+    """ RExp -> Boolean
+        Whether rexp is a check-expect"""
+    return isinstance(rexp, list) and len(rexp) == 3 and rexp[0] == 'check-expect'
+
+
+def runCheck(form, env, engine="interp"):
+    """ Form Env String -> Check
+        Runs the check-expect form in a frame of its own on top of env"""
+    start = time.perf_counter()
+    actual = expected = error = None
+    try:
+        actual = racython.runRExp(form.rexp[1], env.child(), engine)[0]
+        expected = racython.runRExp(form.rexp[2], env.child(), engine)[0]
+    except Exception as e:
+        error = "%s: %s" % (type(e).__name__, e)
+    # interp exits on a free identifier, that only ends this check, the resolver can tell which one it was
+    except SystemExit as e:
+        error = "%s: %s" % (type(e).__name__, e)
+        try:
+            resolver.resolve(form.rexp, env, strict=True)
+        except racython.FreeIdentifierError as free:
+            error = str(free)
+    passed = error is None and actual == expected
+    return Check(form.line, form.column, passed, actual, expected, error, time.perf_counter() - start)
+
+
+def work(blob, forms, engine):
+    """ Bytes [ListOf Form] String -> [ListOf Check] String
+        runCheck in a worker, for every form on a copy of the pickled environment, and what they displayed"""
+    env = pickle.loads(blob)
+    results = []
+    with ports.redirect(io.StringIO()) as (output, _):
+        checks = [runCheck(form, env, engine) for form in forms]
+    for check in checks:
+        # Values that can't go back to the parent are sent as they print
+        try:
+            pickle.dumps(check)
+        except Exception:
+            check = check._replace(actual=str(check.actual), expected=str(check.expected))
+        results.append(check)
+    return results, output.stream.getvalue()
+
+
+def runChecks(forms, engine="interp", env=None):
+    """ [ListOf Form] String Env -> Summary
+        Runs the given check-expect forms in env, on the pool if it is worth it"""
+    start = time.perf_counter()
+    env = racython.toEnv(dict(racython.topLevelEnv) if env is None else env)
+    blob = None
+    if len(forms) >= MINIMUM and parallel.WORKERS > 1 and not parallel.inWorker:
+        try:
+            blob = pickle.dumps(env, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            pass
+    if blob is None:
+        results = [runCheck(form, env, engine) for form in forms]
+    else:
+        size = -(-len(forms) // (parallel.WORKERS * parallel.CHUNKS))
+        futures = [parallel.getPool().submit(work, blob, forms[i:i + size], engine)
+                   for i in range(0, len(forms), size)]
+        results = []
+        for future in futures:
+            chunk, output = future.result()
+            ports.currentOutput.write(output)
+            results.extend(chunk)
+    return Summary(results, time.perf_counter() - start)
+
+
+def runFile(file, engine="interp", env=None, optimize=False):
+    """ String -> [ListOf Value] Summary
+        Runs the given multi form program with its check-expects left for last, in a fresh copy of topLevelEnv
+        unless given env, and returns the values of the other forms and the Summary of the checks"""
+    env = racython.toEnv(dict(racython.topLevelEnv) if env is None else env)
+    forms = list(reader.read(io.StringIO(file)))
+    checks = [form for form in forms if isCheck(form.rexp)]
+    values = list(racython.runForms([form.rexp for form in forms if not isCheck(form.rexp)], engine, env,
+                                    optimize))
+    return values, runChecks(checks, engine, env)
+
+
+if __name__ == "__main__":
+    # racython imports this module, so everything only the command line needs is imported here
+    import argparse
+    options = argparse.ArgumentParser(description="Runs the check-expects of a Racython program")
+    options.add_argument("program", help="file to run, - for stdin")
+    options.add_argument("--engine", default="interp")
+    options.add_argument("--timings", action="store_true", help="also show how long each check took")
+    args = options.parse_args()
+    source = sys.stdin.read() if args.program == "-" else open(args.program).read()
+    values, summary = runFile(source, args.engine)
+    ports.flush()
+    for value in values:
+        print(value)
+    print(summary.report(args.timings))
+    sys.exit(1 if summary.failed else 0)
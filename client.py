@@ -0,0 +1,96 @@
+"""
+Client for the Racython evaluation server (see server).
+
+A Client keeps one connection to the server open, so every evaluate after the first only costs a round trip. It
+only needs the standard library, so starting it doesn't load the interpreter.
+
+    python client.py [--session NAME] [--engine ENGINE] [--timeout SECONDS] "<racket expression>"
+    python client.py --file program.rkt
+
+prints what the program displayed and then the value of each form, like tarea3.py, and exits with 1 if it failed.
+
+A Response is a Dictionary with:
+    - "values": [ListOf String], the value of each form that ran, as tarea3 prints it
+    - "output": String, what the forms displayed
+    - "error": [Or String None], why the forms after the last value didn't run
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+
+def defaultSocket():
+    """ -> String
+        Where the server listens unless told otherwise"""
+    return os.environ.get("RACYTHON_SOCKET") or os.path.join(os.path.expanduser("~"), ".cache", "racython",
+                                                             "server.sock")
+
+
+class Client(object):
+    """ A connection to the server"""
+
+    def __init__(self, path=None):
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.connect(path or defaultSocket())
+        self.responses = self.connection.makefile("rb")
+
+    def request(self, request):
+        """ Dictionary -> Dictionary
+            Sends one request and waits for its response"""
+        self.connection.sendall(json.dumps(request).encode() + b"\n")
+        line = self.responses.readline()
+        if not line:
+            raise ConnectionError("The server closed the connection")
+        return json.loads(line)
+
+    def evaluate(self, source, session="default", engine=None, timeout=None, input=None):
+        """ String String String Number String -> Response
+            Runs every form in source in the given session, creating it if it doesn't exist yet. input is what
+            read gets to read."""
+        request = {"source": source, "session": session}
+        for key, value in (("engine", engine), ("timeout", timeout), ("input", input)):
+            if value is not None:
+                request[key] = value
+        return self.request(request)
+
+    def close(self, session="default"):
+        """ String -> None
+            Drops the given session and everything defined in it"""
+        self.request({"close": session})
+
+    def disconnect(self):
+        self.responses.close()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.disconnect()
+        return False
+
+
+if __name__ == "__main__":
+    options = argparse.ArgumentParser(description="Evaluates Racython on a running server")
+    options.add_argument("expression", nargs="?")
+    options.add_argument("--file", help="run this file instead, - for stdin")
+    options.add_argument("--session", default="default")
+    options.add_argument("--engine")
+    options.add_argument("--timeout", type=float)
+    options.add_argument("--socket")
+    args = options.parse_args()
+    if args.file is not None:
+        source = sys.stdin.read() if args.file == "-" else open(args.file).read()
+    else:
+        source = args.expression
+    with Client(args.socket) as client:
+        response = client.evaluate(source, args.session, args.engine, args.timeout)
+    sys.stdout.write(response["output"])
+    for value in response["values"]:
+        print(value)
+    if response["error"] is not None:
+        print(response["error"], file=sys.stderr)
+        sys.exit(1)
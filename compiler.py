@@ -0,0 +1,236 @@
+"""
+Closure compilation for Racython.
+
+compile turns a Resolved tree (see resolver) into a tree of Python closures, one per node, each taking the Frame
+to run in and returning the node's Value. All the dispatching on node types happens once, here, so running the
+program is just calling the root closure.
+
+A Compiled is a [Frame -> Value]
+"""
+
+import racython
+from resolver import Const, Local, Global, Free, If0, Fun, SetLocal, SetGlobal, With, Seqn, App, UNSET, capture
+
+
+class Closure(object):
+    """ A compiled closure over a Frame. Calling it runs the compiled body in a fresh frame holding the
+        arguments."""
+    __slots__ = ("body", "arity", "size", "frame", "exact")
+
+    def __init__(self, body, arity, size, frame):
+        self.body = body
+        self.arity = arity
+        self.size = size
+        self.frame = frame
+        # The only argument count whose frame is just the arguments, when the body has no locals of its own
+        self.exact = arity if arity == size else -1
+
+    def __call__(self, *args):
+        frame = [self.frame]
+        frame.extend(args[:self.arity])
+        if len(frame) <= self.size:
+            frame.extend([UNSET] * (self.size + 1 - len(frame)))
+        return self.body(frame)
+
+
+def compile(node):
+    """ Resolved -> Compiled
+        Compiles the resolved tree into nested Python closures"""
+    kind = type(node)
+    if kind is Const:
+        return compileConst(node)
+    if kind is Local:
+        return compileLocal(node)
+    if kind is Global:
+        return compileGlobal(node)
+    if kind is Free:
+        return compileFree(node)
+    if kind is If0:
+        return compileIf0(node)
+    if kind is Fun:
+        return compileFun(node)
+    if kind is SetLocal:
+        return compileSetLocal(node)
+    if kind is SetGlobal:
+        return compileSetGlobal(node)
+    if kind is With:
+        return compileWith(node)
+    if kind is Seqn:
+        return compileSeqn(node)
+    if kind is App:
+        return compileApp(node)
+    raise racython.InternalRacythonException("Unknown resolved node " + repr(node))
+
+
+def compileConst(node):
+    value = node.value
+
+    def const(frame):
+        return value
+    return const
+
+
+def compileLocal(node):
+    index = node.index
+    fallback = compile(node.fallback)
+    if node.depth == 0:
+        def local(frame):
+            value = frame[index]
+            if value is UNSET:
+                return fallback(frame)
+            return value
+    elif node.depth == 1:
+        def local(frame):
+            value = frame[0][index]
+            if value is UNSET:
+                return fallback(frame)
+            return value
+    else:
+        depth = node.depth
+
+        def local(frame):
+            target = frame
+            for _ in range(depth):
+                target = target[0]
+            value = target[index]
+            if value is UNSET:
+                return fallback(frame)
+            return value
+    return local
+
+
+def compileGlobal(node):
+    name = node.name
+    depth = node.depth
+
+    def globalRef(frame):
+        for _ in range(depth):
+            frame = frame[0]
+        try:
+            return frame[name]
+        except KeyError:
+            raise racython.FreeIdentifierError(name)
+    return globalRef
+
+
+def compileFree(node):
+    name = node.name
+
+    def free(frame):
+        raise racython.FreeIdentifierError(name)
+    return free
+
+
+def compileIf0(node):
+    test = compile(node.test)
+    then = compile(node.then)
+    other = compile(node.other)
+
+    def if0(frame):
+        if test(frame):
+            return then(frame)
+        return other(frame)
+    return if0
+
+
+def compileFun(node):
+    body = compile(node.body)
+    arity = node.arity
+    size = node.size
+    mutable = node.mutable
+
+    def fun(frame):
+        return Closure(body, arity, size, capture(frame, mutable))
+    return fun
+
+
+def compileSetLocal(node):
+    index = node.index
+    value = compile(node.value)
+
+    def setLocal(frame):
+        frame[index] = value(frame)
+    return setLocal
+
+
+def compileSetGlobal(node):
+    name = node.name
+    value = compile(node.value)
+
+    def setGlobal(frame):
+        frame[name] = value(frame)
+    return setGlobal
+
+
+def compileWith(node):
+    binding = compile(node.binding)
+    body = compile(node.body)
+    padding = [UNSET] * (node.size - 1)
+    if node.inner:
+        def withInner(frame):
+            local = [frame, UNSET]
+            local.extend(padding)
+            local[1] = binding(local)
+            return body(local)
+        return withInner
+
+    def withOuter(frame):
+        local = [frame, binding(frame)]
+        local.extend(padding)
+        return body(local)
+    return withOuter
+
+
+def compileSeqn(node):
+    first = compile(node.first)
+    second = compile(node.second)
+
+    def seqn(frame):
+        first(frame)
+        return second(frame)
+    return seqn
+
+
+def compileApp(node):
+    function = compile(node.function)
+    args = [compile(arg) for arg in node.args]
+    # Calls to compiled closures taking exactly these arguments and no other locals build the callee's frame
+    # directly, everything else goes through __call__
+    if len(args) == 0:
+        def app0(frame):
+            f = function(frame)
+            if type(f) is Closure and f.exact == 0:
+                return f.body([f.frame])
+            return f()
+        return app0
+    if len(args) == 1:
+        arg0, = args
+
+        def app1(frame):
+            f = function(frame)
+            if type(f) is Closure and f.exact == 1:
+                return f.body([f.frame, arg0(frame)])
+            return f(arg0(frame))
+        return app1
+    if len(args) == 2:
+        arg0, arg1 = args
+
+        def app2(frame):
+            f = function(frame)
+            if type(f) is Closure and f.exact == 2:
+                return f.body([f.frame, arg0(frame), arg1(frame)])
+            return f(arg0(frame), arg1(frame))
+        return app2
+    if len(args) == 3:
+        arg0, arg1, arg2 = args
+
+        def app3(frame):
+            f = function(frame)
+            if type(f) is Closure and f.exact == 3:
+                return f.body([f.frame, arg0(frame), arg1(frame), arg2(frame)])
+            return f(arg0(frame), arg1(frame), arg2(frame))
+        return app3
+
+    def app(frame):
+        return function(frame)(*[arg(frame) for arg in args])
+    return app
@@ -0,0 +1,157 @@
+"""
+Incremental re-evaluation of a Racython program.
+
+A Session runs a program, then runs edited versions of it again re-running only what the edit could have changed.
+For every top level form it records which names the form reads (its free variables) and which it writes (the
+names it defines or sets outside any fun or with), the form's value and the values it left in what it wrote.
+
+Every write gets a token. Running a form again gives new tokens to everything it writes, reusing it puts back the
+values and tokens it left last time. When a program is run again, each form is matched with a form of the
+previous run that reads the same (the first one not matched yet), and it is reused if every name it reads still
+has the token it had then. So a form that was edited runs again, as does everything that reads what it writes,
+and everything that reads what those write, and so on, and the rest is taken from the snapshot.
+
+Some forms always run again:
+    - those with OUTPUT or INPUT, so the program still displays what it did and reads what it is given
+    - those that can MUTATE a vector, which also stops the forms that wrote the names they read from being
+      reused the next time, since their values may have changed since they were saved
+A form has an effect if it refers to a primitive with it, or to a name written by a form that has it, so a fun
+that displays makes the forms calling it display too.
+"""
+
+import io
+import marshal
+import racket_functions
+import racython
+import reader
+
+OUTPUT = "output"
+INPUT = "input"
+MUTATE = "mutate"
+
+EFFECTS = {"display": OUTPUT, "write-string": OUTPUT, "newline": OUTPUT, "flush-output": OUTPUT, "read": INPUT,
+           "read-line": INPUT, "vector-set!": MUTATE}
+
+KEYWORDS = {"if0", "seqn"}
+
+
+class Record(object):
+    """ What a Session knows about one top level form it ran"""
+    __slots__ = ("key", "reads", "inputs", "writes", "tokens", "saved", "effects", "value")
+
+    def __init__(self, key, reads, writes):
+        self.key = key
+        self.reads = reads
+        self.writes = writes
+        # The token of every name read when it ran, and of every name written after
+        self.inputs = {}
+        self.tokens = {}
+        self.effects = set()
+        # The value of the form, and the value it left in every name written
+        self.value = None
+        self.saved = {}
+
+
+def names(rexp, bound, reads, writes, top=True):
+    """ RExp [SetOf Variable] [SetOf Variable] [SetOf Variable] Boolean -> None
+        Adds the free variables of rexp to reads and, if it runs at the top level, what it defines or sets to
+        writes"""
+    if isinstance(rexp, str):
+        if rexp not in bound and not rexp.startswith("\""):
+            reads.add(rexp)
+        return
+    if not isinstance(rexp, list) or not rexp:
+        return
+    head = rexp[0]
+    if head == 'fun' and len(rexp) == 3:
+        names(rexp[2], bound | set(rexp[1]), reads, writes, False)
+    elif (head == 'define' or head == 'set') and len(rexp) == 3:
+        if top:
+            writes.add(rexp[1])
+        names(rexp[2], bound, reads, writes, top)
+    elif head == 'define-struct' and len(rexp) == 3:
+        if top:
+            writes.update(racket_functions.structNames(rexp[1], rexp[2]))
+    elif head == 'with' and len(rexp) == 3:
+        # The value is run in the new frame, but before the name is bound in it
+        names(rexp[1][1], bound, reads, writes, False)
+        names(rexp[2], bound | {rexp[1][0]}, reads, writes, False)
+    else:
+        for sub in rexp[1:] if head in KEYWORDS else rexp:
+            names(sub, bound, reads, writes, top)
+
+
+class Session(object):
+    """ A program run before, and what it needs to run an edited version of it again"""
+
+    def __init__(self, engine="interp", env=None):
+        self.engine = engine
+        self.base = racython.topLevelEnv if env is None else env
+        self.records = []
+        # Names read by a form that could mutate them in the last run
+        self.mutated = set()
+        self.env = None
+        self.reused = 0
+        self.ran = 0
+
+    def run(self, forms):
+        """ [ListOf RExp] -> [Generator Value]
+            Runs the given top level forms in a fresh frame on top of the session's env, reusing what it can from
+            the last run, and yields the value of each"""
+        previous = {}
+        for record in self.records:
+            previous.setdefault(record.key, []).append(record)
+        # Every write goes into the innermost frame, so the session's env is never written to
+        env = self.env = racython.toEnv(self.base).child()
+        tokens = {}
+        effects = {}
+        mutated = set()
+        records = []
+        self.reused = self.ran = 0
+        try:
+            for rexp in forms:
+                key = marshal.dumps(rexp)
+                matches = previous.get(key)
+                old = matches.pop(0) if matches else None
+                if old is not None:
+                    reads, writes = old.reads, old.writes
+                else:
+                    reads, writes = set(), set()
+                    names(rexp, set(), reads, writes)
+                record = Record(key, reads, writes)
+                for name in reads:
+                    record.inputs[name] = tokens.get(name)
+                    if name in effects:
+                        record.effects |= effects[name]
+                    elif name in EFFECTS and name not in tokens:
+                        record.effects.add(EFFECTS[name])
+                if old is not None and not record.effects and old.inputs == record.inputs and \
+                        not writes & self.mutated:
+                    self.reused += 1
+                    record.value, record.tokens, record.saved = old.value, old.tokens, old.saved
+                    for name, value in old.saved.items():
+                        env[name] = value
+                else:
+                    self.ran += 1
+                    record.value = racython.runRExp(rexp, env, self.engine)[0]
+                    for name in writes:
+                        record.tokens[name] = object()
+                        # A define in a branch that didn't run left nothing
+                        if name in env:
+                            record.saved[name] = env[name]
+                if MUTATE in record.effects:
+                    mutated |= reads
+                for name in writes:
+                    tokens[name] = record.tokens[name]
+                    effects[name] = record.effects
+                records.append(record)
+                yield record.value
+        finally:
+            # Up to where it stopped, if a form failed
+            self.records = records
+            self.mutated = mutated
+
+    def runFile(self, file):
+        """ String -> [Generator Value]
+            run for the forms of the given multi form program"""
+        return self.run([form.rexp for form in reader.read(io.StringIO(file))])
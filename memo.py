@@ -0,0 +1,220 @@
+"""
+Memoization of pure Racython functions.
+
+(memo f) or (memo f size) wraps a procedure in a Memo: calls with arguments seen before return the cached value
+instead of running f again. Each Memo keeps its own LRU cache of at most size results (DEFAULT_SIZE by default).
+Arguments are keyed by value. A call only uses the cache if every argument can be keyed: numbers, strings,
+booleans, lists of those, other Memos and the pure primitives. Anything else (a vector, a plain closure) could
+change or do something, so that call just runs f.
+
+memoize rewrites a program so every named fun that is pure is wrapped in memo. A fun is pure when its body, funs
+inside it included, has no define or set and only refers to its own parameters and locals, to the PURE
+primitives and to top level functions that are themselves pure and defined only once. That leaves out display,
+read, error, the vector constructors (each call must get a fresh vector) and vector-set!.
+"""
+
+import collections
+import weakref
+import racython
+import racket_functions
+
+DEFAULT_SIZE = 1024
+
+PURE = {"+", "-", "/", "*", "or", "and", "not", "equal?", ">", "<", ">=", "<=", "list", "cons", "empty?", "empty",
+        "first", "second", "third", "rest", "reverse", "#true", "#false", "map", "filter", "foldr", "foldl",
+        "ormap", "andmap", "odd?", "even?", "list->string", "integer->char", "explode", "build-list", "length",
+        "list-ref", "vector-ref", "vector-length", "vector->list", "add1", "sub1", "modulo", "pmap",
+        "pbuild-list", "in-range", "stream-map", "stream-filter", "stream->list", "stream-first", "stream-rest",
+        "stream-empty?"}
+
+KEYWORDS = {"if0", "seqn"}
+
+memos = weakref.WeakSet()
+
+pureFunctions = set()
+
+
+class Unkeyable(Exception):
+    """ Raised for an argument that can't be part of a cache key"""
+    pass
+
+
+class Memo(object):
+    """ A procedure whose results are cached by argument"""
+    __slots__ = ("function", "size", "cache", "hits", "misses", "bypassed", "evictions", "__weakref__")
+
+    def __init__(self, function, size=DEFAULT_SIZE):
+        self.function = function
+        self.size = size
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        memos.add(self)
+
+    def __call__(self, *args):
+        try:
+            key = tuple([keyOf(arg) for arg in args])
+        except Unkeyable:
+            self.bypassed += 1
+            return racython.apply(self.function, list(args))[0]
+        cache = self.cache
+        if key in cache:
+            self.hits += 1
+            cache.move_to_end(key)
+            return cache[key]
+        self.misses += 1
+        value = racython.apply(self.function, list(args))[0]
+        cache[key] = value
+        if len(cache) > self.size:
+            cache.popitem(last=False)
+            self.evictions += 1
+        return value
+
+    def stats(self):
+        """ -> Dictionary
+            The counters of this memo and how many results it holds"""
+        return {"hits": self.hits, "misses": self.misses, "bypassed": self.bypassed, "evictions": self.evictions,
+                "entries": len(self.cache)}
+
+
+def keyOf(value):
+    """ Value -> Key
+        A hashable stand in for value that is only equal for equal values, raises Unkeyable if value could
+        change or isn't known to be pure"""
+    kind = type(value)
+    if kind is int or kind is float or kind is str or kind is bool:
+        # Keeps 1 and 1.0 apart
+        return kind, value
+    if kind is racket_functions.Pair or kind is racket_functions.Empty:
+        return tuple([keyOf(x) for x in value])
+    if kind is Memo:
+        return value
+    if not pureFunctions:
+        pureFunctions.update(racython.topLevelEnv[name] for name in PURE if callable(racython.topLevelEnv[name]))
+    try:
+        if value in pureFunctions:
+            return value
+    except TypeError:
+        pass
+    raise Unkeyable()
+
+
+def stats():
+    """ -> Dictionary
+        The counters of every memo still alive, added up"""
+    totals = {"hits": 0, "misses": 0, "bypassed": 0, "evictions": 0, "entries": 0}
+    for memo in list(memos):
+        for name, value in memo.stats().items():
+            totals[name] += value
+    return totals
+
+
+def bound(rexp, names):
+    """ RExp [Dictionary Variable Number] -> None
+        Counts every name define, set, fun or with binds anywhere in rexp"""
+    if not isinstance(rexp, list) or not rexp:
+        return
+    head = rexp[0]
+    if (head == 'define' or head == 'set') and len(rexp) == 3:
+        names[rexp[1]] = names.get(rexp[1], 0) + 1
+        bound(rexp[2], names)
+        return
+    if head == 'fun':
+        for param in rexp[1]:
+            names[param] = names.get(param, 0) + 1
+        bound(rexp[2], names)
+        return
+    if head == 'with':
+        names[rexp[1][0]] = names.get(rexp[1][0], 0) + 1
+        bound(rexp[1][1], names)
+        bound(rexp[2], names)
+        return
+    if head == 'define-struct':
+        for name in racket_functions.structNames(rexp[1], rexp[2]):
+            names[name] = names.get(name, 0) + 1
+        return
+    for sub in rexp:
+        bound(sub, names)
+
+
+def isFun(rexp):
+    return isinstance(rexp, list) and len(rexp) == 3 and rexp[0] == 'fun'
+
+
+def pure(fun, allowed):
+    """ RExp [SetOf Variable] -> Boolean
+        Whether the given fun has no side effects, given the free names it may use"""
+
+    def walk(rexp, scope):
+        if isinstance(rexp, (int, float)):
+            return True
+        if isinstance(rexp, str):
+            return rexp in scope or rexp in allowed or rexp.startswith("\"")
+        if not rexp:
+            return False
+        head = rexp[0]
+        if head == 'fun':
+            return walk(rexp[2], scope | set(rexp[1]))
+        if head == 'define' or head == 'set' or head == 'define-struct':
+            return False
+        if head == 'with':
+            inner = scope | {rexp[1][0]}
+            return walk(rexp[1][1], inner) and walk(rexp[2], inner)
+        if head in KEYWORDS:
+            rexp = rexp[1:]
+        return all(walk(sub, scope) for sub in rexp)
+    return walk(fun[2], set(fun[1]))
+
+
+def memoize(forms, size=DEFAULT_SIZE):
+    """ [ListOf RExp] Number -> [ListOf RExp]
+        The given top level forms with every named pure fun wrapped in memo"""
+    names = {}
+    for rexp in forms:
+        bound(rexp, names)
+    # The program can't be rewritten if it has a memo of its own
+    if "memo" in names:
+        return forms
+    allowed = set(name for name in PURE if name not in names)
+    # Top level functions defined once are pure if they only use pure things, themselves included
+    candidates = {}
+    for rexp in forms:
+        if isinstance(rexp, list) and len(rexp) == 3 and rexp[0] == 'define' and isFun(rexp[2]) and \
+                names[rexp[1]] == 1:
+            candidates[rexp[1]] = rexp[2]
+    changed = True
+    while changed:
+        changed = False
+        for name, fun in list(candidates.items()):
+            if not pure(fun, allowed | set(candidates)):
+                del candidates[name]
+                changed = True
+    allowed |= set(candidates)
+
+    def wrap(rexp):
+        if isFun(rexp) and pure(rexp, allowed):
+            return ["memo", rewrite(rexp), size]
+        return rewrite(rexp)
+
+    def rewrite(rexp):
+        if not isinstance(rexp, list) or not rexp:
+            return rexp
+        head = rexp[0]
+        if (head == 'define' or head == 'set') and len(rexp) == 3:
+            return [head, rexp[1], wrap(rexp[2])]
+        if head == 'fun':
+            return [head, rexp[1], rewrite(rexp[2])]
+        if head == 'define-struct':
+            return rexp
+        if head == 'with':
+            return [head, [rexp[1][0], wrap(rexp[1][1])], rewrite(rexp[2])]
+        # The arguments of an immediately applied fun are named by its parameters
+        if isFun(head):
+            named = len(head[1]) + 1
+            return [rewrite(head)] + [wrap(arg) if i < named else rewrite(arg)
+                                      for i, arg in enumerate(rexp[1:], 1)]
+        return [rewrite(sub) for sub in rexp]
+
+    return [rewrite(rexp) for rexp in forms]
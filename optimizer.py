@@ -0,0 +1,353 @@
+"""
+Constant folding for Racython.
+
+optimize rewrites a RExp before it is run:
+    - calls to FOLDABLE primitives whose arguments are all constants are replaced by their value, if that value
+      can be written back as a RExp (a number, #true or #false) and the call doesn't fail
+    - an if0 whose test is a constant is replaced by the branch it takes, a seqn whose first expression is a
+      constant or a fun by its second
+    - a with whose local is a constant is removed and the constant put in every place the local was used, one
+      whose local is a fun used at most once (and not inside another fun) has the fun put in that place
+    - a map, filter, foldl or foldr whose list is made by a map, filter or build-list is fused with it into one
+      pass over a stream (see streams): (foldl + 0 (map f (build-list n g))) becomes
+      (foldl + 0 (stream-map f (stream-map g (in-range n)))), so no list is built in between. A map or filter
+      that is fused stays a map or filter of a stream, (stream->list (stream-map f ...)), which fuses again with
+      whatever takes its list. A foldr over a fused build-list folds left over the range backwards, any other
+      fused foldr still builds the one list it needs to go backwards. A build-list is only fused when its count is
+      a number literal that is an integer: in-range takes any number, so (build-list 2.5 f) would not fail.
+Only names that the program never binds and that still hold the topLevelEnv primitive in the Environment the
+program runs in are folded or fused. A with is only removed if its body never defines or sets anything, since those
+would otherwise land in a different frame or change what the fun would have captured.
+
+Fusing runs the functions of the stages in a different order, the stages of an element one after the other, so
+only stages whose function is pure (as memo tells it, see Pure) are fused. An error in one of them may then come
+up for a different element than it would have without fusing.
+
+A Report is a Report(Number Number Number Number Number Number): nodes before and after, and how many calls were
+folded, branches pruned, withs inlined and lists fused.
+
+python optimizer.py "<racket expression>" prints the optimized expression and its report.
+"""
+
+import collections
+import sys
+import memo
+import racket_functions
+import racython
+
+Report = collections.namedtuple("Report", "before after folded pruned inlined fused")
+
+FOLDABLE = {"+", "-", "/", "*", "or", "and", "not", "equal?", ">", "<", ">=", "<=", "odd?", "even?", "begin",
+            "add1", "sub1", "modulo"}
+
+BOOLEANS = {"#true": True, "#false": False}
+
+# The arity of each builtin whose list can be fused, the builtins that make those lists, and their lazy versions
+CONSUMERS = {"map": 3, "filter": 3, "foldl": 4, "foldr": 4}
+
+PRODUCERS = {"map", "filter", "build-list"}
+
+LAZY = {"map": "stream-map", "filter": "stream-filter"}
+
+# Every builtin a fused pipeline uses
+STREAMS = {"stream-map", "stream-filter", "stream->list", "in-range", "sub1", "foldl"}
+
+
+def size(rexp):
+    """ RExp -> Number
+        Number of nodes in rexp"""
+    if isinstance(rexp, list):
+        return 1 + sum(size(sub) for sub in rexp)
+    return 1
+
+
+def binders(rexp, names):
+    """ RExp [SetOf Variable] -> [SetOf Variable]
+        Adds every name rexp binds with define, set, fun or with to names"""
+    if isinstance(rexp, list) and rexp:
+        head = rexp[0]
+        if (head == 'define' or head == 'set') and len(rexp) == 3:
+            names.add(rexp[1])
+        elif head == 'fun' and len(rexp) == 3:
+            names.update(rexp[1])
+        elif head == 'with' and len(rexp) == 3:
+            names.add(rexp[1][0])
+        elif head == 'define-struct' and len(rexp) == 3:
+            names.update(racket_functions.structNames(rexp[1], rexp[2]))
+            return names
+        for sub in rexp:
+            binders(sub, names)
+    return names
+
+
+def assigns(rexp):
+    """ RExp -> Boolean
+        Whether rexp contains a define or a set anywhere"""
+    if not isinstance(rexp, list) or not rexp:
+        return False
+    if (rexp[0] == 'define' or rexp[0] == 'set' or rexp[0] == 'define-struct') and len(rexp) == 3:
+        return True
+    return any(assigns(sub) for sub in rexp)
+
+
+def variables(rexp, names):
+    """ RExp [SetOf Variable] -> [SetOf Variable]
+        Adds every variable rexp refers to, bound or not, to names"""
+    if isinstance(rexp, str):
+        names.add(rexp)
+    elif isinstance(rexp, list) and rexp:
+        if rexp[0] == 'fun' and len(rexp) == 3:
+            variables(rexp[2], names)
+        elif rexp[0] == 'with' and len(rexp) == 3:
+            variables(rexp[1][1], names)
+            variables(rexp[2], names)
+        else:
+            for sub in rexp:
+                variables(sub, names)
+    return names
+
+
+def uses(rexp, name, inFun=False):
+    """ RExp Variable Boolean -> Number Boolean
+        How many times rexp refers to name, and whether any of them is inside a fun"""
+    if isinstance(rexp, str):
+        return (1, inFun) if rexp == name else (0, False)
+    if not isinstance(rexp, list) or not rexp:
+        return 0, False
+    if rexp[0] == 'fun' and len(rexp) == 3:
+        return uses(rexp[2], name, True)
+    if rexp[0] == 'with' and len(rexp) == 3:
+        subs = [rexp[1][1], rexp[2]]
+    else:
+        subs = rexp
+    count, nested = 0, False
+    for sub in subs:
+        subCount, subNested = uses(sub, name, inFun)
+        count += subCount
+        nested = nested or subNested
+    return count, nested
+
+
+def substitute(rexp, name, value):
+    """ RExp Variable RExp -> RExp
+        rexp with every reference to name replaced by value"""
+    if isinstance(rexp, str):
+        return value if rexp == name else rexp
+    if not isinstance(rexp, list) or not rexp:
+        return rexp
+    if rexp[0] == 'fun' and len(rexp) == 3:
+        return ['fun', rexp[1], substitute(rexp[2], name, value)]
+    if rexp[0] == 'with' and len(rexp) == 3:
+        return ['with', [rexp[1][0], substitute(rexp[1][1], name, value)], substitute(rexp[2], name, value)]
+    return [substitute(sub, name, value) for sub in rexp]
+
+
+class Pure(object):
+    """ The free names a fun can use and still be pure: those in env, other than the shadowed ones, whose value
+        can be called or read without anything being seen"""
+
+    def __init__(self, env, shadowed, seen=frozenset()):
+        self.env = env
+        self.shadowed = shadowed
+        # The closures already being looked at, a recursive one is pure if the rest of it is
+        self.seen = seen
+
+    def __contains__(self, name):
+        if name in self.shadowed:
+            return False
+        try:
+            value = self.env[name]
+        except KeyError:
+            return False
+        if type(value) in (int, float, str, bool):
+            return True
+        if name in memo.PURE and value is racython.topLevelEnv.get(name):
+            return True
+        if type(value) is racython.closure:
+            if id(value) in self.seen:
+                return True
+            return memo.pure(['fun', value.params, value.body], Pure(value.env, set(), self.seen | {id(value)}))
+        return False
+
+
+def optimize(rexp, env=None):
+    """ RExp Environment -> RExp Report
+        Folds the constant parts of rexp for running in env"""
+    env = racython.toEnv(racython.topLevelEnv if env is None else env)
+    bound = binders(rexp, set())
+
+    def unshadowed(name):
+        if name in bound or name not in racython.topLevelEnv:
+            return False
+        try:
+            return env[name] is racython.topLevelEnv[name]
+        except KeyError:
+            return False
+
+    primitives = set(name for name in FOLDABLE if unshadowed(name))
+    booleans = dict((name, value) for name, value in BOOLEANS.items() if unshadowed(name))
+    counts = {"folded": 0, "pruned": 0, "inlined": 0, "fused": 0}
+    fusing = all(unshadowed(name) for name in STREAMS)
+    consumers = set(name for name in CONSUMERS if fusing and unshadowed(name))
+    producers = set(name for name in PRODUCERS if fusing and unshadowed(name))
+    allowed = Pure(env, bound)
+    # The stream->list and in-range nodes made by fusing, by id
+    generated = {}
+
+    def constant(rexp):
+        # Whether rexp is a constant, and its value
+        if isinstance(rexp, (int, float)) and not isinstance(rexp, bool):
+            return True, rexp
+        if isinstance(rexp, str) and rexp in booleans:
+            return True, booleans[rexp]
+        return False, None
+
+    def literal(value):
+        # The RExp for value, None if there isn't one
+        if type(value) is int or type(value) is float:
+            return value
+        if type(value) is bool:
+            for name, boolean in booleans.items():
+                if boolean is value:
+                    return name
+        return None
+
+    def isFun(rexp):
+        return isinstance(rexp, list) and len(rexp) == 3 and rexp[0] == 'fun'
+
+    def inline(name, value, body):
+        # The body of (with (name value) body) with the with removed, None if it has to stay
+        if assigns(body) or name in binders(body, set()):
+            return None
+        if constant(value)[0]:
+            return substitute(body, name, value)
+        if isFun(value):
+            count, inFun = uses(body, name)
+            # Whatever the body binds could capture the fun's variables once it is moved
+            if count > 1 or inFun or variables(value, set()) & binders(body, set()):
+                return None
+            return substitute(body, name, value)
+        return None
+
+    def stageable(function):
+        # Whether function is a name or a fun that can be run as a stage of a fused pipeline
+        if isinstance(function, str):
+            return not function.startswith("\"") and function in allowed
+        return isFun(function) and memo.pure(function, allowed)
+
+    def made(rexp):
+        # Whether rexp is a node fusing made
+        return generated.get(id(rexp)) is rexp
+
+    def lazy(rexp):
+        # The stream of the elements of the list rexp makes, None if it isn't made by a producer
+        if made(rexp) and rexp[0] == 'stream->list':
+            return rexp[1]
+        if not isinstance(rexp, list) or len(rexp) != 3 or not isinstance(rexp[0], str) or \
+                rexp[0] not in producers:
+            return None
+        if rexp[0] == 'build-list':
+            if type(rexp[1]) is not int or not stageable(rexp[2]):
+                return None
+            numbers = ['in-range', rexp[1]]
+            generated[id(numbers)] = numbers
+            return ['stream-map', rexp[2], numbers]
+        if not stageable(rexp[1]):
+            return None
+        source = lazy(rexp[2])
+        return [LAZY[rexp[0]], rexp[1], rexp[2] if source is None else source]
+
+    def backwards(stream):
+        # The given stream with its elements the other way around, None if it doesn't come from a build-list
+        if made(stream) and stream[0] == 'in-range':
+            return ['in-range', ['sub1', stream[1]], -1, -1]
+        if isinstance(stream, list) and len(stream) == 3 and stream[0] in LAZY.values():
+            source = backwards(stream[2])
+            return None if source is None else [stream[0], stream[1], source]
+        return None
+
+    def fuse(rexp):
+        # rexp with the producer of its list fused into it, None if there is none
+        head = rexp[0]
+        if len(rexp) != CONSUMERS[head]:
+            return None
+        source = lazy(rexp[-1])
+        if source is None:
+            return None
+        if head == 'foldr':
+            reversed = backwards(source)
+            if reversed is not None:
+                return ['foldl', rexp[1], rexp[2], reversed]
+        if head == 'foldl' or head == 'foldr':
+            return [head, rexp[1], rexp[2], source]
+        # Only a pure stage can go on being fused with what takes its list
+        if not stageable(rexp[1]):
+            return [head, rexp[1], source]
+        fused = ['stream->list', [LAZY[head], rexp[1], source]]
+        generated[id(fused)] = fused
+        return fused
+
+    def walk(rexp):
+        if not isinstance(rexp, list) or not rexp:
+            return rexp
+        head = rexp[0]
+        if head == 'if0' and len(rexp) == 4:
+            test = walk(rexp[1])
+            known, value = constant(test)
+            if known:
+                counts["pruned"] += 1
+                return walk(rexp[2] if value else rexp[3])
+            return ['if0', test, walk(rexp[2]), walk(rexp[3])]
+        if head == 'fun' and len(rexp) == 3:
+            return ['fun', rexp[1], walk(rexp[2])]
+        if (head == 'define' or head == 'set') and len(rexp) == 3:
+            return [head, rexp[1], walk(rexp[2])]
+        # Its fields are names, not calls
+        if head == 'define-struct':
+            return rexp
+        if head == 'with' and len(rexp) == 3:
+            name, value = rexp[1]
+            value = walk(value)
+            body = walk(rexp[2])
+            inlined = inline(name, value, body)
+            if inlined is not None:
+                counts["inlined"] += 1
+                # Putting the value in may have made more of the body constant
+                return walk(inlined)
+            return ['with', [name, value], body]
+        if head == 'seqn' and len(rexp) == 3:
+            first = walk(rexp[1])
+            second = walk(rexp[2])
+            if constant(first)[0] or isFun(first):
+                counts["pruned"] += 1
+                return second
+            return ['seqn', first, second]
+        rexp = [walk(sub) for sub in rexp]
+        if isinstance(head, str) and head in primitives:
+            args = [constant(arg) for arg in rexp[1:]]
+            if all(known for known, _ in args):
+                try:
+                    value = racython.topLevelEnv[head](*[value for _, value in args])
+                except Exception:
+                    # Leave it for the program to fail when it gets there
+                    return rexp
+                folded = literal(value)
+                if folded is not None:
+                    counts["folded"] += 1
+                    return folded
+        if isinstance(head, str) and head in consumers:
+            fused = fuse(rexp)
+            if fused is not None:
+                counts["fused"] += 1
+                return fused
+        return rexp
+
+    optimized = walk(rexp)
+    return optimized, Report(size(rexp), size(optimized), counts["folded"], counts["pruned"], counts["inlined"],
+                             counts["fused"])
+
+
+if __name__ == "__main__":
+    optimized, report = optimize(racython.parser(sys.argv[1]))
+    print(optimized)
+    print("%d -> %d nodes, %d calls folded, %d branches pruned, %d withs inlined, %d lists fused" % report)
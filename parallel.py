@@ -0,0 +1,132 @@
+"""
+Parallel map and build-list for Racython.
+
+(pmap f lst) and (pbuild-list n f) give the same list as map and build-list, but split the elements into chunks
+that are run on a pool of worker processes. f, and the environment it captured, is pickled once for every chunk
+and every worker runs it on its own copy, so anything f does besides returning a value (set, vector-set!, a memo
+filling its cache) stays in the worker: these are meant for pure functions that take a while per element.
+
+Lists shorter than MINIMUM, machines with a single core, functions that can't be pickled (those of the compile
+engine) and calls made from inside a worker run serially, in this process. Functions bulk can run over the whole
+list at once are run that way instead, since that is faster than any pool.
+
+Either way, the results come back in the order of the elements, and the first element, in that order, whose call
+failed is reported with a racython.ElementError naming it and caused by the original error. What f displays in a
+worker is kept and written to the current output port here, chunk by chunk in the order of the elements, since
+workers never write out their ports' buffers. Workers start with an empty output port of their own, so what this
+process displayed before is never written out again by them. The pool is stopped when the program exits.
+"""
+
+import atexit
+import io
+import os
+import ports
+import racython
+
+MINIMUM = 64
+
+# Chunks per worker, more of them even out elements that take longer than others
+CHUNKS = 4
+
+WORKERS = os.cpu_count() or 1
+
+pool = None
+
+inWorker = False
+
+
+def startWorker():
+    global inWorker
+    inWorker = True
+    # A forked worker starts with whatever the parent had displayed but not written out yet, which isn't its own
+    ports.currentOutput = ports.OutputPort()
+
+
+def stopPool():
+    """ -> None
+        Stops the workers of the pool, if it was started"""
+    global pool
+    if pool is not None:
+        pool.shutdown()
+        pool = None
+
+
+# Before the interpreter starts tearing down what the pool's threads need
+atexit.register(stopPool)
+
+
+def getPool():
+    """ -> ProcessPoolExecutor
+        The pool of workers, started the first time it is needed"""
+    global pool
+    if pool is None:
+        # Only programs that use the pool pay for importing it
+        import concurrent.futures
+        pool = concurrent.futures.ProcessPoolExecutor(WORKERS, initializer=startWorker)
+    return pool
+
+
+def run(function, values, start):
+    """ Procedure [ListOf Value] Number -> [ListOf Value] [Or (Number Value Exception String) None]
+        function applied to each value, up to the first that fails, and the index, element, error and its
+        description for that one. values start at the given index of the whole list."""
+    results = []
+    for index, value in enumerate(values, start):
+        try:
+            results.append(racython.apply(function, [value])[0])
+        except Exception as e:
+            return results, (index, value, e, "%s: %s" % (type(e).__name__, e))
+    return results, None
+
+
+def work(blob, values, start):
+    """ Bytes [ListOf Value] Number -> [ListOf Value] [Or (Number Value Exception String) None] String
+        run in a worker, for the pickled function, and what it displayed"""
+    import pickle
+    with ports.redirect(io.StringIO()) as (output, _):
+        results, failed = run(pickle.loads(blob), values, start)
+    if failed is not None:
+        index, value, error, message = failed
+        # Errors raised by error are instances of a class local to it, which can't be sent back
+        try:
+            pickle.dumps(error)
+        except Exception:
+            error = racython.RacythonException(message)
+        failed = (index, value, error, message)
+    return results, failed, output.stream.getvalue()
+
+
+def mapped(name, function, values):
+    """ String Procedure [ListOf Value] -> [ListOf Value]
+        function applied to every value, on the pool if it is worth it. name is the primitive reported in
+        errors."""
+    blob = None
+    if len(values) >= MINIMUM and WORKERS > 1 and not inWorker:
+        # Like the pool, only imported by programs that get to use it
+        import pickle
+        try:
+            blob = pickle.dumps(function, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            pass
+    if blob is None:
+        chunks = [run(function, values, 0)]
+    else:
+        size = -(-len(values) // (WORKERS * CHUNKS))
+        futures = [getPool().submit(work, blob, values[start:start + size], start)
+                   for start in range(0, len(values), size)]
+        chunks = []
+        for future in futures:
+            results, failed, output = future.result()
+            ports.currentOutput.write(output)
+            chunks.append((results, failed))
+            if failed is not None:
+                for rest in futures:
+                    rest.cancel()
+                break
+    results = []
+    for chunk, failed in chunks:
+        results.extend(chunk)
+        if failed is not None:
+            index, value, error, message = failed
+            raise racython.ElementError(name, index, value, message) from error
+    return results
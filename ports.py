@@ -0,0 +1,132 @@
+"""
+Input and output ports for Racython.
+
+display, write-string and newline write to the current OutputPort, read and read-line read from the current
+InputPort. By default those are stdout and stdin.
+
+An OutputPort keeps what is written to it and hands it to its stream in one write once it holds BUFFER_SIZE
+characters, when it is flushed (flush-output, or flush here), before anything is read from stdin, and when the
+program exits. A program that prints a character at a time makes one system call per BUFFER_SIZE characters
+instead of one per character. Something else printing to stdout in between (like runFile printing the value of
+each form) has to flush first so it doesn't come out ahead of what was displayed.
+
+An InputPort reads its stream a line at a time, without the flush of stdout and stderr input() does on every call.
+At the end of the stream it returns EOF.
+
+redirect makes display, read and the rest use other streams, like an io.StringIO, while it is active.
+"""
+
+import atexit
+import contextlib
+import sys
+
+BUFFER_SIZE = 1 << 16
+
+
+class Eof(object):
+    """ What reading past the end of an InputPort gives, there is only one: EOF"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "#<eof>"
+
+    def __reduce__(self):
+        return "EOF"
+
+
+EOF = Eof()
+
+
+class OutputPort(object):
+    """ A buffered text stream to write to, stdout (whatever sys.stdout is when it flushes) if stream is None"""
+    __slots__ = ("stream", "limit", "chunks", "size", "flushes", "written")
+
+    def __init__(self, stream=None, limit=BUFFER_SIZE):
+        self.stream = stream
+        self.limit = limit
+        self.chunks = []
+        self.size = 0
+        # How many times, and how many characters, it has written to its stream
+        self.flushes = 0
+        self.written = 0
+
+    def write(self, text):
+        """ String -> None
+            Adds text to what this port holds, writing it all out if that is more than its limit"""
+        self.chunks.append(text)
+        self.size += len(text)
+        if self.size >= self.limit:
+            self.flush()
+
+    def flush(self):
+        """ -> None
+            Writes out everything this port holds"""
+        if not self.chunks:
+            return
+        stream = sys.stdout if self.stream is None else self.stream
+        text = "".join(self.chunks)
+        del self.chunks[:]
+        self.size = 0
+        self.flushes += 1
+        self.written += len(text)
+        stream.write(text)
+        stream.flush()
+
+
+class InputPort(object):
+    """ A text stream to read lines from, stdin (whatever sys.stdin is when it reads) if stream is None"""
+    __slots__ = ("stream",)
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def readLine(self):
+        """ -> [Or String EOF]
+            The next line, without its line break"""
+        if self.stream is None:
+            # Whatever asked for this line has to be seen before it is typed
+            currentOutput.flush()
+            line = sys.stdin.readline()
+        else:
+            line = self.stream.readline()
+        if not line:
+            return EOF
+        if line.endswith("\n"):
+            return line[:-1]
+        return line
+
+
+currentOutput = OutputPort()
+
+currentInput = InputPort()
+
+
+def flush():
+    """ -> None
+        Writes out everything the current output port holds"""
+    currentOutput.flush()
+
+
+@contextlib.contextmanager
+def redirect(output=None, input=None):
+    """ [Or TextStream OutputPort None] [Or TextStream InputPort None] -> [Context OutputPort InputPort]
+        Makes the given streams (or ports) the current ports while active, keeping the current ones for those
+        that are None. What was written to the given output is flushed to it at the end."""
+    global currentOutput, currentInput
+    saved = currentOutput, currentInput
+    currentOutput.flush()
+    if output is not None:
+        currentOutput = output if isinstance(output, OutputPort) else OutputPort(output)
+    if input is not None:
+        currentInput = input if isinstance(input, InputPort) else InputPort(input)
+    try:
+        yield currentOutput, currentInput
+    finally:
+        try:
+            currentOutput.flush()
+        finally:
+            currentOutput, currentInput = saved
+
+
+# Whatever is still held when the program ends, sys.exit included
+atexit.register(lambda: currentOutput.flush())
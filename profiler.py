@@ -0,0 +1,244 @@
+"""
+A per function profiler for Racython.
+
+While a Profiler is active it replaces racython.interp, racython.apply and racython.callEnv with versions that
+time every closure call, and every primitive in its environment with a wrapper that times the primitive. When
+it exits the originals are put back, so a program that isn't being profiled runs exactly the code it always ran.
+
+Closures are only seen by the interp engine; the others call their own closures directly, so with them only the
+primitives show up. A closure is named after the variable it is bound to by define, with or an immediately
+applied fun, anonymous ones after their parameters. A tail call ends the caller's entry, the same way it drops
+the caller's frame.
+
+    python profiler.py program.rkt [--collapsed FILE] [--memory] [--limit N]
+
+prints the program's results, then the report. --collapsed writes the stacks in the collapsed format flame graph
+tools read, with the exclusive time of each stack in microseconds.
+"""
+
+import argparse
+import io
+import sys
+import time
+import tracemalloc
+import ports
+import racython
+import reader
+
+
+class Stats(object):
+    """ What the profiler knows about one function"""
+    __slots__ = ("calls", "inclusive", "exclusive", "allocated", "active")
+
+    def __init__(self):
+        self.calls = 0
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+        self.allocated = 0
+        # Calls to this function still running, only the outermost one adds to inclusive
+        self.active = 0
+
+
+class Profiler(object):
+    """ Records calls, inclusive and exclusive time and, with memory=True, the net bytes allocated (allocated
+        minus freed, traced with tracemalloc) for every closure and primitive called while it is active"""
+
+    def __init__(self, env=None, memory=False):
+        self.env = racython.topLevelEnv if env is None else env
+        self.memory = memory
+        self.stats = {}
+        self.stacks = {}
+        self.names = {}
+        self.stack = []     # One [name, start, children's time, path, memory at start, children's memory] per call
+        self.slots = []     # Per running interp, the entry of the closure it tail called into, if any
+        self.saved = None
+        self.tracing = False
+
+    def name(self, rexp, bound=None):
+        """ RExp -> None
+            Remembers the names closures made by rexp will be called by"""
+        if not isinstance(rexp, list) or not rexp:
+            return
+        head = rexp[0]
+        if head == 'fun':
+            # Keep the body alive so its id isn't reused
+            self.names[id(rexp[2])] = (bound or "fun (" + " ".join(rexp[1]) + ")", rexp[2])
+            self.name(rexp[2])
+            return
+        if (head == 'define' or head == 'set') and len(rexp) == 3:
+            self.name(rexp[2], rexp[1])
+            return
+        if head == 'with':
+            self.name(rexp[1][1], rexp[1][0])
+            self.name(rexp[2])
+            return
+        # The arguments of an immediately applied fun are named after its parameters
+        if isinstance(head, list) and head and head[0] == 'fun':
+            self.name(head)
+            for param, arg in zip(head[1], rexp[1:]):
+                self.name(arg, param)
+            for arg in rexp[len(head[1]) + 1:]:
+                self.name(arg)
+            return
+        for sub in rexp:
+            self.name(sub)
+
+    def closureName(self, function):
+        """ closure -> String
+            The name of the given closure"""
+        named = self.names.get(id(function.body))
+        if named is None:
+            return "fun (" + " ".join(function.params) + ")"
+        return named[0]
+
+    def enter(self, name):
+        """ String -> [ListOf Value]
+            Starts timing a call to name"""
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = Stats()
+        stats.calls += 1
+        stats.active += 1
+        path = self.stack[-1][3] + (name,) if self.stack else (name,)
+        allocated = tracemalloc.get_traced_memory()[0] if self.memory else 0
+        entry = [name, 0.0, 0.0, path, allocated, 0]
+        self.stack.append(entry)
+        entry[1] = time.perf_counter()
+        return entry
+
+    def exit(self):
+        """ -> None
+            Stops timing the innermost call"""
+        now = time.perf_counter()
+        name, start, children, path, allocated, childrenAllocated = self.stack.pop()
+        elapsed = now - start
+        stats = self.stats[name]
+        stats.active -= 1
+        if not stats.active:
+            stats.inclusive += elapsed
+        stats.exclusive += elapsed - children
+        self.stacks[path] = self.stacks.get(path, 0.0) + elapsed - children
+        if self.memory:
+            allocated = tracemalloc.get_traced_memory()[0] - allocated
+            stats.allocated += allocated - childrenAllocated
+        if self.stack:
+            parent = self.stack[-1]
+            parent[2] += elapsed
+            parent[5] += allocated
+
+    def __enter__(self):
+        originalInterp, originalApply, originalCallEnv = racython.interp, racython.apply, racython.callEnv
+        closure = racython.closure
+        slots = self.slots
+
+        def interp(rexp, env):
+            slots.append(None)
+            try:
+                return originalInterp(rexp, env)
+            finally:
+                if slots.pop() is not None:
+                    self.exit()
+
+        def apply(function, args, env=racython.topLevelEnv):
+            if type(function) is not closure:
+                return originalApply(function, args, env)
+            self.enter(self.closureName(function))
+            try:
+                return interp(function.body, originalCallEnv(function, args))[0], env
+            finally:
+                self.exit()
+
+        # interp only calls callEnv itself for tail calls, which replace the closure this interp was running
+        def callEnv(function, args):
+            if slots[-1] is not None:
+                self.exit()
+            slots[-1] = self.enter(self.closureName(function))
+            return originalCallEnv(function, args)
+
+        primitives = {}
+        for key, value in self.env.items():
+            if callable(value) and type(value) is not closure:
+                primitives[key] = value
+                self.env[key] = self.wrap(key, value)
+        self.saved = (originalInterp, originalApply, originalCallEnv, primitives)
+        # Only stop tracing on exit if it was started here
+        self.tracing = self.memory and not tracemalloc.is_tracing()
+        if self.tracing:
+            tracemalloc.start()
+        racython.interp, racython.apply, racython.callEnv = interp, apply, callEnv
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        originalInterp, originalApply, originalCallEnv, primitives = self.saved
+        racython.interp, racython.apply, racython.callEnv = originalInterp, originalApply, originalCallEnv
+        for key, primitive in primitives.items():
+            self.env[key] = primitive
+        # Calls cut short by an exception
+        while self.stack:
+            self.exit()
+        del self.slots[:]
+        if self.tracing:
+            tracemalloc.stop()
+        self.saved = None
+        return False
+
+    def wrap(self, name, primitive):
+        """ String Procedure -> Procedure
+            The given primitive, timed as name"""
+        enter, exit = self.enter, self.exit
+
+        def timed(*args):
+            enter(name)
+            try:
+                return primitive(*args)
+            finally:
+                exit()
+        return timed
+
+    def report(self, limit=None):
+        """ -> String
+            A table of every function called, most exclusive time first"""
+        rows = sorted(self.stats.items(), key=lambda item: item[1].exclusive, reverse=True)
+        lines = ["%10s %12s %12s %12s  %s" % ("calls", "inclusive", "exclusive", "net alloc", "function")]
+        for name, stats in rows[:limit]:
+            lines.append("%10d %11.3fs %11.3fs %10.1fKi  %s" % (stats.calls, stats.inclusive, stats.exclusive,
+                                                               stats.allocated / 1024.0, name))
+        return "\n".join(lines)
+
+    def collapsed(self):
+        """ -> String
+            Every stack seen, outermost call first and separated by ;, followed by its exclusive time in
+            microseconds"""
+        return "".join("%s %d\n" % (";".join(path), round(seconds * 1e6))
+                       for path, seconds in sorted(self.stacks.items()))
+
+
+def profile(source, engine="interp", env=None, memory=False):
+    """ String -> [ListOf Value] Profiler
+        Runs the given multi form program with a fresh copy of topLevelEnv, profiling it"""
+    profiler = Profiler(dict(racython.topLevelEnv) if env is None else env, memory)
+    forms = [form.rexp for form in reader.read(io.StringIO(source))]
+    for rexp in forms:
+        profiler.name(rexp)
+    with profiler:
+        values = list(racython.runForms(forms, engine, profiler.env))
+    return values, profiler
+
+
+if __name__ == "__main__":
+    options = argparse.ArgumentParser(description="Profiles a Racython program")
+    options.add_argument("program", help="file to run, - for stdin")
+    options.add_argument("--engine", default="interp")
+    options.add_argument("--collapsed", help="write collapsed stacks to this file")
+    options.add_argument("--memory", action="store_true", help="also trace allocations, slower")
+    options.add_argument("--limit", type=int, help="only report this many functions")
+    args = options.parse_args()
+    source = sys.stdin.read() if args.program == "-" else open(args.program).read()
+    values, profiler = profile(source, args.engine, memory=args.memory)
+    ports.flush()
+    for value in values:
+        print(value)
+    print(profiler.report(args.limit))
+    if args.collapsed:
+        with open(args.collapsed, "w") as output:
+            output.write(profiler.collapsed())
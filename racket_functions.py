@@ -1,19 +1,270 @@
-from collections import namedtuple
-from functools import reduce
-import racython
+from array import array
+import copyreg
+import gc
+import itertools
+import keyword
+import os
+import ports
+import weakref
+
+
+class Pair(object):
+    """ An immutable cons cell. A Racket list is a chain of Pairs ending in EMPTY, so cons and rest share the
+        tail instead of copying it."""
+    __slots__ = ("first", "rest")
+
+    def __init__(self, first, rest):
+        self.first = first
+        self.rest = rest
+
+    def __iter__(self):
+        node = self
+        while type(node) is Pair:
+            yield node.first
+            node = node.rest
+
+    def __bool__(self):
+        return True
+
+    def __len__(self):
+        return racket_length(self)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple)):
+            other = fromList(other)
+        if not isinstance(other, (Pair, Empty)):
+            return NotImplemented
+        node = self
+        while type(node) is Pair and type(other) is Pair:
+            if node.first != other.first:
+                return False
+            node, other = node.rest, other.rest
+        if type(node) is Pair or type(other) is Pair:
+            return False
+        return node == other
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return repr(toList(self))
+
+    def __reduce__(self):
+        # Pickled as a flat list, a long one would otherwise nest a Pair per element
+        return fromList, (list(self),)
+
+
+class Empty(object):
+    """ The empty list, there is only one: EMPTY"""
+    __slots__ = ()
+
+    def __iter__(self):
+        return iter(())
+
+    def __bool__(self):
+        return False
+
+    def __len__(self):
+        return 0
+
+    def __eq__(self, other):
+        if isinstance(other, (Empty, Pair, list, tuple)):
+            return not other
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(())
+
+    def __repr__(self):
+        return "[]"
+
+    def __reduce__(self):
+        return "EMPTY"
+
+
+EMPTY = Empty()
+
+
+class Vector(object):
+    """ A mutable, fixed length Racket vector. While every element is a small integer the elements live in a
+        compact array of machine integers, the first other value moves them into a plain list."""
+    __slots__ = ("items",)
+
+    def __init__(self, values):
+        values = list(values)
+        self.items = values
+        if all(type(x) is int for x in values):
+            try:
+                self.items = array("q", values)
+            except OverflowError:
+                pass
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __setitem__(self, index, value):
+        items = self.items
+        if type(items) is array:
+            if type(value) is int:
+                try:
+                    items[index] = value
+                    return
+                except OverflowError:
+                    pass
+            # Check the index before giving up on the array
+            items[index]
+            self.items = items = list(items)
+        items[index] = value
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __eq__(self, other):
+        if not isinstance(other, Vector):
+            return NotImplemented
+        return len(self.items) == len(other.items) and all(a == b for a, b in zip(self.items, other.items))
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "#(" + " ".join(repr(x) for x in self.items) + ")"
+
+
+class StructType(type):
+    """ The type of a struct made by define-struct, a subclass of Struct. Its instances keep each field in a slot
+        named after it, or after its position (_0, _1, ...) if the field's name can't be a Python attribute."""
+
+    def __repr__(cls):
+        return "#<struct-type:" + cls.name + ">"
+
+
+class Struct(object, metaclass=StructType):
+    """ An instance of a struct, equal to another of the same type with equal fields"""
+    __slots__ = ()
+    name = "struct"
+    fields = ()
+    key = None
+
+    def values(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.values() == other.values()
+
+    def __hash__(self):
+        return hash((type(self).key, self.values()))
+
+    def __repr__(self):
+        return "(make-" + self.name + "".join(" " + repr(value) for value in self.values()) + ")"
+
+    def __reduce__(self):
+        return type(self), self.values()
+
+
+class StructPredicate(object):
+    """ The X? of a struct type"""
+    __slots__ = ("type",)
+
+    def __init__(self, type):
+        self.type = type
+
+    def __call__(self, value):
+        return type(value) is self.type
+
+
+# Every struct type this process has made or unpickled and still uses, by key. A type nothing refers to anymore is
+# dropped, so a define-struct run over and over doesn't keep every type it made.
+structTypes = weakref.WeakValueDictionary()
+
+structCounter = itertools.count()
+
+
+def structType(name, fields, key=None):
+    """ Variable [ListOf Variable] String -> StructType
+        The struct type with the given key, a new one if this process doesn't have it yet. Types pickled in
+        another process come back as the same type each time."""
+    if key is not None and key in structTypes:
+        return structTypes[key]
+    if key is None:
+        key = "%d.%d" % (os.getpid(), next(structCounter))
+    slots = tuple(field if field.isidentifier() and not keyword.iskeyword(field) and not hasattr(Struct, field)
+                  else "_%d" % index for index, field in enumerate(fields))
+    if len(set(slots)) < len(slots):
+        slots = tuple("_%d" % index for index in range(len(fields)))
+    # A constructor that stores its arguments straight into the slots, like the __new__ of a namedtuple
+    namespace = {}
+    exec("def __init__(self%s):\n    %s\n" % ("".join(", " + slot for slot in slots),
+                                               "; ".join("self.%s = %s" % (slot, slot) for slot in slots) or "pass"),
+         namespace)
+    cls = StructType(name, (Struct,), {"__slots__": slots, "__init__": namespace["__init__"], "name": name,
+                                       "fields": tuple(fields), "key": key})
+    structTypes[key] = cls
+    return cls
+
+
+copyreg.pickle(StructType, lambda cls: (structType, (cls.name, cls.fields, cls.key)))
+
+
+def structNames(name, fields):
+    """ Variable [ListOf Variable] -> [ListOf Variable]
+        The names (define-struct name fields) binds"""
+    return ["make-" + name, name + "?"] + [name + "-" + field for field in fields]
+
+
+def structAccessor(cls, index):
+    """ StructType Number -> Procedure
+        The accessor of the field at index, the __get__ of its slot"""
+    return cls.__dict__[cls.__slots__[index]].__get__
+
+
+def makeStruct(name, fields):
+    """ Variable [ListOf Variable] -> [ListOf (Variable Procedure)]
+        What each name (define-struct name fields) binds is bound to: the new type itself as its constructor,
+        its predicate and the __get__ of each field's slot as its accessor"""
+    cls = structType(name, fields)
+    procedures = [cls, StructPredicate(cls)] + [structAccessor(cls, index) for index in range(len(fields))]
+    return list(zip(structNames(name, fields), procedures))
+
+
+def fromList(values):
+    """ [Iterable Value] -> [Or Pair Empty]
+        Builds a Racket list holding the given values, in order"""
+    values = list(values)
+    lst = EMPTY
+    # Each new Pair only points at older ones, so there are no cycles for the collector to look for while a
+    # long list is built, and it would otherwise walk the growing list over and over
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for value in reversed(values):
+            lst = Pair(value, lst)
+    finally:
+        if enabled:
+            gc.enable()
+    return lst
+
+
+def toList(lst):
+    """ [Or Pair Empty] -> [ListOf Value]
+        The Python list holding the elements of a Racket list, nested Racket lists included"""
+    return [toList(x) if isinstance(x, Pair) else x for x in lst]
 
 
 def racket_list(*args):
-    return list(args)
+    return fromList(args)
 
 
 def racket_cons(first, rest):
-    rest.insert(0, first)
-    return rest
+    return Pair(first, rest)
 
 
 def racket_empty_huh(list):
-    return not bool(list)
+    return not list
 
 
 def racket_or(*args):
@@ -28,45 +279,74 @@ def racket_not(bool):
     return not bool
 
 
+def element(name, list, index):
+    """ String [Or Pair Empty] Number -> Value
+        The element at index of list, raising a RacythonException naming the primitive name if it has no such
+        element"""
+    node = list
+    for _ in range(index):
+        if type(node) is not Pair:
+            break
+        node = node.rest
+    if type(node) is not Pair:
+        raise racython.RacythonException("%s: expects a list with at least %d elements, given %r" %
+                                         (name, index + 1, list))
+    return node.first
+
+
 def racket_first(list):
-    return list[0]
+    if type(list) is not Pair:
+        raise racython.RacythonException("first: expects a non-empty list, given %r" % (list,))
+    return list.first
 
 
 def racket_second(list):
-    return list[1]
+    return element("second", list, 1)
 
 
 def racket_third(list):
-    return list[2]
+    return element("third", list, 2)
 
 
 def racket_rest(list):
-    return list[1:]
+    if type(list) is not Pair:
+        raise racython.RacythonException("rest: expects a non-empty list, given %r" % (list,))
+    return list.rest
 
 
 def racket_reverse(list):
-    return list[::-1]
-
-
-def racket_make_struct(args):
-    arg = ' '.join(args[1])
-    return namedtuple(args[0], arg)
+    reversed = EMPTY
+    for elem in list:
+        reversed = Pair(elem, reversed)
+    return reversed
 
 
-def racket_access_struct(index):
-    return lambda nt: nt[index]
+def racket_map(function, lst):
+    values = [x for x in lst]
+    result = bulk.mapped(function, values)
+    if result is None:
+        result = [racython.apply(function, [x])[0] for x in values]
+    return fromList(result)
 
 
-def racket_struct_huh(nt):
-    return lambda int: isinstance(int, nt)
-
-
-def racket_map(function, list):
-    return [racython.apply(function, [x])[0] for x in list]
+def racket_filter(function, lst):
+    values = [x for x in lst]
+    result = bulk.filtered(function, values)
+    if result is None:
+        result = [x for x in values if racython.apply(function, [x])[0]]
+    return fromList(result)
 
 
-def racket_filter(function, lst):
-    return list(filter(lambda x: racython.apply(function, [x])[0], lst))
+def racket_pmap(function, lst):
+    values = [x for x in lst]
+    # Bulk functions only do arithmetic, so on an error they can be run again one element at a time to find it
+    try:
+        result = bulk.mapped(function, values)
+    except Exception:
+        result = None
+    if result is None:
+        result = parallel.mapped("pmap", function, values)
+    return fromList(result)
 
 
 def racket_integerToChar(int):
@@ -74,26 +354,79 @@ def racket_integerToChar(int):
 
 
 def racket_foldl(function, base, lst):
-    return reduce(lambda x, acc: racython.apply(function, [x, acc])[0], lst, base)
+    if isinstance(lst, streams.Stream):
+        return streams.folded(function, base, lst)
+    values = [x for x in lst]
+    result = bulk.folded(function, base, values)
+    if result is not None:
+        return result[0]
+    acc = base
+    for elem in values:
+        acc = racython.apply(function, [elem, acc])[0]
+    return acc
 
 
 def racket_foldr(function, base, lst):
+    values = [x for x in lst]
+    result = bulk.folded(function, base, values, right=True)
+    if result is not None:
+        return result[0]
     acc = base
-    for elem in lst[::-1]:
+    for elem in reversed(values):
         acc = racython.apply(function, [elem, acc])[0]
     return acc
 
 
+def racket_force(value):
+    return streams.force(value)
+
+
+def racket_inRange(*args):
+    if not 1 <= len(args) <= 3:
+        raise racython.RacythonException("in-range: expects 1 to 3 arguments, given " + str(len(args)))
+    if len(args) == 1:
+        return streams.Range(0, args[0])
+    return streams.Range(*args)
+
+
+def racket_streamFirst(stream):
+    if streams.empty(stream):
+        raise racython.RacythonException("stream-first: the stream is empty")
+    return streams.first(stream)
+
+
+def racket_streamRest(stream):
+    if streams.empty(stream):
+        raise racython.RacythonException("stream-rest: the stream is empty")
+    return streams.rest(stream)
+
+
+def racket_streamEmpty_huh(stream):
+    return streams.empty(stream)
+
+
+def racket_streamMap(function, stream):
+    return streams.StreamMap(function, stream)
+
+
+def racket_streamFilter(function, stream):
+    return streams.StreamFilter(function, stream)
+
+
+def racket_streamToList(stream):
+    return fromList(stream)
+
+
 def racket_andmap(function, lst):
     for elem in lst:
-        if function(elem) == False:
+        if racython.apply(function, [elem])[0] == False:
             return False
     return True
 
 
 def racket_ormap(function, lst):
     for elem in lst:
-        if function(elem) == True:
+        if racython.apply(function, [elem])[0] == True:
             return True
     return False
 
@@ -103,7 +436,21 @@ def racket_checkExpect(arg1, arg2):
 
 
 def racket_display(inStr):
-    print(inStr)
+    ports.currentOutput.write(str(inStr) + "\n")
+
+
+def racket_writeString(string):
+    if not isinstance(string, str):
+        raise racython.RacythonException("write-string: expected a string, given " + repr(string))
+    ports.currentOutput.write(string)
+
+
+def racket_newline():
+    ports.currentOutput.write("\n")
+
+
+def racket_flushOutput():
+    ports.currentOutput.flush()
 
 
 def racket_begin(*args):
@@ -111,7 +458,15 @@ def racket_begin(*args):
 
 
 def racket_read():
-    return input()
+    return ports.currentInput.readLine()
+
+
+def racket_readLine():
+    return ports.currentInput.readLine()
+
+
+def racket_eof_huh(value):
+    return value is ports.EOF
 
 
 def racket_listToString(list):
@@ -126,19 +481,84 @@ def racket_error(*args):
 
 
 def racket_explode(str):
-    return list(str)
+    return fromList(str)
 
 
 def racket_buildList(num, func):
-    return [racython.apply(func, [x])[0] for x in range(num)]
+    result = bulk.built(num, func)
+    if result is None:
+        result = [racython.apply(func, [x])[0] for x in range(num)]
+    return fromList(result)
+
+
+def racket_pbuildList(num, func):
+    try:
+        result = bulk.built(num, func)
+    except Exception:
+        result = None
+    if result is None:
+        result = parallel.mapped("pbuild-list", func, list(range(num)))
+    return fromList(result)
 
 
 def racket_length(list):
-    return len(list)
+    length = 0
+    while type(list) is Pair:
+        length += 1
+        list = list.rest
+    return length
 
 
 def racket_listRef(list, num):
-    return list[num]
+    if type(num) is int and num >= 0:
+        node = list
+        for _ in range(num):
+            if type(node) is not Pair:
+                break
+            node = node.rest
+        if type(node) is Pair:
+            return node.first
+    raise racython.RangeError("list-ref", num, racket_length(list), "list")
+
+
+def racket_makeVector(size, fill=0):
+    return Vector([fill] * size)
+
+
+def racket_vector(*args):
+    return Vector(args)
+
+
+def racket_vectorRef(vector, index):
+    if type(index) is not int or not 0 <= index < len(vector):
+        raise racython.RangeError("vector-ref", index, len(vector))
+    return vector[index]
+
+
+def racket_vectorSet(vector, index, value):
+    if type(index) is not int or not 0 <= index < len(vector):
+        raise racython.RangeError("vector-set!", index, len(vector))
+    vector[index] = value
+
+
+def racket_vectorLength(vector):
+    return len(vector)
+
+
+def racket_vectorToList(vector):
+    return fromList(vector)
+
+
+def racket_listToVector(list):
+    return Vector(list)
+
+
+def racket_buildVector(num, func):
+    return Vector([racython.apply(func, [x])[0] for x in range(num)])
+
+
+def racket_memo(function, size=None):
+    return memo.Memo(function, memo.DEFAULT_SIZE if size is None else size)
 
 
 def racket_add1(num):
@@ -151,3 +571,19 @@ def racket_sub1(num):
 
 def racket_modulo(num1, num2):
     return num1 % num2
+
+
+def racket_odd_huh(num):
+    return num % 2 == 1
+
+
+def racket_even_huh(num):
+    return num % 2 == 0
+
+
+# Imported last, see the note on the import cycle in racython
+import bulk
+import memo
+import parallel
+import racython
+import streams
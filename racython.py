@@ -4,6 +4,8 @@ A RExp is one of:
     - ['if0' RExp RExp RExp]
     - Variable
     - ['fun' Variable RExp]
+    - ['delay' RExp]
+    - ['stream-cons' RExp RExp]
     - ['cond' (list RExp Rexp) ...]
     - ['define' Variable RExp]
     - ['define-struct' Variable SExp]
@@ -22,15 +24,27 @@ A Procedure is one of:
     - closure
 A pythOP is a pythOP(handler=[ListOf Value]->Value)
 A closure is a closure([ListOf Variables], RExp, Env)
-An environment is a dictionary mapping from a Variable to a Value
+An environment is an Env, a frame of bindings from Variable to Value chained to its enclosing Env
+
+racython imports racket_functions, reader, resolver and streams, and those (with bulk, memo and parallel) call back
+into racython, so they import each other. That cycle is worked around, not removed: racket_functions, reader,
+resolver and streams import racython and the rest of the cycle last, after everything racython reads from them
+while it is being imported exists, so any of them can be imported first. Removing it would take moving apply and
+interp out of this module.
 """
 
+import cache as programCache
 import collections
-from copy import deepcopy
+import io
+import memo
 import operator
+import ports
 import racket_functions
-from sexpdata import loads
-from nltk.tokenize import SExprTokenizer
+import reader
+import resolver
+import streams
+import compiler
+import vm
 from sys import setrecursionlimit
 import sys
 
@@ -54,7 +68,7 @@ topLevelEnv = {"+": operator.add,
                "list": racket_functions.racket_list,
                "cons": racket_functions.racket_cons,
                "empty?": racket_functions.racket_empty_huh,
-               "empty": [],
+               "empty": racket_functions.EMPTY,
                "first": racket_functions.racket_first,
                "second": racket_functions.racket_second,
                "third": racket_functions.racket_third,
@@ -68,8 +82,8 @@ topLevelEnv = {"+": operator.add,
                "foldl": racket_functions.racket_foldl,
                "ormap": racket_functions.racket_ormap,
                "andmap": racket_functions.racket_andmap,
-               "odd?": lambda x: x % 2 == 1,
-               "even?": lambda x: x % 2 == 0,
+               "odd?": racket_functions.racket_odd_huh,
+               "even?": racket_functions.racket_even_huh,
                "check-expect": racket_functions.racket_checkExpect,
                "display": racket_functions.racket_display,
                "begin": racket_functions.racket_begin,
@@ -81,9 +95,89 @@ topLevelEnv = {"+": operator.add,
                "build-list": racket_functions.racket_buildList,
                "length": racket_functions.racket_length,
                "list-ref": racket_functions.racket_listRef,
+               "make-vector": racket_functions.racket_makeVector,
+               "vector": racket_functions.racket_vector,
+               "vector-ref": racket_functions.racket_vectorRef,
+               "vector-set!": racket_functions.racket_vectorSet,
+               "vector-length": racket_functions.racket_vectorLength,
+               "vector->list": racket_functions.racket_vectorToList,
+               "list->vector": racket_functions.racket_listToVector,
+               "build-vector": racket_functions.racket_buildVector,
+               "memo": racket_functions.racket_memo,
                "add1": racket_functions.racket_add1,
                "sub1": racket_functions.racket_sub1,
-               "modulo": racket_functions.racket_modulo, }
+               "modulo": racket_functions.racket_modulo,
+               "pmap": racket_functions.racket_pmap,
+               "pbuild-list": racket_functions.racket_pbuildList,
+               "write-string": racket_functions.racket_writeString,
+               "newline": racket_functions.racket_newline,
+               "flush-output": racket_functions.racket_flushOutput,
+               "read-line": racket_functions.racket_readLine,
+               "eof-object?": racket_functions.racket_eof_huh,
+               "force": racket_functions.racket_force,
+               "in-range": racket_functions.racket_inRange,
+               "stream-first": racket_functions.racket_streamFirst,
+               "stream-rest": racket_functions.racket_streamRest,
+               "stream-empty?": racket_functions.racket_streamEmpty_huh,
+               "stream-map": racket_functions.racket_streamMap,
+               "stream-filter": racket_functions.racket_streamFilter,
+               "stream->list": racket_functions.racket_streamToList, }
+
+
+class Env(object):
+    """ A frame of bindings from Variable to Value chained to the frame it was created in.
+        Lookups walk the chain outwards, define and set always write into the innermost frame."""
+    __slots__ = ("vars", "parent", "snapshot")
+
+    def __init__(self, vars=None, parent=None):
+        self.vars = {} if vars is None else vars
+        self.parent = parent
+        # The frozen copy of this frame handed out to closures, dropped as soon as the frame changes
+        self.snapshot = None
+
+    def __getitem__(self, name):
+        env = self
+        while env is not None:
+            vars = env.vars
+            if name in vars:
+                return vars[name]
+            env = env.parent
+        raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        self.snapshot = None
+        self.vars[name] = value
+
+    def __contains__(self, name):
+        try:
+            self[name]
+            return True
+        except KeyError:
+            return False
+
+    def child(self, vars=None):
+        """ [Dictionary Variable Value] -> Env
+            Creates a new innermost frame on top of this one"""
+        return Env(vars, self)
+
+    def capture(self):
+        """ -> Env
+            Returns a frozen copy of this chain of frames for a closure. Frames that haven't changed since they
+            were last captured are shared, so capturing an unchanged chain allocates nothing."""
+        parent = None if self.parent is None else self.parent.capture()
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.parent is not parent:
+            snapshot = Env(dict(self.vars), parent)
+            # A snapshot is never written to, so it is its own snapshot
+            snapshot.snapshot = snapshot
+            self.snapshot = snapshot
+        return snapshot
+
+
+def toEnv(env):
+    """ [Or Env Dictionary] -> Env
+        Wraps a plain dictionary (like topLevelEnv) as the outermost frame, writes still go into the dictionary"""
+    return env if isinstance(env, Env) else Env(env)
 
 
 class RacythonException(Exception):
@@ -92,59 +186,120 @@ class InternalRacythonException(Exception):
     pass
 class check_expect_error(Exception):
     pass
+class ReadError(RacythonException):
+    """ Raised by the reader for text that isn't well formed, with the line and column where it went wrong"""
+    def __init__(self, message, line, column):
+        RacythonException.__init__(self, "%s at line %d, column %d" % (message, line, column))
+        self.line = line
+        self.column = column
+class ElementError(RacythonException):
+    """ Raised by pmap and pbuild-list with the element their function failed on, caused by that failure"""
+    def __init__(self, name, index, element, message):
+        RacythonException.__init__(self, "%s: %s, for element %r at index %d" % (name, message, element, index))
+        self.index = index
+        self.element = element
+class Timeout(RacythonException):
+    """ Raised in a program that ran longer than it was allowed to, by the server and batch"""
+    pass
+class StepLimit(RacythonException):
+    """ Raised in a program that took more steps than it was allowed to, by batch"""
+    pass
+class RangeError(RacythonException, IndexError):
+    """ Raised by a primitive given an index out of the range its vector or list (the kind) has"""
+    def __init__(self, name, index, size, kind="vector"):
+        if size == 0:
+            message = "%s: index %r out of range for empty %s" % (name, index, kind)
+        else:
+            message = "%s: index is out of range, index: %r, valid range: [0, %d]" % (name, index, size - 1)
+        RacythonException.__init__(self, message)
+        self.index = index
+class FreeIdentifierError(RacythonException, KeyError):
+    """ Raised with every free identifier found, by the resolver or when one is reached at runtime"""
+    def __str__(self):
+        return "error: identificador libre!! " + ", ".join(self.args)
 
 def interp(rexp, env):
     """ Rexp Environment -> Value Environment
-        Recursively evaluates the given Rexp in the given environment"""
-    # If it is a number, then return that
-    if isinstance(rexp, (int, float)):
-        return rexp, env
-    # If it is a string then it is either a variable or a string
-    if isinstance(rexp, str):
-        try:
-            # If it is variable, return the value of the variable
-            return env[rexp], env
-        except KeyError as e:
-            if rexp.find("\""):
-                print("error: identificador libre!! "+rexp)
+        Evaluates the given Rexp in the given environment. Expressions in tail position (the branches of if0, the
+        last expression of seqn and with, and the body of a called closure) are run by this same loop instead of
+        a recursive call, so tail recursive programs run in constant Python stack."""
+    callerEnv = env
+    while True:
+        # If it is a number, then return that
+        if isinstance(rexp, (int, float)):
+            return rexp, callerEnv
+        # If it is a string then it is either a variable or a string
+        if isinstance(rexp, str):
+            try:
+                # If it is variable, return the value of the variable
+                return env[rexp], callerEnv
+            except KeyError as e:
+                ports.flush()
+                if rexp.find("\""):
+                    print("error: identificador libre!! "+rexp)
+                else:
+                    print("error: identificador libre!! "+rexp[1:-1])
+                sys.exit()
+        head = rexp[0]
+        # If it is if0, then use Python's if to determine which part to run next
+        if head == 'if0':
+            if interp(rexp[1], env)[0]:
+                rexp = rexp[2]
             else:
-                print("error: identificador libre!! "+rexp[1:-1])
-            sys.exit()
-    # If it is if0, then use Python's if to determine which part to run
-    if rexp[0] == 'if0':
-        if interp(rexp[1], env)[0]:
-            return interp(rexp[2], env)
-        else:
-            return interp(rexp[3], env)
-    # If it is fun, create a closure with the parameters, body, and env
-    if rexp[0] == 'fun':
-        clausenv = deepcopy(env)
-        return closure(rexp[1], rexp[2], clausenv), clausenv
-    # If it is define or set, change the env then return none
-    if rexp[0] == 'define' or rexp[0] == 'set':
-        env[rexp[1]] = interp(rexp[2], env)[0]
-        # define returns None
-        return None, env
-    # If it is with, create a new environment then execute it
-    if rexp[0] == 'with':
-        localDefines = rexp[1]
-        lEnv = deepcopy(env)
-        localDefines.insert(0,'define')
-        interp(localDefines, lEnv)[0]
-        return interp(rexp[2], lEnv)
-    # If it is seqn, update the env with expr1 then eval expr2
-    if rexp[0] == 'seqn':
-        interp(rexp[1], env)[0]
-        return interp(rexp[2], env)
-    # If it is none of those, then it is a function application (aka (Rexp Rexp ...))
-    else:
+                rexp = rexp[3]
+            continue
+        # If it is fun, create a closure with the parameters, body, and a snapshot of env
+        if head == 'fun':
+            return closure(rexp[1], rexp[2], toEnv(env).capture()), callerEnv
+        # If it is delay, wrap the expression in a thunk that only runs when forced
+        if head == 'delay':
+            return streams.Promise(closure([], rexp[1], toEnv(env).capture())), callerEnv
+        # If it is stream-cons, delay both its first and its rest
+        if head == 'stream-cons':
+            captured = toEnv(env).capture()
+            return streams.StreamPair(streams.Promise(closure([], rexp[1], captured)),
+                                      streams.Promise(closure([], rexp[2], captured))), callerEnv
+        # If it is define or set, change the env then return none
+        if head == 'define' or head == 'set':
+            env[rexp[1]] = interp(rexp[2], env)[0]
+            # define returns None
+            return None, callerEnv
+        # If it is define-struct, define its constructor, predicate and accessors then return none
+        if head == 'define-struct':
+            for name, value in racket_functions.makeStruct(rexp[1], rexp[2]):
+                env[name] = value
+            return None, callerEnv
+        # If it is with, create a new frame, bind the local in it, then execute the body in it
+        if head == 'with':
+            name, value = rexp[1]
+            env = toEnv(env).child()
+            env[name] = interp(value, env)[0]
+            rexp = rexp[2]
+            continue
+        # If it is seqn, update the env with expr1 then eval expr2
+        if head == 'seqn':
+            interp(rexp[1], env)
+            rexp = rexp[2]
+            continue
+        # If it is none of those, then it is a function application (aka (Rexp Rexp ...))
         # Get the function that is being called
-        # deepcopy to ensure scoping rules work properly
-        functionValue = interp(rexp[0], env)[0]
+        functionValue = interp(head, env)[0]
         # Eval each of the arguments to the function
         argsValue = [interp(a, env)[0] for a in rexp[1:]]
+        # A closure's body is in tail position, so run it here rather than through apply
+        if type(functionValue) is closure:
+            env = callEnv(functionValue, argsValue)
+            rexp = functionValue.body
+            continue
         # Apply the function to the arguments
-        return apply(functionValue, argsValue, env=env)
+        return apply(functionValue, argsValue, env=callerEnv)
+
+
+def callEnv(function, args):
+    """ closure [ListOf Value] -> Env
+        A new frame on top of the closure's snapshot holding its parameters, so the call never touches the
+        caller's bindings"""
+    return function.env.child(dict(zip(function.params, args)))
 
 
 def apply(function, args, env=topLevelEnv):
@@ -153,13 +308,7 @@ def apply(function, args, env=topLevelEnv):
     # If it is a closure, then it is a user defined function. Thus, eval it in a new environment containing
     # the parameters to the function.
     if type(function) is closure:
-        fParams = function.params
-        fBody = function.body
-        # deepcopy to ensure scoping rules work properly
-        fullEnv = deepcopy(function.env)
-        for param, arg in zip(fParams, args):
-            fullEnv[param] = arg
-        return interp(fBody, fullEnv)
+        return interp(function.body, callEnv(function, args))[0], env
     # If it is a PythOp, just apply the function
     else:
         return function(*args), env
@@ -182,54 +331,122 @@ def parseAtom(strRexp):
 
 def parser(strRexpr):
     """ String -> RExpr
-        Parse a RExpr from the result of splitting a string representation of a racket program
-        on the '(', ')', and ' ' characters. """
-
-    def reformat(sexpr):
-        """ RExpr -> RExpr
-            Replaces all symbol objects with strings and all bracket objects with lists"""
-        if "sexpdata.Bracket" in str(type(sexpr)):
-            return reformat(sexpr.value())
-        elif type(sexpr) is not list:
-            if "sexpdata.Symbol" in str(type(sexpr)):
-                return sexpr.value()
-            elif "sexpdata.Quoted" in str(type(sexpr)):
-                return parseAtom(sexpr.value().value())
-            else:
-                return parseAtom(sexpr)
-        return [reformat(term) for term in sexpr]
-
+        Parse a RExpr from a string representation of a single racket expression"""
     if "(" not in strRexpr or ")" not in strRexpr:
         return parseAtom(strRexpr)
-    sexpr = loads(strRexpr)
-    return reformat(sexpr)
+    forms = reader.read(io.StringIO(strRexpr))
+    rexp = next(forms).rexp
+    extra = next(forms, None)
+    if extra is not None:
+        raise ReadError("Expected a single expression", extra.line, extra.column)
+    return rexp
+
+
+def runRExp(rexp, env=topLevelEnv, engine="interp", memoize=False, optimize=False, strict=False):
+    """ RExp Environment -> Value Environment
+        Executes an already parsed program, either with interp or, with engine="resolve", by lexically addressing
+        it first, with engine="compile", by compiling it into Python closures, or, with engine="vm", by compiling
+        it to bytecode for the stack machine. With memoize, every named pure function in it caches its results
+        (see memo), memoize can be the number of results each one keeps. With optimize, its constant parts are
+        folded first (see optimizer). With strict, its free identifiers are reported with a FreeIdentifierError
+        before any of it runs, otherwise only the one reached fails (and interp exits)."""
+    env = toEnv(env)
+    if strict:
+        resolver.check([rexp], env)
+    if optimize:
+        # Only imported for programs that ask for it, so everything else starts faster
+        import optimizer
+        rexp = optimizer.optimize(rexp, env)[0]
+    if memoize:
+        rexp = memo.memoize([rexp], memo.DEFAULT_SIZE if memoize is True else memoize)[0]
+    if engine == "resolve":
+        return resolver.evaluate(resolver.resolve(rexp, env)[0], env), env
+    elif engine == "compile":
+        return compiler.compile(resolver.resolve(rexp, env)[0])(env), env
+    elif engine == "vm":
+        return vm.execute(vm.assemble(resolver.resolve(rexp, env)[0]), env), env
+    else:
+        return interp(rexp, env)
 
 
-def run(strRexp, env=topLevelEnv, returnEnv=False):
+def run(strRexp, env=topLevelEnv, returnEnv=False, engine="interp", memoize=False, optimize=False, strict=False):
     """ String -> Value
-        Executes the given single function call racket program"""
-    strRexp = strRexp
-    rexp = parser(strRexp)
+        Executes the given single function call racket program with the given engine (see runRExp)"""
+    result = runRExp(parser(strRexp), env, engine, memoize, optimize, strict)
     if returnEnv:
-        return interp(rexp, env)
+        return result
     else:
-        return interp(rexp, env)[0]
+        return result[0]
 
 
-def runFile(file):
+def runFile(file, engine="interp", env=topLevelEnv, cache=False, memoize=False, optimize=False, checks=False,
+            session=None, strict=False):
     """ String -> Value
-        Runs he given multi function call racket program. """
-    file = '\n'.join(stripComments(file.splitlines()))
-    rexpList = SExprTokenizer().tokenize(file)
+        Runs he given multi function call racket program. With cache, its parsed forms are kept in the on disk
+        program cache, cache can be a cache.ProgramCache to use instead of the default one. memoize
+        is as in runRExp, looking at the whole program to tell which functions are pure, and so is optimize.
+        With checks, the check-expects are run last, all of them, and the Summary of them is printed and
+        returned instead (see checks), neither cache nor memoize are used then. With an incremental.Session as
+        session, only what changed since the session last ran the file is run again, in the session's engine and
+        env. With strict, the free identifiers of the whole program are reported with a FreeIdentifierError before
+        any of it runs (see runRExp)."""
+    if checks:
+        # Only imported for tests, so everything else starts faster
+        import checks as checkRunner
+        values, summary = checkRunner.runFile(file, engine, env, optimize)
+        ports.flush()
+        for out in values:
+            print(out)
+        print(summary.report())
+        return summary
+    if session is not None:
+        results = session.runFile(file)
+    elif cache or memoize or strict:
+        forms = None
+        if cache:
+            programs = cache if isinstance(cache, programCache.ProgramCache) else programCache.programs
+            forms = programs.load(file)
+        if forms is None:
+            forms = [form.rexp for form in reader.read(io.StringIO(file))]
+            if cache:
+                programs.store(file, forms)
+        if strict:
+            resolver.check(forms, env)
+        if memoize:
+            forms = memo.memoize(forms, memo.DEFAULT_SIZE if memoize is True else memoize)
+        results = runForms(forms, engine, env, optimize)
+    else:
+        results = runStream(io.StringIO(file), engine, env, optimize=optimize)
     output = []
-    env = topLevelEnv
-    for rexp in rexpList:
-        out, env = run(rexp, env=env, returnEnv=True)
+    for out in results:
         output.append(out)
+        # After whatever the form displayed
+        ports.flush()
         print(output[-1])
     return output
 
 
+def runForms(forms, engine="interp", env=topLevelEnv, optimize=False):
+    """ [ListOf RExp] -> [Generator Value]
+        Runs already parsed top level forms in order, yielding each one's value"""
+    for rexp in forms:
+        out, env = runRExp(rexp, env, engine, optimize=optimize)
+        yield out
+
+
+def runStream(stream, engine="interp", env=topLevelEnv, chunkSize=reader.CHUNK_SIZE, optimize=False, strict=False):
+    """ File -> [Generator Value]
+        Runs the program read from stream one top level form at a time, each as soon as it has been read, and
+        yields its value. Only the form being run is held in memory. With chunkSize=None the stream is read a line
+        at a time, so a form typed into stdin runs as soon as its line ends. With strict, the whole program is read
+        first instead, and its free identifiers are reported with a FreeIdentifierError before any of it runs."""
+    forms = (form.rexp for form in reader.read(stream, chunkSize))
+    if strict:
+        forms = list(forms)
+        resolver.check(forms, env)
+    return runForms(forms, engine, env, optimize)
+
+
 def stripComments(listOfLines):
     """ [ListOf String] -> [ListOf String]
         Strips all comments from a given list of lines"""
@@ -282,5 +499,19 @@ def getEnv():
 
 
 if __name__ == "__main__":
+    replEnv = toEnv(dict(topLevelEnv))
     while True:
-        interp(input("> "))
+        try:
+            line = input("> ")
+        except EOFError:
+            break
+        try:
+            for value in runStream(io.StringIO(line), env=replEnv):
+                ports.flush()
+                print(value)
+        # interp has already printed why it exited
+        except SystemExit:
+            pass
+        except Exception as e:
+            ports.flush()
+            print("%s: %s" % (type(e).__name__, e))
@@ -0,0 +1,206 @@
+"""
+A single pass S-expression reader for Racython.
+
+read pulls text from a file object a chunk at a time and yields each top level form as soon as its closing
+bracket has been read, skipping ; and #| |# comments on the way. Forms come out as RExps, the same shape
+racython.parser has always produced:
+    - numbers are ints or floats
+    - symbols are Strings
+    - strings are parsed with racython.parseAtom, so "5" is 5 and "hi" is "\"hi\""
+    - (...) and [...] are lists
+    - 'symbol is parsed like the string "symbol", '(...) is (list '...)
+
+A Form is a Form(RExp, Number, Number): a top level form and the line and column (both from 1) it starts at.
+"""
+
+import collections
+import re
+
+Form = collections.namedtuple("Form", "rexp line column")
+
+CHUNK_SIZE = 1 << 16
+
+# Skips whitespace, then matches one token
+TOKEN = re.compile(r"""\s*(?:
+    (;[^\n]*)                               # 1 line comment
+  | (\#\|)                                  # 2 block comment
+  | ([(\[])                                 # 3 open
+  | ([)\]])                                 # 4 close
+  | (')                                     # 5 quote
+  | ("(?:[^"\\]|\\.)*")                     # 6 string
+  | ((?:[^\s()\[\]";'\#]|\#(?!\|))+)        # 7 atom
+)""", re.VERBOSE)
+
+SPACE = re.compile(r"\s*")
+
+BLOCK = re.compile(r"#\||\|#")
+
+NUMBER = re.compile(r"[+-]?(?:\d|\.\d)")
+
+ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "\\": "\\", "\"": "\""}
+
+UNESCAPE = re.compile(r"\\(.)", re.DOTALL)
+
+
+def atom(token):
+    """ String -> [Or Number Variable]
+        A number if the token looks like one, otherwise a symbol"""
+    if NUMBER.match(token):
+        try:
+            return int(token)
+        except ValueError:
+            try:
+                return float(token)
+            except ValueError:
+                pass
+    return token
+
+
+def string(token):
+    """ String -> Value
+        The value of a string literal, quotes included"""
+    body = token[1:-1]
+    if "\\" in body:
+        body = UNESCAPE.sub(lambda match: ESCAPES.get(match.group(1), match.group(1)), body)
+    return racython.parseAtom(body)
+
+
+def quote(datum):
+    """ RExp -> RExp
+        What 'datum reads as: a quoted symbol is parsed like a string, a quoted list becomes a call to list"""
+    if isinstance(datum, list):
+        return ["list"] + [quote(x) for x in datum]
+    if isinstance(datum, str) and not datum.startswith("\""):
+        return racython.parseAtom(datum)
+    return datum
+
+
+def read(stream, chunkSize=CHUNK_SIZE):
+    """ File -> [Generator Form]
+        Reads the top level forms of stream one at a time, chunkSize characters at a time or, if it is None, a
+        line at a time"""
+    buffer = ""
+    offset = 0          # Position in the stream of buffer[0]
+    line = 1            # Line number at lineOffset...
+    lineOffset = 0      # ...and the stream position where the newest counted line starts
+    counted = 0         # Stream position up to which newlines have been counted
+    eof = False
+    stack = []          # One [items, line, column, quotes] per enclosing open bracket
+    items = None        # The list being read, None at the top level
+    quotes = 0          # Quotes waiting for the next datum in items
+    opened = None       # Line and column of the top level form being read
+    depth = 0           # Nesting of block comments still open at the end of the buffer
+    match = TOKEN.match
+
+    def position(at):
+        # Line and column of stream position at, counting newlines from where we last stopped
+        nonlocal line, lineOffset, counted
+        text = buffer[counted - offset:at - offset]
+        newlines = text.count("\n")
+        if newlines:
+            line += newlines
+            lineOffset = counted + text.rfind("\n") + 1
+        counted = at
+        return line, at - lineOffset + 1
+
+    start = 0
+    while True:
+        if not eof:
+            chunk = stream.readline() if chunkSize is None else stream.read(chunkSize)
+            if chunk:
+                # Count the lines in what's about to be dropped before dropping it
+                position(offset + start)
+                buffer = buffer[start:] + chunk
+                offset += start
+                start = 0
+            else:
+                eof = True
+        end = len(buffer)
+        pos = start
+        while pos < end:
+            if depth:
+                # Inside a block comment, look for where it opens and closes. A lone # or | at the end of the
+                # buffer could be half of either, so keep it for the next chunk.
+                found = BLOCK.search(buffer, pos)
+                if found is None:
+                    pos = end if eof else max(pos, end - 1)
+                    break
+                depth += 1 if found.group() == "#|" else -1
+                pos = found.end()
+                continue
+            token = match(buffer, pos)
+            if token is None:
+                # Either only whitespace is left or a string doesn't end in this buffer
+                pos = SPACE.match(buffer, pos).end()
+                if pos == end or not eof:
+                    break
+                lineNumber, column = position(offset + pos)
+                raise racython.ReadError("Unterminated string", lineNumber, column)
+            kind = token.lastindex
+            tokenEnd = token.end()
+            # Comments and atoms running into the end of the buffer might continue in the next chunk
+            if tokenEnd == end and not eof and (kind == 7 or kind == 1):
+                break
+            pos = tokenEnd
+            if kind == 7:
+                text = token.group(7)
+                datum = text
+                if NUMBER.match(text):
+                    datum = atom(text)
+            elif kind == 3:
+                # Only top level forms need to know where they start
+                if items is None:
+                    opened = position(offset + token.start(3))
+                stack.append((items, opened, quotes))
+                items = []
+                quotes = 0
+                continue
+            elif kind == 4:
+                if items is None:
+                    lineNumber, column = position(offset + token.start(4))
+                    raise racython.ReadError("Unexpected " + repr(token.group(4)), lineNumber, column)
+                if quotes:
+                    raise racython.ReadError("Quote without anything to quote", opened[0], opened[1])
+                datum = items
+                where = opened
+                items, opened, quotes = stack.pop()
+                if items is None:
+                    while quotes:
+                        quotes -= 1
+                        datum = quote(datum)
+                    yield Form(datum, where[0], where[1])
+                    continue
+            elif kind == 6:
+                datum = string(token.group(6))
+            elif kind == 5:
+                quotes += 1
+                continue
+            elif kind == 2:
+                depth = 1
+                continue
+            else:
+                continue
+            # A datum is complete, apply any quotes in front of it and put it where it belongs
+            while quotes:
+                quotes -= 1
+                datum = quote(datum)
+            if items is None:
+                lineNumber, column = position(offset + token.start(kind))
+                yield Form(datum, lineNumber, column)
+            else:
+                items.append(datum)
+        start = pos
+        if eof:
+            break
+    if depth:
+        lineNumber, column = position(offset + len(buffer))
+        raise racython.ReadError("Unterminated #| comment", lineNumber, column)
+    if items is not None:
+        raise racython.ReadError("Unclosed bracket", opened[0], opened[1])
+    if quotes:
+        lineNumber, column = position(offset + len(buffer))
+        raise racython.ReadError("Quote without anything to quote", lineNumber, column)
+
+
+# Imported last, see the note on the import cycle in racython
+import racython
@@ -0,0 +1,272 @@
+"""
+Lexical addressing for Racython.
+
+resolve turns a RExp into a Resolved tree where every Variable already knows where it lives, and evaluate runs
+that tree. Each fun call and each with gets a Frame instead of an Env:
+
+A Frame is a list [Frame-or-Env Value ...], its parent followed by one slot per local. The outermost frame's
+parent is the Env the program was started in, which still holds the top level bindings by name.
+
+A Resolved is one of:
+    - Const(Value)
+    - Local(Number Number Resolved)                depth, slot, what to read while the slot is unset
+    - Global(Number Variable)                      depth of the Env, name
+    - Free(Variable)
+    - If0(Resolved Resolved Resolved)
+    - Fun(Number Number Resolved [ListOf Boolean]) arity, frame size, body, which enclosing frames change
+    - SetLocal(Number Resolved)
+    - SetGlobal(Variable Resolved)
+    - With(Number Resolved Resolved Boolean)       frame size, binding, body, binding evaluated inside the frame
+    - Seqn(Resolved Resolved)
+    - App(Resolved [ListOf Resolved])
+"""
+
+import collections
+
+Const = collections.namedtuple("Const", "value")
+Local = collections.namedtuple("Local", "depth index fallback")
+Global = collections.namedtuple("Global", "depth name")
+Free = collections.namedtuple("Free", "name")
+If0 = collections.namedtuple("If0", "test then other")
+Fun = collections.namedtuple("Fun", "arity size body mutable")
+SetLocal = collections.namedtuple("SetLocal", "index value")
+SetGlobal = collections.namedtuple("SetGlobal", "name value")
+With = collections.namedtuple("With", "size binding body inner")
+Seqn = collections.namedtuple("Seqn", "first second")
+App = collections.namedtuple("App", "function args")
+
+
+class Unset(object):
+    """ The value of a slot that hasn't been bound yet, reading it falls back to the enclosing frames"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "UNSET"
+
+
+UNSET = Unset()
+
+
+class Scope(object):
+    """ The compile time shape of a Frame: where each local lives and whether the frame is written after it
+        is created"""
+    __slots__ = ("names", "parent", "mutable")
+
+    def __init__(self, names, parent, mutable):
+        self.names = {}
+        for name in names:
+            self.names.setdefault(name, len(self.names) + 1)
+        self.parent = parent
+        self.mutable = mutable
+
+
+class Procedure(object):
+    """ A closure over a Frame. Calling it runs the body in a fresh frame holding the arguments."""
+    __slots__ = ("fun", "frame")
+
+    def __init__(self, fun, frame):
+        self.fun = fun
+        self.frame = frame
+
+    def __call__(self, *args):
+        fun = self.fun
+        frame = [self.frame]
+        frame.extend(args[:fun.arity])
+        if len(frame) <= fun.size:
+            frame.extend([UNSET] * (fun.size + 1 - len(frame)))
+        return evaluate(fun.body, frame)
+
+
+def assigned(rexp):
+    """ RExp -> [ListOf Variable]
+        Every Variable that is defined or set by rexp in the frame it runs in, without looking inside the
+        funs and withs that get frames of their own"""
+    if not isinstance(rexp, list) or not rexp:
+        return []
+    if rexp[0] in ('fun', 'with', 'delay', 'stream-cons'):
+        return []
+    if rexp[0] == 'define-struct':
+        return racket_functions.structNames(rexp[1], rexp[2])
+    names = []
+    if rexp[0] == 'define' or rexp[0] == 'set':
+        names.append(rexp[1])
+        rexp = rexp[2:]
+    for sub in rexp:
+        names.extend(assigned(sub))
+    return names
+
+
+def resolve(rexp, env=None, strict=False):
+    """ RExp Environment -> Resolved [ListOf Variable]
+        Lexically addresses rexp for running in env, returning the resolved tree and every free identifier in it.
+        A free identifier only fails if it is actually reached, unless strict is set, in which case they are all
+        reported up front."""
+    env = racython.toEnv(racython.topLevelEnv if env is None else env)
+    topLevel = set(assigned(rexp))
+    free = []
+
+    def lookup(name, scope, depth, report=True):
+        # Walk the scopes outwards, an unset local falls back to whatever the name means further out
+        while scope is not None:
+            if name in scope.names:
+                return Local(depth, scope.names[name], lookup(name, scope.parent, depth + 1, False))
+            scope = scope.parent
+            depth += 1
+        if name in topLevel or name in env:
+            return Global(depth, name)
+        if report and name not in free:
+            free.append(name)
+        return Free(name)
+
+    def chain(scope):
+        flags = []
+        while scope is not None:
+            flags.append(scope.mutable)
+            scope = scope.parent
+        return tuple(flags)
+
+    def walk(rexp, scope):
+        # Numbers are constants
+        if isinstance(rexp, (int, float)):
+            return Const(rexp)
+        # Strings are variables
+        if isinstance(rexp, str):
+            return lookup(rexp, scope, 0)
+        if rexp[0] == 'if0':
+            return If0(walk(rexp[1], scope), walk(rexp[2], scope), walk(rexp[3], scope))
+        # A fun's frame holds its parameters and everything its body defines
+        if rexp[0] == 'fun':
+            locals = assigned(rexp[2])
+            inner = Scope(list(rexp[1]) + locals, scope, bool(locals))
+            return Fun(len(rexp[1]), len(inner.names), walk(rexp[2], inner), chain(scope))
+        # A delay is a Promise of a fun without parameters, a stream-cons a StreamPair of two of them
+        if rexp[0] == 'delay':
+            return App(Const(streams.Promise), [walk(['fun', [], rexp[1]], scope)])
+        if rexp[0] == 'stream-cons':
+            return App(Const(streams.StreamPair), [walk(['delay', rexp[1]], scope), walk(['delay', rexp[2]], scope)])
+        if rexp[0] == 'define' or rexp[0] == 'set':
+            if scope is None:
+                return SetGlobal(rexp[1], walk(rexp[2], scope))
+            return SetLocal(scope.names[rexp[1]], walk(rexp[2], scope))
+        # A define-struct is run as the defines of what it binds: its constructor is a new type every time it
+        # runs, and the predicate and accessors are made out of it
+        if rexp[0] == 'define-struct':
+            names = racket_functions.structNames(rexp[1], rexp[2])
+            constructor = lookup(names[0], scope, 0)
+            values = [App(Const(racket_functions.structType), [Const(rexp[1]), Const(tuple(rexp[2]))]),
+                      App(Const(racket_functions.StructPredicate), [constructor])] + \
+                [App(Const(racket_functions.structAccessor), [constructor, Const(index)])
+                 for index in range(len(rexp[2]))]
+            defines = [SetGlobal(name, value) if scope is None else SetLocal(scope.names[name], value)
+                       for name, value in zip(names, values)]
+            node = defines.pop()
+            while defines:
+                node = Seqn(defines.pop(), node)
+            return node
+        # A with's frame holds its local and everything it defines. The binding only needs to run inside the
+        # frame if it defines something itself, otherwise every slot it could see is still unset.
+        if rexp[0] == 'with':
+            name, value = rexp[1]
+            locals = assigned(value)
+            bodyLocals = assigned(rexp[2])
+            inner = Scope([name] + locals + bodyLocals, scope, bool(locals or bodyLocals))
+            binding = walk(value, inner if locals else scope)
+            return With(len(inner.names), binding, walk(rexp[2], inner), bool(locals))
+        if rexp[0] == 'seqn':
+            return Seqn(walk(rexp[1], scope), walk(rexp[2], scope))
+        return App(walk(rexp[0], scope), [walk(arg, scope) for arg in rexp[1:]])
+
+    resolved = walk(rexp, None)
+    if strict and free:
+        raise racython.FreeIdentifierError(*free)
+    return resolved, free
+
+
+def check(forms, env=None):
+    """ [ListOf RExp] Environment -> None
+        Raises a FreeIdentifierError with every free identifier of the program made of the given top level forms,
+        before any of them runs. A name one of the forms defines isn't free in the others."""
+    env = racython.toEnv(racython.topLevelEnv if env is None else env)
+    defined = set()
+    for rexp in forms:
+        defined.update(assigned(rexp))
+    free = []
+    for rexp in forms:
+        for name in resolve(rexp, env)[1]:
+            if name not in defined and name not in free:
+                free.append(name)
+    if free:
+        raise racython.FreeIdentifierError(*free)
+
+
+def capture(frame, mutable, depth=0):
+    """ Frame [ListOf Boolean] -> Frame
+        Freezes the chain of frames for a closure. Frames that can still be written, or whose parent had to be
+        copied, are copied, the rest are shared."""
+    if depth == len(mutable):
+        return frame.capture()
+    parent = frame[0]
+    captured = capture(parent, mutable, depth + 1)
+    if mutable[depth] or captured is not parent:
+        frame = list(frame)
+        frame[0] = captured
+    return frame
+
+
+def evaluate(node, frame):
+    """ Resolved Frame -> Value
+        Recursively evaluates the resolved tree in the given frame"""
+    kind = type(node)
+    # Locals are read straight out of their slot
+    if kind is Local:
+        target = frame
+        for _ in range(node.depth):
+            target = target[0]
+        value = target[node.index]
+        if value is UNSET:
+            return evaluate(node.fallback, frame)
+        return value
+    if kind is Const:
+        return node.value
+    if kind is App:
+        function = evaluate(node.function, frame)
+        return function(*[evaluate(arg, frame) for arg in node.args])
+    if kind is If0:
+        if evaluate(node.test, frame):
+            return evaluate(node.then, frame)
+        return evaluate(node.other, frame)
+    if kind is Global:
+        target = frame
+        for _ in range(node.depth):
+            target = target[0]
+        try:
+            return target[node.name]
+        except KeyError:
+            raise racython.FreeIdentifierError(node.name)
+    if kind is Fun:
+        return Procedure(node, capture(frame, node.mutable))
+    if kind is SetLocal:
+        frame[node.index] = evaluate(node.value, frame)
+        return None
+    if kind is SetGlobal:
+        frame[node.name] = evaluate(node.value, frame)
+        return None
+    if kind is With:
+        if node.inner:
+            local = [frame] + [UNSET] * node.size
+            local[1] = evaluate(node.binding, local)
+        else:
+            local = [frame, evaluate(node.binding, frame)] + [UNSET] * (node.size - 1)
+        return evaluate(node.body, local)
+    if kind is Seqn:
+        evaluate(node.first, frame)
+        return evaluate(node.second, frame)
+    if kind is Free:
+        raise racython.FreeIdentifierError(node.name)
+    raise racython.InternalRacythonException("Unknown resolved node " + repr(node))
+
+
+# Imported last, see the note on the import cycle in racython
+import racket_functions
+import racython
+import streams
@@ -0,0 +1,193 @@
+"""
+A long lived evaluation server for Racython.
+
+The server listens on a Unix socket (client.defaultSocket() unless told otherwise) and keeps any number of
+sessions, each with its own environment. The prelude, a copy of topLevelEnv with whatever program the server was
+started with already run in it, is built once; a new session is just an empty frame on top of it, so starting one
+copies nothing and whatever it defines or sets stays in its own frame. When there are more than MAX_SESSIONS the
+one used least recently is dropped.
+
+Each line sent to the server is a Request, a JSON object, and gets back a line with a client.Response:
+    - {"source": String, "session": String, "engine": String, "timeout": Number, "input": String} runs every
+      form in source in the session (only source is needed), with input as what read reads
+    - {"close": String} drops the session
+Requests are run one at a time, in the order they arrive on any connection, and each one is stopped after its
+timeout (DEFAULT_TIMEOUT seconds unless told otherwise) with whatever it had done to its session kept. Like the
+programs of a batch, requests run with Python's recursion limit at batch.DEPTH frames instead of racython's, so one
+that recurses too deep gets a RecursionError back instead of overflowing the C stack and killing the server along
+with every session.
+
+    python server.py [--socket PATH] [--prelude program.rkt] [--engine ENGINE] [--timeout SECONDS] [--depth N]
+"""
+
+import argparse
+import contextlib
+import collections
+import io
+import json
+import os
+import selectors
+import signal
+import socket
+import sys
+import threading
+import batch
+import client
+import ports
+import racython
+
+DEFAULT_TIMEOUT = 10.0
+
+MAX_SESSIONS = 1024
+
+
+class Server(object):
+    """ Sessions forked from a shared prelude, and what runs requests on them"""
+
+    def __init__(self, prelude=None, engine="interp", timeout=DEFAULT_TIMEOUT, depth=batch.DEPTH):
+        self.engine = engine
+        self.timeout = timeout
+        self.depth = depth
+        self.prelude = racython.toEnv(dict(racython.topLevelEnv))
+        if prelude is not None:
+            for _ in racython.runStream(io.StringIO(prelude), engine, self.prelude):
+                pass
+        self.sessions = collections.OrderedDict()
+        # The timeout of the request running and whether one is
+        self.limit = timeout
+        self.running = False
+        # Only the main thread gets signals, elsewhere requests can't be stopped
+        self.alarms = threading.current_thread() is threading.main_thread()
+        if self.alarms:
+            signal.signal(signal.SIGALRM, self.alarm)
+
+    def alarm(self, signum, frame):
+        if self.running:
+            raise racython.Timeout("took longer than %gs" % self.limit)
+
+    def session(self, name):
+        """ String -> Env
+            The environment of the named session, a new one if there is none"""
+        sessions = self.sessions
+        env = sessions.get(name)
+        if env is None:
+            env = sessions[name] = self.prelude.child()
+            if len(sessions) > MAX_SESSIONS:
+                sessions.popitem(last=False)
+        else:
+            sessions.move_to_end(name)
+        return env
+
+    def handle(self, request):
+        """ Request -> Response
+            Runs the given request"""
+        if "close" in request:
+            self.sessions.pop(request["close"], None)
+            return {"values": [], "output": "", "error": None}
+        env = self.session(request.get("session", "default"))
+        values = []
+        output = io.StringIO()
+        error = None
+        self.limit = request.get("timeout", self.timeout)
+        recursion = sys.getrecursionlimit()
+        try:
+            # interp prints its errors itself
+            with ports.redirect(output, io.StringIO(request.get("input", ""))), contextlib.redirect_stdout(output):
+                if self.alarms:
+                    signal.setitimer(signal.ITIMER_REAL, self.limit)
+                self.running = True
+                if self.depth is not None:
+                    sys.setrecursionlimit(self.depth)
+                try:
+                    for value in racython.runStream(io.StringIO(request["source"]),
+                                                    request.get("engine", self.engine), env):
+                        values.append(str(value))
+                finally:
+                    sys.setrecursionlimit(recursion)
+                    self.running = False
+                    if self.alarms:
+                        signal.setitimer(signal.ITIMER_REAL, 0)
+        except SystemExit:
+            # interp has already said why in the output
+            error = "SystemExit: the program exited"
+        except Exception as e:
+            error = "%s: %s" % (type(e).__name__, e)
+        return {"values": values, "output": output.getvalue(), "error": error}
+
+    def respond(self, line):
+        """ Bytes -> Bytes
+            The response line to the given request line"""
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict) or not ("source" in request or "close" in request):
+                raise ValueError("a request needs a source or a close")
+        except ValueError as e:
+            response = {"values": [], "output": "", "error": "Bad request: %s" % e}
+        else:
+            response = self.handle(request)
+        return json.dumps(response).encode() + b"\n"
+
+    def serve(self, path=None):
+        """ String -> None
+            Answers requests on the Unix socket at path until interrupted"""
+        path = path or client.defaultSocket()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path):
+            # Left behind by a server that is gone, unless one is still answering
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                raise OSError("A server is already listening on " + path)
+            except ConnectionRefusedError:
+                os.remove(path)
+            finally:
+                probe.close()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        os.chmod(path, 0o600)
+        listener.listen()
+        selector = selectors.DefaultSelector()
+        selector.register(listener, selectors.EVENT_READ)
+        pending = {}
+        try:
+            while True:
+                for key, _ in selector.select():
+                    if key.fileobj is listener:
+                        connection = listener.accept()[0]
+                        selector.register(connection, selectors.EVENT_READ)
+                        pending[connection] = b""
+                        continue
+                    connection = key.fileobj
+                    try:
+                        data = connection.recv(65536)
+                        pending[connection] += data
+                        while b"\n" in pending[connection]:
+                            line, pending[connection] = pending[connection].split(b"\n", 1)
+                            connection.sendall(self.respond(line))
+                    except OSError:
+                        data = b""
+                    if not data:
+                        selector.unregister(connection)
+                        del pending[connection]
+                        connection.close()
+        finally:
+            selector.close()
+            listener.close()
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    options = argparse.ArgumentParser(description="Serves Racython sessions on a Unix socket")
+    options.add_argument("--socket")
+    options.add_argument("--prelude", help="program every session starts from")
+    options.add_argument("--engine", default="interp")
+    options.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    options.add_argument("--depth", type=int, default=batch.DEPTH)
+    args = options.parse_args()
+    prelude = open(args.prelude).read() if args.prelude else None
+    # Stop on kill as on ^C, so the socket gets removed
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        Server(prelude, args.engine, args.timeout, args.depth).serve(args.socket)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,299 @@
+"""
+Lazy streams for Racython.
+
+A Stream is one of:
+    - a Racket list (EMPTY or a Pair)
+    - StreamPair(Promise, Promise)          what stream-cons makes, its first and its rest are only run when
+                                            asked for
+    - Range(Number, Number, Number)         in-range, the numbers from start up to end (not included) by step
+    - StreamMap(Procedure, Stream)          stream-map, the function applied to every element of the stream
+    - StreamFilter(Procedure, Stream)       stream-filter, the elements of the stream the function holds for
+A Promise is what delay makes: an expression that runs the first time the Promise is forced, every force after
+that gives the same value.
+
+stream-first and stream-rest run a stream one element at a time: stream-first runs only the first element,
+stream-rest only what it takes to get to the rest and stream-empty? only what it takes to tell (nothing for a
+stream-cons). What they ran is kept, so asking for it again doesn't run it again. Whatever goes through the whole
+stream (stream->list, foldl, map, ...) iterates it instead, which never holds more than CHUNK of its elements at
+once. A stream-map or stream-filter whose function
+bulk can turn into a Kernel (only arithmetic, so nothing it does can be seen) is run over CHUNK elements of its
+source at a time, as arrays if NumPy is installed. Any other function is run one element at a time, so stages that
+display something still take turns element by element as they would in Racket.
+"""
+
+import itertools
+
+CHUNK = 10000
+
+
+class Promise(object):
+    """ A thunk that runs once, the first time it is forced"""
+    __slots__ = ("thunk", "value", "forced")
+
+    def __init__(self, thunk):
+        self.thunk = thunk
+        self.value = None
+        self.forced = False
+
+    def force(self):
+        """ -> Value
+            The value of the thunk, running it if it hasn't run yet"""
+        if not self.forced:
+            value = racython.apply(self.thunk, [])[0]
+            # Forcing it again from inside the thunk may have given it a value already
+            if not self.forced:
+                self.value, self.forced, self.thunk = value, True, None
+        return self.value
+
+    def __repr__(self):
+        return "#<promise>"
+
+
+def force(value):
+    """ Value -> Value
+        The value of a Promise, anything else is its own value"""
+    if type(value) is Promise:
+        return value.force()
+    return value
+
+
+class Stream(object):
+    """ A lazy stream, see the subclasses. Each one has isEmpty, head (its first element, without running the
+        rest) and tail (its rest, without running its first element), which run as little of it as they can."""
+    __slots__ = ()
+
+    def __iter__(self):
+        stream = self
+        while not empty(stream):
+            yield first(stream)
+            stream = rest(stream)
+
+    def chunks(self):
+        """ -> [Generator [ListOf Value]]
+            The elements of the stream, in lists of at most CHUNK of them"""
+        elements = iter(self)
+        while True:
+            chunk = list(itertools.islice(elements, CHUNK))
+            if not chunk:
+                return
+            yield chunk
+
+    def __repr__(self):
+        return "#<stream>"
+
+
+class StreamPair(Stream):
+    """ A first element and a rest, both Promises"""
+    __slots__ = ("first", "rest")
+
+    def __init__(self, first, rest):
+        self.first = first
+        self.rest = rest
+
+    def isEmpty(self):
+        return False
+
+    def head(self):
+        return self.first.force()
+
+    def tail(self):
+        return self.rest.force()
+
+
+class Range(Stream):
+    """ The numbers from start up to end, not included, by step"""
+    __slots__ = ("start", "end", "step")
+
+    def __init__(self, start, end, step=1):
+        if step == 0:
+            raise racython.RacythonException("in-range: the step can't be 0")
+        self.start = start
+        self.end = end
+        self.step = step
+
+    def integral(self):
+        return type(self.start) is int and type(self.end) is int and type(self.step) is int
+
+    def isEmpty(self):
+        return self.start >= self.end if self.step > 0 else self.start <= self.end
+
+    def head(self):
+        return self.start
+
+    def tail(self):
+        return Range(self.start + self.step, self.end, self.step)
+
+    def __iter__(self):
+        if self.integral():
+            return iter(range(self.start, self.end, self.step))
+        return Stream.__iter__(self)
+
+    def chunks(self):
+        if not self.integral():
+            return Stream.chunks(self)
+        numbers = range(self.start, self.end, self.step)
+        return (list(numbers[i:i + CHUNK]) for i in range(0, len(numbers), CHUNK))
+
+
+class StreamMap(Stream):
+    """ function applied to every element of source"""
+    __slots__ = ("function", "source", "value", "ran", "next")
+
+    def __init__(self, function, source):
+        self.function = function
+        self.source = source
+        # The first element and the rest once asked for, so function only runs once on it
+        self.value = None
+        self.ran = False
+        self.next = None
+
+    def isEmpty(self):
+        return empty(self.source)
+
+    def head(self):
+        if not self.ran:
+            self.value = racython.apply(self.function, [first(self.source)])[0]
+            self.ran = True
+        return self.value
+
+    def tail(self):
+        if self.next is None:
+            self.next = StreamMap(self.function, rest(self.source))
+        return self.next
+
+    def __iter__(self):
+        if kernel(self.function) is not None:
+            return itertools.chain.from_iterable(self.chunks())
+        return map(caller(self.function), self.source)
+
+    def chunks(self):
+        node = kernel(self.function)
+        if node is None:
+            return Stream.chunks(self)
+        return (bulk.compute(node, chunk) for chunk in chunks(self.source))
+
+
+class StreamFilter(Stream):
+    """ The elements of source function holds for"""
+    __slots__ = ("function", "source", "found", "next")
+
+    def __init__(self, function, source):
+        self.function = function
+        self.source = source
+        # source from its first element function holds for on, once looked for
+        self.found = None
+        self.next = None
+
+    def find(self):
+        """ -> Stream
+            source without the elements before the first one function holds for"""
+        if self.found is None:
+            stream = self.source
+            while not empty(stream) and not racython.apply(self.function, [first(stream)])[0]:
+                stream = rest(stream)
+            self.found = stream
+        return self.found
+
+    def isEmpty(self):
+        return empty(self.find())
+
+    def head(self):
+        return first(self.find())
+
+    def tail(self):
+        if self.next is None:
+            self.next = StreamFilter(self.function, rest(self.find()))
+        return self.next
+
+    def __iter__(self):
+        if kernel(self.function) is not None:
+            return itertools.chain.from_iterable(self.chunks())
+        return filter(caller(self.function), self.source)
+
+    def chunks(self):
+        node = kernel(self.function)
+        if node is None:
+            return Stream.chunks(self)
+        return (list(itertools.compress(chunk, bulk.compute(node, chunk))) for chunk in chunks(self.source))
+
+
+def kernel(function):
+    """ Procedure -> [Or Kernel None]
+        The bulk Kernel for function with one argument, None if there is none"""
+    try:
+        return bulk.kernel(function, 1)
+    except bulk.Unsupported:
+        return None
+
+
+def caller(function):
+    """ Procedure -> Procedure
+        A Python function calling function with one argument"""
+    if type(function) is racython.closure:
+        return lambda value: racython.apply(function, [value])[0]
+    return function
+
+
+def empty(stream):
+    """ Stream -> Boolean
+        Whether stream has no elements"""
+    kind = type(stream)
+    if kind is racket_functions.Pair:
+        return False
+    if kind is racket_functions.Empty:
+        return True
+    if isinstance(stream, Stream):
+        return stream.isEmpty()
+    raise racython.RacythonException("expected a stream, given " + repr(stream))
+
+
+def first(stream):
+    """ Stream -> Value
+        The first element of a stream that isn't empty"""
+    if type(stream) is racket_functions.Pair:
+        return stream.first
+    return stream.head()
+
+
+def rest(stream):
+    """ Stream -> Stream
+        The rest of a stream that isn't empty"""
+    if type(stream) is racket_functions.Pair:
+        return stream.rest
+    return stream.tail()
+
+
+def chunks(stream):
+    """ Stream -> [Generator [ListOf Value]]
+        The elements of stream, in lists of at most CHUNK of them"""
+    if isinstance(stream, Stream):
+        return stream.chunks()
+    return Stream.chunks(stream)
+
+
+def folded(function, base, stream):
+    """ Procedure Value Stream -> Value
+        foldl of function over the elements of stream, without holding more than CHUNK of them at once"""
+    try:
+        bulk.kernel(function, 2)
+    except bulk.Unsupported:
+        # Its calls have to take turns with those of the stream's functions
+        acc = base
+        for elem in stream:
+            acc = racython.apply(function, [elem, acc])[0]
+        return acc
+    acc = base
+    for chunk in chunks(stream):
+        result = bulk.folded(function, acc, chunk)
+        if result is not None:
+            acc = result[0]
+            continue
+        for elem in chunk:
+            acc = racython.apply(function, [elem, acc])[0]
+    return acc
+
+
+# Imported last, see the note on the import cycle in racython
+import bulk
+import racket_functions
+import racython
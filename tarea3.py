@@ -1,3 +1,4 @@
+import ports
 import racython
 import sys
 
@@ -15,11 +16,47 @@ def interp(expr, env=racython.getEnv()):
     return racython.interp(expr, env)
 
 
-def run(string):
+def run(string, engine="interp", strict=False):
     """ String -> String
-            Executes the given single function call racket program"""
-    return str(racython.run(string))
+            Executes the given single function call racket program, with strict its free identifiers are reported
+            with a FreeIdentifierError before it runs"""
+    return str(racython.run(string, engine=engine, strict=strict))
+
+
+def runFile(path, engine="interp", strict=False):
+    """ String -> [Generator String]
+        Executes the racket program in the file at path, or in stdin if path is "-", yielding each result as soon
+        as its form has run. With strict, the free identifiers of a file are reported with a FreeIdentifierError
+        before any of it runs. stdin is never checked up front, that would wait for all of it."""
+    if path == "-":
+        # Line at a time, so results come back as soon as each form is typed
+        for value in racython.runStream(sys.stdin, engine, chunkSize=None):
+            yield str(value)
+        return
+    with open(path) as source:
+        for value in racython.runStream(source, engine, strict=strict):
+            yield str(value)
+
+
+def testFile(path, engine="interp"):
+    """ String -> checks.Summary
+        Runs the racket program in the file at path with its check-expects left for last, printing the results
+        of the other forms and the summary of the checks"""
+    with open(path) as source:
+        return racython.runFile(source.read(), engine, dict(racython.topLevelEnv), checks=True)
 
 
 if __name__ == '__main__':
-    print(run(sys.argv[1]))
+    strict = "--strict" in sys.argv
+    if strict:
+        sys.argv.remove("--strict")
+    if sys.argv[1] == "--file":
+        for result in runFile(sys.argv[2], strict=strict):
+            ports.flush()
+            print(result, flush=True)
+    elif sys.argv[1] == "--test":
+        sys.exit(1 if testFile(sys.argv[2]).failed else 0)
+    else:
+        result = run(sys.argv[1], strict=strict)
+        ports.flush()
+        print(result)
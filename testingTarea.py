@@ -1,9 +1,36 @@
 import unittest
 
 from racython import run, stripSemiColonComments, stripComments, stripMLComments, interp, topLevelEnv, \
-    closure, apply
+    closure, apply, Env
 import racython
+import racket_functions
+import reader
+import io
+import resolver
+import compiler
+import vm
+import sys
 import tarea3
+import cache
+import tempfile
+import benchmark
+import profiler
+import memo
+import optimizer
+import bulk
+import parallel
+import checks
+import server
+import ports
+import client
+import incremental
+import batch
+import subprocess
+import time
+import json
+import pickle
+import os
+import gc
 
 
 class TestInterpreterInternals(unittest.TestCase):
@@ -132,5 +159,984 @@ class TestRacketInterpreter(unittest.TestCase):
         self.assertRaises(KeyError, tarea3.run, "(with (y (+ 30 y)) (+ x (- y 40)))")
 
 
+class TestEnv(unittest.TestCase):
+    def test_frames(self):
+        outer = Env({"x": 1, "y": 2})
+        inner = outer.child({"x": 3})
+        self.assertEqual(inner["x"], 3)
+        self.assertEqual(inner["y"], 2)
+        inner["y"] = 4
+        self.assertEqual(inner["y"], 4)
+        self.assertEqual(outer["y"], 2)
+        self.assertRaises(KeyError, inner.__getitem__, "z")
+
+    def test_capture(self):
+        env = Env({"x": 1}).child({"y": 2})
+        snapshot = env.capture()
+        self.assertIs(env.capture(), snapshot)
+        env["y"] = 5
+        self.assertEqual(snapshot["y"], 2)
+        self.assertIsNot(env.capture(), snapshot)
+        self.assertIs(env.capture().parent, snapshot.parent)
+
+    def test_closure_calls(self):
+        self.assertEqual(run("((fun (f) (+ (f 1) (f 2))) (fun (x) (with (y 10) (+ x y))))"), 23)
+        self.assertEqual(run("""((fun (fib) (fib fib 15))
+                                 (fun (self n) (if0 (< n 2) n (+ (self self (- n 1)) (self self (- n 2))))))"""), 610)
+
+
+# Programs every engine has to agree with interp on
+PROGRAMS = ["(+ 1 1)",
+            "(modulo 11 2)",
+            "(equal? (list 1 2) (list 1 2))",
+            "(<= 3 3)",
+            "(((fun (x) x) (fun (x) (+ x 5))) 3)",
+            """((fun (abs) (list (abs (- 5 7)) (abs (- 7 5)))) (fun (x) (if0 ( < x 0) (- 0 x) x)))""",
+            "(if0 (if0 0 2 (+ 0 0)) (+ (if0 1 450 900) 23) (+ 6 9))",
+            "(and #true #false #true)",
+            "(or #false #false #false)",
+            "(not #false)",
+            "(cons 0 (list 1 2 3 4))",
+            "(rest (list 1 2 3 4))",
+            "(reverse (list 1 2 3))",
+            "(empty? empty)",
+            "(build-list 5 (fun (x) (* 2 x)))",
+            "(begin (* 3 3) (/ 2 2) (+ 1 1))",
+            "(with (f (fun (y) (+ x y))) (+ 2 3))",
+            "(with (x 3) (with (f (fun (y) (+ x y))) (with (x 5) (f 4))))",
+            "(with (x 3) (+ (seqn (set x 5) x) x))",
+            "(with (x 3) (with (f (fun (y) (- x y))) (seqn (set x 15) (f 10))))",
+            "(with (x 3) (seqn (set x 15) (with (f (fun (y) (- x y))) (f 10))))",
+            "((fun (x) (seqn (set y x) (with (f (fun (z) (+ y z))) (seqn (set y 100) (f 1))))) 5)",
+            "((fun (x) (+ (seqn (set x 2) x) x)) 1)",
+            """((fun (fib) (fib fib 12))
+               (fun (self n) (if0 (< n 2) n (+ (self self (- n 1)) (self self (- n 2))))))"""]
+
+
+class TestResolver(unittest.TestCase):
+    def test_same_as_interp(self):
+        for program in PROGRAMS:
+            self.assertEqual(run(program, env=dict(topLevelEnv), engine="resolve"),
+                             run(program, env=dict(topLevelEnv)), program)
+
+    def test_addresses(self):
+        node, free = resolver.resolve(tarea3.parser("(fun (x) (with (y 1) (+ x y)))"))
+        self.assertEqual(free, [])
+        add = node.body.body
+        self.assertEqual(add.function, resolver.Global(2, "+"))
+        self.assertEqual(add.args[0].depth, 1)
+        self.assertEqual(add.args[1].depth, 0)
+
+    def test_free(self):
+        node, free = resolver.resolve(tarea3.parser("(with (f (fun (y) (+ x (+ z x)))) (+ 2 3))"))
+        self.assertEqual(free, ["x", "z"])
+        self.assertRaises(racython.FreeIdentifierError, resolver.resolve,
+                          tarea3.parser("(with (f (fun (y) (+ x y))) 1)"), topLevelEnv, True)
+        self.assertRaises(KeyError, run, "(with (f (fun (y) (+ x y))) (f 3))", engine="resolve")
+
+    def test_strict(self):
+        # Nothing runs, not even what comes before the free identifier
+        program = "(display 1)\n(define f (fun (y) (+ x (g y))))\n(display 2)\n(f 3)\n(define g (fun (y) y))"
+        for engine in ["interp", "resolve", "compile", "vm"]:
+            with ports.redirect(io.StringIO()) as (output, _):
+                with self.assertRaises(racython.FreeIdentifierError) as raised:
+                    racython.runFile(program, engine, dict(topLevelEnv), cache=False, strict=True)
+                with self.assertRaises(racython.FreeIdentifierError):
+                    list(racython.runStream(io.StringIO(program), engine, dict(topLevelEnv), strict=True))
+                with self.assertRaises(racython.FreeIdentifierError):
+                    run("(seqn (display 1) (z 2))", dict(topLevelEnv), engine=engine, strict=True)
+            self.assertEqual(raised.exception.args, ("x",))
+            self.assertEqual(output.stream.getvalue(), "")
+        self.assertRaises(racython.FreeIdentifierError, tarea3.run, "(with (f (fun (y) z)) 1)", strict=True)
+        self.assertEqual(tarea3.run("(with (f (fun (y) z)) 1)"), "1")
+
+
+class TestCompiler(unittest.TestCase):
+    def test_same_as_interp(self):
+        for program in PROGRAMS:
+            self.assertEqual(run(program, env=dict(topLevelEnv), engine="compile"),
+                             run(program, env=dict(topLevelEnv)), program)
+        self.assertEqual(tarea3.run("(if0 (< 5 0) 5 6)", engine="compile"), "6")
+
+    def test_closures(self):
+        add = run("(fun (x y) (+ x y))", engine="compile")
+        self.assertIsInstance(add, compiler.Closure)
+        self.assertEqual(apply(add, [1, 2])[0], 3)
+        self.assertEqual(add(1, 2, 3), 3)
+        self.assertRaises(KeyError, tarea3.run, "(with (f (fun (y) (+ x y))) (f 3))", "compile")
+
+
+class TestVM(unittest.TestCase):
+    def test_same_as_interp(self):
+        for program in PROGRAMS:
+            self.assertEqual(run(program, env=dict(topLevelEnv), engine="vm"),
+                             run(program, env=dict(topLevelEnv)), program)
+        self.assertEqual(tarea3.run("(if0 (< 5 0) 5 6)", engine="vm"), "6")
+
+    def test_deep_recursion(self):
+        # Neither the non tail recursive sum nor the tail recursive count touch the Python stack
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(1000)
+        try:
+            self.assertEqual(run("""((fun (sum) (sum sum 100000))
+                                     (fun (self n) (if0 (equal? n 0) 0 (+ n (self self (- n 1))))))""",
+                                 engine="vm"), 5000050000)
+            self.assertEqual(run("""((fun (count) (count count 100000 0))
+                                     (fun (self n acc) (if0 (equal? n 0) acc (self self (- n 1) (add1 acc)))))""",
+                                 engine="vm"), 100000)
+        finally:
+            sys.setrecursionlimit(limit)
+
+    def test_disassemble(self):
+        code = vm.assemble(resolver.resolve(tarea3.parser("(with (x 3) (fun (y) (+ x y)))"))[0])
+        listing = vm.disassemble(code)
+        self.assertIn("ENTER", listing)
+        self.assertIn("<fun/1> arity=1 size=1", listing)
+        self.assertIn("TAIL_CALL", listing)
+        self.assertEqual(apply(vm.execute(code, racython.toEnv(topLevelEnv)), [4])[0], 7)
+
+
+class TestTailCalls(unittest.TestCase):
+    def test_tail_positions(self):
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(1000)
+        try:
+            self.assertEqual(run("""((fun (loop) (loop loop 10000))
+                                     (fun (self n) (if0 (equal? n 0) 0
+                                                        (with (m (- n 1)) (seqn (set n m) (self self n))))))"""), 0)
+        finally:
+            sys.setrecursionlimit(limit)
+
+    def test_million_iterations(self):
+        # 10^6 iterations with a 1000 frame Python stack, in well under the memory a frame per iteration would need
+        import resource
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(1000)
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        try:
+            self.assertEqual(run("""((fun (count) (count count 1000000 0))
+                                     (fun (self n acc) (if0 (equal? n 0) acc (self self (- n 1) (add1 acc)))))"""),
+                             1000000)
+        finally:
+            sys.setrecursionlimit(limit)
+        # ru_maxrss is in KiB on Linux
+        self.assertLess(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before, 64 * 1024)
+
+
+class TestLists(unittest.TestCase):
+    def test_persistent(self):
+        tail = run("(list 1 2 3)")
+        longer = racket_functions.racket_cons(0, tail)
+        self.assertEqual(tail, [1, 2, 3])
+        self.assertIs(racket_functions.racket_rest(longer), tail)
+        self.assertIs(run("(rest (list 1))"), racket_functions.EMPTY)
+        self.assertEqual(tarea3.run("(cons 0 (list 1 2))"), "[0, 1, 2]")
+
+    def test_conversions(self):
+        lst = racket_functions.fromList([1, [2, 3], 4])
+        self.assertEqual(racket_functions.racket_length(lst), 3)
+        self.assertEqual(racket_functions.toList(run("(list 1 (list 2 3) 4)")), [1, [2, 3], 4])
+        self.assertEqual(racket_functions.toList(racket_functions.EMPTY), [])
+        self.assertNotEqual(run("(list 1 2)"), run("(list 1 2 3)"))
+        self.assertEqual(hash(run("(list 1 2)")), hash(run("(cons 1 (cons 2 empty))")))
+
+    def test_list_functions(self):
+        self.assertEqual(run("(foldl cons empty (list 1 2 3))"), [3, 2, 1])
+        self.assertEqual(run("(foldr cons empty (list 1 2 3))"), [1, 2, 3])
+        self.assertEqual(run("(filter even? (build-list 6 add1))"), [2, 4, 6])
+        self.assertEqual(run("(map add1 (list 1 2))"), [2, 3])
+        self.assertEqual(run("(list-ref (list 1 2 3) 2)"), 3)
+        self.assertEqual(run("(andmap (fun (x) (< x 3)) (list 1 2))"), True)
+
+    def test_errors(self):
+        for engine in ["interp", "resolve", "compile", "vm"]:
+            for program, name in [("(first empty)", "first"), ("(rest empty)", "rest"),
+                                  ("(second (list 1))", "second"), ("(third (list 1 2))", "third"),
+                                  ("(list-ref (list 1 2) 5)", "list-ref"),
+                                  ("(list-ref (list 1 2 3) -1)", "list-ref")]:
+                with self.assertRaises(racython.RacythonException) as raised:
+                    run(program, dict(topLevelEnv), engine=engine)
+                self.assertTrue(str(raised.exception).startswith(name + ":"), program)
+
+
+class TestVectors(unittest.TestCase):
+    def test_vector_functions(self):
+        self.assertEqual(run("(vector-length (make-vector 4 0))"), 4)
+        self.assertEqual(run("(vector-ref (vector 1 2 3) 1)"), 2)
+        self.assertEqual(run("(with (v (make-vector 3 0)) (seqn (vector-set! v 1 5) (vector->list v)))"), [0, 5, 0])
+        self.assertEqual(run("(vector->list (build-vector 3 add1))"), [1, 2, 3])
+        self.assertEqual(run("(equal? (vector 1 2) (list->vector (list 1 2)))"), True)
+
+    def test_storage(self):
+        vector = run("(make-vector 3 0)")
+        self.assertEqual(vector.items.typecode, "q")
+        vector[0] = 2 ** 70
+        self.assertEqual(list(vector), [2 ** 70, 0, 0])
+        self.assertIsInstance(vector.items, list)
+        self.assertEqual(list(run("(make-vector 2 #false)")), [False, False])
+        self.assertRaises(IndexError, racket_functions.racket_vectorSet, run("(vector 1)"), 1, "x")
+
+    def test_range(self):
+        # Negative indexes don't count from the end
+        for engine in ["interp", "resolve", "compile", "vm"]:
+            for program in ["(vector-ref (vector 1 2 3) -1)", "(vector-set! (vector 1 2 3) -1 9)",
+                            "(vector-ref (vector 1 2 3) 3)"]:
+                with self.assertRaises(racython.RangeError) as raised:
+                    run(program, dict(topLevelEnv), engine=engine)
+                self.assertIn("index is out of range", str(raised.exception))
+            for program, message in [("(vector-ref (vector) 0)", "vector-ref: index 0 out of range for empty vector"),
+                                     ("(list-ref empty 2)", "list-ref: index 2 out of range for empty list")]:
+                with self.assertRaises(racython.RangeError) as raised:
+                    run(program, dict(topLevelEnv), engine=engine)
+                self.assertEqual(str(raised.exception), message)
+
+
+class TestReader(unittest.TestCase):
+    source = """; comment
+(define x 5) #| block #| nested |# comment |# [foo "s;tr\\"q" 1.5 -3 - +x]
+  'sym '(1 a (b)) "5" x#y
+(if0 #true 1 2)   """
+
+    def test_forms(self):
+        forms = list(reader.read(io.StringIO(self.source)))
+        self.assertEqual([form.rexp for form in forms],
+                         [["define", "x", 5], ["foo", "\"s;tr\"q\"", 1.5, -3, "-", "+x"], "\"sym\"",
+                          ["list", 1, "\"a\"", ["list", "\"b\""]], 5, "x#y", ["if0", "#true", 1, 2]])
+        self.assertEqual([(form.line, form.column) for form in forms],
+                         [(2, 1), (2, 47), (3, 4), (3, 9), (3, 19), (3, 23), (4, 1)])
+
+    def test_chunks(self):
+        # Tokens, comments and strings split across reads come out the same
+        expected = list(reader.read(io.StringIO(self.source)))
+        for size in range(1, 12):
+            self.assertEqual(list(reader.read(io.StringIO(self.source), size)), expected)
+
+    def test_lazy(self):
+        forms = reader.read(io.StringIO("(+ 1 2) (+ 3"))
+        self.assertEqual(next(forms).rexp, ["+", 1, 2])
+        self.assertRaises(racython.ReadError, next, forms)
+
+    def test_errors(self):
+        for source, line, column in [("(a\n(b)", 1, 1), ("a)", 1, 2), ("\n\"abc", 2, 1), ("#| x", 1, 5)]:
+            with self.assertRaises(racython.ReadError) as error:
+                list(reader.read(io.StringIO(source)))
+            self.assertEqual((error.exception.line, error.exception.column), (line, column))
+        self.assertRaises(racython.ReadError, tarea3.parser, "(+ 1 2) (+ 3 4)")
+
+    def test_runFile(self):
+        self.assertEqual(racython.runFile("(define x 3) ; x is 3\n#| (define x 4) |#\n(+ x 1)",
+                                          engine="compile", env=dict(topLevelEnv), cache=False), [None, 4])
+
+
+class Lines(object):
+    """ A stream handing out a fixed list of lines, remembering how many it has handed out"""
+    def __init__(self, lines):
+        self.lines = lines
+        self.given = 0
+
+    def readline(self):
+        self.given += 1
+        return self.lines[self.given - 1] if self.given <= len(self.lines) else ""
+
+
+class TestStream(unittest.TestCase):
+    def test_lazy(self):
+        stream = Lines(["(define x 3)\n", "(+ x\n", "4)\n", "(* x 2)\n"])
+        results = racython.runStream(stream, env=dict(topLevelEnv), chunkSize=None)
+        self.assertEqual(next(results), None)
+        self.assertEqual(stream.given, 1)
+        self.assertEqual(next(results), 7)
+        self.assertEqual(stream.given, 3)
+        self.assertEqual(list(results), [6])
+
+    def test_engines(self):
+        source = "(define x 3)\n(with (f (fun (y) (+ x y))) (f 4))\n(list x 2)"
+        for engine in ["interp", "resolve", "compile", "vm"]:
+            self.assertEqual(list(racython.runStream(io.StringIO(source), engine, dict(topLevelEnv), 5)),
+                             [None, 7, [3, 2]])
+
+    def test_file(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".rkt", delete=False) as source:
+            source.write("(+ 3 1) (list 1 2)")
+        try:
+            self.assertEqual(list(tarea3.runFile(source.name, "vm")), ["4", "[1, 2]"])
+        finally:
+            os.remove(source.name)
+
+
+class TestProfiler(unittest.TestCase):
+    source = """(define square (fun (x) (* x x)))
+                (define sum (fun (self lst acc) (if0 (empty? lst) acc (self self (rest lst) (+ acc (square (first lst)))))))
+                (sum sum (list 1 2 3) 0)
+                (map (fun (x) (+ x 1)) (list 1 2))"""
+
+    def test_counts(self):
+        values, profiled = profiler.profile(self.source, memory=True)
+        self.assertEqual(values, [None, None, 14, [2, 3]])
+        calls = dict((name, stats.calls) for name, stats in profiled.stats.items())
+        self.assertEqual((calls["sum"], calls["square"], calls["*"], calls["fun (x)"], calls["map"]), (4, 3, 3, 2, 1))
+        self.assertTrue(all(stats.exclusive <= stats.inclusive + 1e-9 for stats in profiled.stats.values()))
+        self.assertIn("square", profiled.report())
+        self.assertIn("sum;square;* ", profiled.collapsed())
+        self.assertIn("map;fun (x);+ ", profiled.collapsed())
+
+    def test_restores(self):
+        interpreter, env = racython.interp, dict(topLevelEnv)
+        with self.assertRaises(SystemExit):
+            with profiler.Profiler(env):
+                racython.run("(+ 1 y)", env)
+        self.assertIs(racython.interp, interpreter)
+        self.assertIs(env["+"], topLevelEnv["+"])
+
+    def test_engines(self):
+        values, profiled = profiler.profile(self.source, "vm")
+        self.assertEqual(values[2], 14)
+        self.assertEqual(profiled.stats["*"].calls, 3)
+        self.assertNotIn("square", profiled.stats)
+
+
+class TestMemo(unittest.TestCase):
+    def forms(self, source):
+        return [form.rexp for form in reader.read(io.StringIO(source))]
+
+    def test_fib(self):
+        fib = "((fun (fib) (fib fib 80)) (fun (self n) (if0 (< n 2) n (+ (self self (- n 1)) (self self (- n 2))))))"
+        for engine in ["interp", "resolve", "compile", "vm"]:
+            self.assertEqual(run(fib, dict(topLevelEnv), engine=engine, memoize=True), 23416728348467685)
+
+    def test_purity(self):
+        forms = self.forms("""(define square (fun (x) (* x x)))
+                              (define quad (fun (x) (square (square x))))
+                              (define noisy (fun (x) (seqn (display x) x)))
+                              (define loud (fun (x) (noisy x)))
+                              (define adder (fun (a) (fun (x) (+ x a))))
+                              (with (log (fun (x) (error x))) (with (g (fun (y) (log y))) (g 1)))""")
+        memoized = memo.memoize(forms, 10)
+        self.assertEqual([rexp[2][0] == "memo" for rexp in memoized[:5]], [True, True, False, False, True])
+        self.assertEqual(memoized[5][1][1][0], "fun")
+        self.assertEqual(memoized[5][2][1][1][0], "fun")
+        # A program with its own memo is left alone
+        self.assertEqual(memo.memoize(self.forms("(define memo 1)"), 10), self.forms("(define memo 1)"))
+
+    def test_closures(self):
+        source = "(define adder (fun (a) (fun (x) (+ x a))))\n(list ((adder 1) 2) ((adder 2) 2) ((adder 1) 5))"
+        self.assertEqual(racython.runFile(source, env=dict(topLevelEnv), cache=False, memoize=True)[1], [3, 4, 6])
+
+    def test_counters(self):
+        env = dict(topLevelEnv)
+        run("(define f (memo (fun (x) (* x 2)) 2))", env)
+        self.assertEqual(run("(list (f 1) (f 2) (f 1) (f 3) (f 2) (f 1.0))", env), [2, 4, 2, 6, 4, 2.0])
+        self.assertEqual(env["f"].stats(), {"hits": 1, "misses": 5, "bypassed": 0, "evictions": 3, "entries": 2})
+        # Vectors and plain closures can't be keys, those calls skip the cache
+        run("(define g (memo (fun (x) x)))", env)
+        self.assertEqual(run("(list (g (list 1 2)) (g (list 1 2)))", env), [[1, 2], [1, 2]])
+        run("(g (make-vector 1 0))", env)
+        run("(g (fun (y) y))", env)
+        self.assertEqual(env["g"].stats(), {"hits": 1, "misses": 1, "bypassed": 2, "evictions": 0, "entries": 1})
+
+
+FOLDABLE = ["(if0 (< 5 0) 5 6)",
+            "(+ (* 2 3) (+ (- 10 (add1 4)) (modulo 7 3)))",
+            "(if0 (and #true (odd? 3)) (/ 9 2) 0)",
+            "(/ 1 (- 2 2.5))",
+            "(with (x 3) (with (f (fun (y) (+ x y))) (f (* 2 x))))",
+            "(with (x 3) (with (f (fun (y) (* x y))) (list (f 1) (f 2))))",
+            "(with (x 2) (with (x (+ x 1)) x))",
+            "(with (g (fun (y) (+ y 1))) (with (y 10) (g y)))",
+            "(with (f (fun () y)) (with (y 5) 1))",
+            "(seqn 5 (seqn (fun (x) x) (not #false)))",
+            "((fun (+) (+ 1 2)) -)",
+            "((fun (x) (with (y 2) (seqn (set x y) (+ x y)))) 1)",
+            "(with (n 4) ((fun (f) (f f n)) (fun (self n) (if0 (< n 1) 1 (* n (self self (- n 1)))))))"]
+
+
+class TestOptimizer(unittest.TestCase):
+    def test_corpus(self):
+        for program in PROGRAMS + FOLDABLE:
+            expected = run(program, env=dict(topLevelEnv))
+            for engine in ["interp", "resolve", "compile", "vm"]:
+                self.assertEqual(run(program, env=dict(topLevelEnv), engine=engine, optimize=True), expected,
+                                 program + " " + engine)
+
+    def test_report(self):
+        optimized, report = optimizer.optimize(tarea3.parser("(with (x 3) (if0 (< x 0) (+ x 1) (* x 2)))"))
+        self.assertEqual(optimized, 6)
+        self.assertEqual(report, optimizer.Report(19, 1, 2, 1, 1, 0))
+        optimized, report = optimizer.optimize(tarea3.parser("(with (x (f 1)) (+ x x))"))
+        self.assertEqual(report.before, report.after)
+
+    def test_shadowed(self):
+        env = dict(topLevelEnv)
+        run("(define + -)", env)
+        self.assertEqual(optimizer.optimize(["+", 3, 1], env)[0], ["+", 3, 1])
+        self.assertEqual(optimizer.optimize(["*", 3, 1], env)[0], 3)
+        self.assertEqual(optimizer.optimize(["seqn", ["define", "*", "+"], ["*", 3, 1]])[0],
+                         ["seqn", ["define", "*", "+"], ["*", 3, 1]])
+        # Calls that fail are left to fail when run
+        self.assertEqual(optimizer.optimize(["/", 1, 0])[0], ["/", 1, 0])
+
+
+BULK = ["(map add1 (build-list 100 (fun (i) (- i 50))))",
+        "(map (fun (x) (* x 1.5)) (build-list 100 (fun (i) i)))",
+        "(map (fun (x) (/ x 3)) (build-list 100 (fun (i) (- i 50))))",
+        "(map (fun (x) (modulo x -7)) (build-list 100 (fun (i) (- i 50))))",
+        "(map (fun (x) (modulo x 2.5)) (map (fun (x) (* x 0.7)) (build-list 100 (fun (i) (- i 50)))))",
+        "(map (fun (x) (* (* x x) x)) (build-list 100 (fun (i) (* i 1000000000000))))",
+        "(with (k 7) (map (fun (x) (+ x k)) (build-list 100 (fun (i) i))))",
+        "(filter odd? (build-list 100 (fun (i) (- i 50))))",
+        "(filter (fun (x) (equal? x 3.0)) (build-list 100 (fun (i) i)))",
+        "(build-list 100 (fun (i) (< i 3)))",
+        "(build-list 100 (fun (i) 5))",
+        "(foldl (fun (x acc) (+ acc (* x 0.1))) 0 (build-list 100 (fun (i) i)))",
+        "(foldr (fun (x acc) (* x acc)) 1 (build-list 30 (fun (i) (add1 i))))",
+        "(foldr - 0 (build-list 30 (fun (i) i)))",
+        "(foldl + 0 (map (fun (x) (seqn (display x) x)) (list 1 2 3)))"]
+
+
+class TestBulk(unittest.TestCase):
+    def run_all(self, program):
+        minimum, arrays, numpy = bulk.MINIMUM, bulk.ARRAY_MINIMUM, bulk.getNumpy()
+        bulk.ARRAY_MINIMUM = 0
+        try:
+            bulk.MINIMUM = len(program) + 10 ** 9
+            expected = run(program, dict(topLevelEnv))
+            bulk.MINIMUM = minimum
+            results = [run(program, dict(topLevelEnv))]
+            bulk.numpy = None
+            results.append(run(program, dict(topLevelEnv)))
+        finally:
+            bulk.MINIMUM, bulk.ARRAY_MINIMUM, bulk.numpy = minimum, arrays, numpy
+        return expected, results
+
+    def test_same_results(self):
+        for program in BULK:
+            expected, results = self.run_all(program)
+            for result in results:
+                self.assertEqual(result, expected, program)
+                if isinstance(expected, racket_functions.Pair):
+                    self.assertEqual([type(x) for x in result], [type(x) for x in expected], program)
+
+    def test_kernels(self):
+        self.assertEqual(bulk.kernel(topLevelEnv["add1"], 1)[1], "add1")
+        square = run("(fun (x) (* x x))", dict(topLevelEnv))
+        self.assertEqual(bulk.kernel(square, 1), ("call", "*", topLevelEnv["*"], [("arg", 0), ("arg", 0)]))
+        for program in ["(fun (x) (display x))", "(fun (x) (if0 x 1 2))", "(fun (f) (f 1))"]:
+            self.assertRaises(bulk.Unsupported, bulk.kernel, run(program, dict(topLevelEnv)), 1)
+        # Names are looked up in the closure's env, not topLevelEnv
+        shadowed = run("(with (* +) (fun (x) (* x x)))", dict(topLevelEnv))
+        self.assertEqual(bulk.kernel(shadowed, 1)[1], "+")
+
+    def test_errors(self):
+        self.assertRaises(ZeroDivisionError, run, "(map (fun (x) (/ 1 x)) (build-list 100 (fun (i) i)))",
+                          dict(topLevelEnv))
+
+
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        self.saved = parallel.WORKERS, parallel.MINIMUM
+        parallel.WORKERS, parallel.MINIMUM = 2, 8
+
+    def tearDown(self):
+        parallel.WORKERS, parallel.MINIMUM = self.saved
+
+    def test_same_as_map(self):
+        # if0 keeps bulk from taking these
+        for engine in ["interp", "resolve", "compile", "vm"]:
+            for program in ["(%s (fun (x) (if0 (odd? x) (list x (add1 x)) x)) (build-list 100 (fun (i) i)))",
+                            "(%s (fun (x) (if0 (odd? x) x 0)) (list 1 2 3))"]:
+                self.assertEqual(run(program % "pmap", dict(topLevelEnv), engine=engine),
+                                 run(program % "map", dict(topLevelEnv), engine=engine))
+            self.assertEqual(run("(pbuild-list 50 (fun (i) (if0 (odd? i) i (vector i))))", dict(topLevelEnv),
+                                 engine=engine),
+                             run("(build-list 50 (fun (i) (if0 (odd? i) i (vector i))))", dict(topLevelEnv),
+                                 engine=engine))
+
+    def test_errors(self):
+        for program, index in [("(pmap (fun (x) (/ 1 (- x 37))) (build-list 100 (fun (i) i)))", 37),
+                               ("(pbuild-list 100 (fun (i) (if0 (> i 60) (error) i)))", 61)]:
+            with self.assertRaises(racython.ElementError) as raised:
+                run(program, dict(topLevelEnv))
+            self.assertEqual((raised.exception.index, raised.exception.element), (index, index))
+        self.assertIsInstance(raised.exception.__cause__, racython.RacythonException)
+
+    def test_output(self):
+        # What workers display comes back in the order of the elements
+        with ports.redirect(io.StringIO()) as (output, _):
+            run("(pmap (fun (x) (seqn (display x) (if0 (odd? x) x 0))) (build-list 100 (fun (i) i)))",
+                dict(topLevelEnv))
+        self.assertEqual(output.stream.getvalue(), "".join("%d\n" % i for i in range(100)))
+
+    def test_forked_output(self):
+        # Workers don't write out again what was displayed before they started, and the pool stops quietly
+        script = ("import parallel, racython\n"
+                  "parallel.WORKERS = 4\n"
+                  "racython.run('(seqn (display 12345) '\n"
+                  "             '(pmap (fun (x) (if0 (odd? x) x 0)) (build-list 100 (fun (i) i))))')")
+        process = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual((process.stdout, process.stderr), ("12345\n", ""))
+
+    def test_pickling(self):
+        # Long lists and closures over topLevelEnv make it to the workers whole
+        lst = racket_functions.fromList(range(100000))
+        self.assertEqual(pickle.loads(pickle.dumps(lst)), lst)
+        function = run("(with (k 3) (fun (x) (+ x k)))", dict(topLevelEnv))
+        self.assertEqual(racython.apply(pickle.loads(pickle.dumps(function)), [1])[0], 4)
+
+
+CHECKS = """(define sq (fun (x) (* x x)))
+(check-expect (sq 3) 9)
+(check-expect (sq 3) 10)
+(sq 5)
+(check-expect (/ 1 0) 1)
+(check-expect (seqn (define y 1) y) 1)
+(check-expect (with (y 2) y) 2)
+(check-expect (list (sq 1) (sq 2)) (list 1 4))
+(check-expect (sq 6) 36)
+(check-expect (sq 7) 49)
+"""
+
+
+class TestChecks(unittest.TestCase):
+    def setUp(self):
+        self.saved = parallel.WORKERS, checks.MINIMUM
+        checks.MINIMUM = 2
+
+    def tearDown(self):
+        parallel.WORKERS, checks.MINIMUM = self.saved
+
+    def test_summary(self):
+        for workers in [1, 2]:
+            parallel.WORKERS = workers
+            for engine in ["interp", "resolve", "compile", "vm"]:
+                values, summary = checks.runFile(CHECKS, engine)
+                self.assertEqual(values, [None, 25])
+                self.assertEqual(len(summary.checks), 8)
+                self.assertEqual([(check.line, check.actual) for check in summary.failed], [(3, 9), (5, None)])
+                self.assertIn("ZeroDivisionError", summary.failed[1].error)
+                report = summary.report()
+                self.assertIn("2 of the 8 tests failed.", report)
+                self.assertIn("Actual value 9 differs from 10, the expected value.\nat line 3, column 1", report)
+
+    def test_output(self):
+        parallel.WORKERS = 2
+        source = "".join("(check-expect (seqn (display %d) %d) %d)\n" % (i, i, i) for i in range(10))
+        with ports.redirect(io.StringIO()) as (output, _):
+            summary = checks.runFile(source)[1]
+        self.assertFalse(summary.failed)
+        self.assertEqual(output.stream.getvalue(), "".join("%d\n" % i for i in range(10)))
+
+    def test_order(self):
+        parallel.WORKERS = 1
+        for engine in ["interp", "resolve", "compile", "vm"]:
+            with ports.redirect(io.StringIO()) as (output, _):
+                summary = checks.runFile("(check-expect (seqn (display 1) 1) (seqn (display 2) 1))", engine)[1]
+            self.assertEqual(output.stream.getvalue(), "1\n2\n")
+            summary = checks.runFile("(check-expect (/ 1 0) (vector-ref (vector) 0))", engine)[1]
+            self.assertIn("ZeroDivisionError", summary.failed[0].error)
+
+    def test_run_file(self):
+        parallel.WORKERS = 1
+        env = dict(topLevelEnv)
+        summary = racython.runFile("(define x 2)\n(check-expect x 2)", env=env, checks=True)
+        self.assertEqual(summary.report(), "The only test passed!")
+        self.assertEqual(env["x"], 2)
+        self.assertEqual(checks.runFile("(+ 1 2)")[1].report(), "This program has no tests.")
+
+
+class TestServer(unittest.TestCase):
+    def test_sessions(self):
+        evaluator = server.Server("(define base 10)")
+        self.assertEqual(evaluator.handle({"source": "(define x (+ base 1)) x", "session": "a"})["values"],
+                         ["None", "11"])
+        self.assertEqual(evaluator.handle({"source": "(with (y 2) (* x y))", "session": "a", "engine": "vm"}),
+                         {"values": ["22"], "output": "", "error": None})
+        # Other sessions start from the prelude alone
+        response = evaluator.handle({"source": "base x", "session": "b"})
+        self.assertEqual((response["values"], response["error"]), (["10"], "SystemExit: the program exited"))
+        self.assertNotIn("x", evaluator.prelude)
+        evaluator.handle({"close": "a"})
+        self.assertNotIn("a", evaluator.sessions)
+
+    def test_requests(self):
+        evaluator = server.Server(timeout=0.2)
+        self.assertEqual(evaluator.handle({"source": "(seqn (display 5) (read))", "input": "6\n"}),
+                         {"values": ["6"], "output": "5\n", "error": None})
+        response = evaluator.handle({"source": "1 (/ 1 0) 2"})
+        self.assertEqual((response["values"], response["error"]), (["1"], "ZeroDivisionError: division by zero"))
+        response = evaluator.handle({"source": "(with (loop (fun (f) (f f))) (loop loop))"})
+        self.assertEqual(response["error"], "Timeout: took longer than 0.2s")
+        self.assertEqual(evaluator.handle({"source": "(+ 1 2)"})["values"], ["3"])
+        self.assertIn("Bad request", json.loads(evaluator.respond(b"{"))["error"])
+
+    def test_depth(self):
+        # Deep enough to overflow the C stack under racython's recursion limit
+        evaluator = server.Server()
+        limit = sys.getrecursionlimit()
+        program = "((fun (sum) (sum sum 1000000)) (fun (self n) (if0 (equal? n 0) 0 (+ n (self self (- n 1))))))"
+        for engine in ["resolve", "compile"]:
+            response = evaluator.handle({"source": program, "engine": engine})
+            self.assertTrue(response["error"].startswith("RecursionError: "), response["error"])
+            self.assertEqual(evaluator.handle({"source": "(+ 1 2)", "engine": engine})["values"], ["3"])
+        self.assertEqual(sys.getrecursionlimit(), limit)
+
+    def test_socket(self):
+        path = os.path.join(tempfile.mkdtemp(), "server.sock")
+        process = subprocess.Popen([sys.executable, "server.py", "--socket", path],
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        try:
+            for _ in range(100):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.05)
+            with client.Client(path) as connection:
+                connection.evaluate("(define x 4)", session="s")
+                self.assertEqual(connection.evaluate("(* x x)", session="s")["values"], ["16"])
+        finally:
+            process.terminate()
+            process.wait()
+        self.assertFalse(os.path.exists(path))
+
+
+class TestPorts(unittest.TestCase):
+    def test_output(self):
+        output = io.StringIO()
+        hi = "(list->string (list (integer->char 104) (integer->char 105)))"
+        with ports.redirect(output):
+            for engine in ["interp", "vm"]:
+                run("(seqn (display 5) (seqn (write-string %s) (newline)))" % hi, dict(topLevelEnv), engine=engine)
+            # Nothing is written until it is flushed
+            self.assertEqual(output.getvalue(), "")
+            run("(flush-output)", dict(topLevelEnv))
+            self.assertEqual(output.getvalue(), "5\nhi\n5\nhi\n")
+        with self.assertRaises(racython.RacythonException) as raised:
+            run("(write-string 5)", dict(topLevelEnv))
+        self.assertTrue(str(raised.exception).startswith("write-string: "))
+
+    def test_buffering(self):
+        output = io.StringIO()
+        port = ports.OutputPort(output, 10)
+        with ports.redirect(port):
+            run("(build-list 20 (fun (i) (display i)))", dict(topLevelEnv))
+            self.assertEqual(port.flushes, 4)
+        self.assertEqual(output.getvalue(), "".join("%d\n" % i for i in range(20)))
+        self.assertEqual((port.flushes, port.written), (5, len(output.getvalue())))
+
+    def test_input(self):
+        with ports.redirect(input=io.StringIO("uno\ndos")):
+            self.assertEqual(run("(list (read-line) (read) (eof-object? (read-line)))", dict(topLevelEnv)),
+                             ["uno", "dos", True])
+        self.assertEqual(repr(ports.EOF), "#<eof>")
+
+
+class TestStructs(unittest.TestCase):
+    source = """(define-struct bf [ptr tape])
+                (define s (make-bf 1 (list 0 1 0)))
+                (list (bf-ptr s) (bf-tape s) (bf? s) (bf? 5) (equal? s (make-bf 1 (list 0 1 0))))
+                ((fun (x) (seqn (define-struct posn (x y)) (posn-y (make-posn 2 x)))) 7)"""
+
+    def test_engines(self):
+        for engine in ["interp", "resolve", "compile", "vm"]:
+            env = racython.toEnv(dict(topLevelEnv))
+            forms = [form.rexp for form in reader.read(io.StringIO(self.source))]
+            self.assertEqual(list(racython.runForms(forms, engine, env))[2:], [[1, [0, 1, 0], True, False, True], 7])
+            self.assertEqual(repr(env["s"]), "(make-bf 1 [0, 1, 0])")
+            self.assertEqual(type(env["s"]).__slots__, ("ptr", "tape"))
+            self.assertRaises(TypeError, run, "(bf-ptr (list 1 2))", env, engine=engine)
+            self.assertRaises(TypeError, run, "(make-bf 1)", env, engine=engine)
+            self.assertFalse(hasattr(env["s"], "__dict__"))
+            # Every run of a define-struct makes a new type
+            self.assertFalse(run("(with (mk (fun () (seqn (define-struct p (x)) (make-p 1)))) (equal? (mk) (mk)))",
+                                 dict(topLevelEnv), engine=engine), engine)
+
+    def test_types(self):
+        env = racython.toEnv(dict(topLevelEnv))
+        run("(define-struct a (class x-y))", env)
+        value = run("(make-a 1 2)", env)
+        self.assertEqual(type(value).__slots__, ("_0", "_1"))
+        self.assertEqual(run("(a-x-y (make-a 1 2))", env), 2)
+        # Each define-struct makes a new type
+        run("(define old (make-a 1 2))", env)
+        run("(define-struct a (class x-y))", env)
+        self.assertFalse(run("(a? old)", env))
+        self.assertNotEqual(run("(make-a 1 2)", env), env["old"])
+        copy = pickle.loads(pickle.dumps(value))
+        self.assertIs(type(copy), type(value))
+        self.assertEqual(copy, value)
+        # Types nothing uses anymore aren't kept
+        run("(build-list 500 (fun (i) (seqn (define-struct p (x)) (make-p i))))", dict(topLevelEnv))
+        gc.collect()
+        self.assertLess(len(racket_functions.structTypes), 100)
+
+    def test_pool(self):
+        saved = parallel.WORKERS, parallel.MINIMUM
+        parallel.WORKERS, parallel.MINIMUM = 2, 8
+        try:
+            env = racython.toEnv(dict(topLevelEnv))
+            run("(define-struct posn (x y))", env)
+            self.assertEqual(run("(pmap (fun (p) (posn? (make-posn (posn-y p) (posn-x p))))"
+                                 " (build-list 20 (fun (i) (make-posn i 0))))", env), [True] * 20)
+        finally:
+            parallel.WORKERS, parallel.MINIMUM = saved
+
+    def test_rewriters(self):
+        rexp = racython.parser("(seqn (define-struct odd (+)) (odd? 3))")
+        self.assertEqual(optimizer.optimize(rexp)[0], rexp)
+        forms = [racython.parser("(define-struct a (b))"), racython.parser("(define f (fun (x) (make-a x)))")]
+        self.assertEqual(memo.memoize(forms), forms)
+        reads, writes = set(), set()
+        incremental.names(forms[0], set(), reads, writes)
+        self.assertEqual((reads, writes), (set(), {"make-a", "a?", "a-b"}))
+
+
+class TestStreams(unittest.TestCase):
+    source = """(define nats (fun (self n) (stream-cons n (self self (add1 n)))))
+                (define s (nats nats 0))
+                (define p (delay (seqn (display 7) 3)))
+                (list (stream-first (stream-rest (stream-rest s))) (+ (force p) (force p)) (force 4))
+                (stream-first (stream-filter (fun (x) (> x 5)) (stream-map (fun (x) (* x 2)) s)))
+                (list (stream->list (in-range 4)) (stream->list (in-range 1 2 0.25)) (stream->list (in-range 5 0 -2)))
+                (list (stream-empty? (in-range 3 3)) (stream-empty? empty) (stream-first (list 8 9)))
+                (foldl + 0 (stream-map (fun (x) (* x x)) (stream-filter even? (in-range 100000))))
+                (foldl (fun (x acc) (seqn (display x) acc)) 0 (stream-map (fun (x) (seqn (display (* 10 x)) x))
+                                                                          (in-range 1 3)))"""
+
+    def test_engines(self):
+        for engine in ["interp", "resolve", "compile", "vm"]:
+            env = racython.toEnv(dict(topLevelEnv))
+            forms = [form.rexp for form in reader.read(io.StringIO(self.source))]
+            with ports.redirect(io.StringIO()) as (output, _):
+                values = list(racython.runForms(forms, engine, env))[3:]
+            self.assertEqual(values, [[2, 6, 4], 6, [[0, 1, 2, 3], [1, 1.25, 1.5, 1.75], [5, 3, 1]], [True, True, 8],
+                                      166661666700000, 0], engine)
+            # A delay runs once, and a stage with effects takes turns with the fold
+            self.assertEqual(output.stream.getvalue(), "7\n10\n1\n20\n2\n", engine)
+            self.assertRaises(racython.RacythonException, run, "(stream-rest (in-range 0))", env, engine=engine)
+            # Only what is asked for runs
+            run("(define bad (stream-cons 1 (/ 1 0)))", env, engine=engine)
+            self.assertEqual(run("(list (stream-first bad) (stream-empty? bad))", env, engine=engine), [1, False])
+            self.assertEqual(run("(stream-first (stream-map add1 (stream-filter odd? bad)))", env, engine=engine), 2)
+            self.assertRaises(ZeroDivisionError, run, "(stream-rest bad)", env, engine=engine)
+
+    def test_fusion(self):
+        optimized, report = optimizer.optimize(racython.parser(
+            "(foldl + 0 (map (fun (x) (* x x)) (filter even? (build-list 10 add1))))"))
+        self.assertEqual(optimized, ["foldl", "+", 0, ["stream-map", ["fun", ["x"], ["*", "x", "x"]],
+                                                        ["stream-filter", "even?", ["stream-map", "add1",
+                                                                                    ["in-range", 10]]]]])
+        self.assertEqual(report.fused, 3)
+        optimized = optimizer.optimize(racython.parser("(foldr cons empty (map add1 (build-list 5 sub1)))"))[0]
+        self.assertEqual(optimized, ["foldl", "cons", "empty", ["stream-map", "add1", ["stream-map", "sub1",
+                                                                                         ["in-range", ["sub1", 5],
+                                                                                          -1, -1]]]])
+        # Stages with effects, and names the program binds, are left alone
+        for program in ["(map add1 (map display (list 1 2)))", "(seqn (define add1 sub1) (map add1 (map add1 xs)))",
+                        "(fun (k) (map add1 (map (fun (x) (* x k)) xs)))", "(fun (n) (map add1 (build-list n add1)))",
+                        "(foldl + 0 (build-list 2.5 add1))"]:
+            self.assertEqual(optimizer.optimize(racython.parser(program))[1].fused, 0, program)
+        for program in ["(map (fun (x) (* x 2)) (filter odd? (map add1 (list 1 2 3 4))))",
+                        "(foldr cons empty (filter even? (map sub1 (build-list 20 add1))))",
+                        "(foldr + 0 (map add1 (list 1 2 3)))", "(filter even? (build-list 0 add1))",
+                        "(map (fun (x) (seqn (display x) x)) (map add1 (list 1 2)))"]:
+            with ports.redirect(io.StringIO()) as (output, _):
+                expected = run(program, env=dict(topLevelEnv))
+            for engine in ["interp", "resolve", "compile", "vm"]:
+                with ports.redirect(io.StringIO()) as (fused, _):
+                    self.assertEqual(run(program, env=dict(topLevelEnv), engine=engine, optimize=True), expected,
+                                     program + " " + engine)
+                self.assertEqual(fused.stream.getvalue(), output.stream.getvalue())
+        for engine in ["interp", "resolve", "compile", "vm"]:
+            self.assertRaises(TypeError, run, "(foldl + 0 (build-list 2.5 add1))", dict(topLevelEnv), engine=engine,
+                              optimize=True)
+
+    def test_memory(self):
+        results = dict(((kind, mode), benchmark.measure(template.format(n=100000), 100000, optimize=mode == "fused"))
+                       for kind, template in benchmark.PIPELINES.items() if kind != "closure"
+                       for mode in ("eager", "fused"))
+        for kind in ["squares", "foldr"]:
+            self.assertEqual(results[kind, "eager"]["value"], results[kind, "fused"]["value"])
+            self.assertLess(results[kind, "fused"]["peak_bytes"] * 5, results[kind, "eager"]["peak_bytes"])
+
+
+class TestIncremental(unittest.TestCase):
+    source = ("(define a 5)\n(define sq (fun (x) (* x x)))\n(define b (sq a))\n(define c 7)\n(+ b c)\n"
+              "(display c)\n")
+
+    def fromScratch(self, source, engine):
+        forms = [form.rexp for form in reader.read(io.StringIO(source))]
+        return list(racython.runForms(forms, engine, racython.toEnv(dict(topLevelEnv))))
+
+    def test_reuse(self):
+        with ports.redirect(io.StringIO()):
+            for engine in ["interp", "resolve", "compile", "vm"]:
+                session = incremental.Session(engine)
+                self.assertEqual(list(session.runFile(self.source)), self.fromScratch(self.source, engine))
+                self.assertEqual((session.ran, session.reused), (6, 0))
+                # Only the display runs again
+                self.assertEqual(list(session.runFile(self.source))[4], 32)
+                self.assertEqual((session.ran, session.reused), (1, 5))
+                edited = self.source.replace("(define a 5)", "(define a 6)")
+                self.assertEqual(list(session.runFile(edited)), self.fromScratch(edited, engine))
+                self.assertEqual((session.ran, session.reused), (4, 2))
+
+    def test_effects(self):
+        with ports.redirect(io.StringIO()) as (output, _):
+            session = incremental.Session()
+            source = "(define three 3)\n(define show (fun (x) (display x)))\n(show three)\n"
+            for _ in range(2):
+                list(session.runFile(source))
+            output.flush()
+            self.assertEqual(output.stream.getvalue(), "3\n3\n")
+            self.assertEqual(session.reused, 1)
+        # A vector set by a form is made again before it runs again
+        source = "(define v (make-vector 1 0))\n(vector-set! v 0 (+ (vector-ref v 0) 1))\n(vector-ref v 0)\n"
+        for _ in range(2):
+            self.assertEqual(list(session.runFile(source))[2], 1)
+
+    def test_runFile(self):
+        session = incremental.Session()
+        with ports.redirect(io.StringIO()):
+            self.assertEqual(racython.runFile(self.source, session=session)[4], 32)
+            racython.runFile(self.source, session=session)
+        self.assertEqual(session.reused, 5)
+
+    def test_env(self):
+        base = racython.toEnv(dict(topLevelEnv)).child({"a": 2})
+        session = incremental.Session("resolve", base)
+        for _ in range(2):
+            self.assertEqual(list(session.runFile("(define b (* a 3))\n(set a 10)\n(+ a b)")), [None, None, 16])
+        self.assertEqual(base.vars, {"a": 2})
+
+
+class TestBatch(unittest.TestCase):
+    prelude = "(define sq (fun (x) (* x x)))"
+    programs = ["(define a 3)\n(sq a)", "(seqn (display 7) a)", "(set sq 5)\nsq", "(sq 4)", "(/ 1 0)"]
+
+    def test_isolation(self):
+        for engine in ["interp", "resolve", "compile", "vm"]:
+            for workers in [1, 2]:
+                results = batch.runBatch(self.programs, self.prelude, engine, workers)
+                self.assertEqual([result.index for result in results], list(range(5)))
+                self.assertEqual([[str(value) for value in result.values] for result in results],
+                                 [["None", "9"], [], ["None", "5"], ["16"], []])
+                self.assertIsNone(results[3].error)
+                self.assertTrue(results[1].error and results[1].output.startswith("7\n"))
+                self.assertEqual(results[4].error, "ZeroDivisionError: division by zero")
+
+    def test_limits(self):
+        loop = "((fun (f) (f f)) (fun (f) (f f)))"
+        deep = "((fun (f) (+ 1 (f f))) (fun (f) (+ 1 (f f))))"
+        for engine in ["interp", "resolve", "compile", "vm"]:
+            result = batch.runBatch([loop, "(+ 1 2)"], engine=engine, workers=1, steps=20000)
+            self.assertTrue(result[0].error.startswith(("StepLimit", "RecursionError")))
+            self.assertEqual((result[1].values, result[1].error), ([3], None))
+            self.assertLess(result[1].steps, 20000)
+            # The vm keeps its calls off the Python stack
+            if engine != "vm":
+                self.assertTrue(batch.runBatch([deep], engine=engine, workers=1)[0].error.startswith("RecursionError"))
+        result = batch.runBatch([loop], workers=1, timeout=0.2)[0]
+        self.assertEqual(result.error, "Timeout: took longer than 0.2s")
+        self.assertLess(result.seconds, 2)
+        self.assertEqual(sys.getrecursionlimit(), 1000000000)
+
+    def test_streaming(self):
+        with batch.Batch(workers=2) as runner:
+            results = list(runner.run(["(+ %d 1)" % i for i in range(20)]))
+        self.assertEqual(sorted((result.index, result.values) for result in results),
+                         [(i, [i + 1]) for i in range(20)])
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_workloads(self):
+        expected = {"fib 10": 55, "list 20": 210, "map/filter/foldr 1000": 748500, "closures 200": 19900}
+        for name, source, calls, unit in benchmark.workloads(10, 1000):
+            if name in expected:
+                for engine in ["interp", "vm"]:
+                    self.assertEqual(racython.run(source, engine=engine), expected[name])
+
+    def test_compare(self):
+        baseline = {"a": {"seconds": 1.0}, "b": {"seconds": 1.0}, "c": {"seconds": 1.0}}
+        results = {"a": {"seconds": 1.1}, "b": {"seconds": 2.0}, "d": {"seconds": 9.0}}
+        self.assertEqual(benchmark.compare(results, baseline, 0.25), ["b"])
+
+    def test_structs(self):
+        results = dict((encoding, benchmark.structThroughput(encoding, 1000)) for encoding in benchmark.STRUCTS)
+        self.assertLess(results["define-struct"]["bytes_per_instance"], results["namedtuple"]["bytes_per_instance"])
+        self.assertLess(results["namedtuple"]["bytes_per_instance"], results["list"]["bytes_per_instance"])
+
+    def test_startup(self):
+        results = benchmark.startup(1)
+        self.assertEqual(sorted(results), ["startup import racython", "startup python", "startup tarea3.py"])
+        self.assertIn("racython", results["startup import racython"]["modules"])
+        # Every module can be the first one imported
+        for module in ["racket_functions", "reader", "resolver", "compiler", "vm", "memo", "bulk", "parallel",
+                       "streams"]:
+            self.assertIn(module, benchmark.importTimes(module))
+
+
+class TestProgramCache(unittest.TestCase):
+    source = "(define x 3)\n(+ x 4)\n(list 1 2)"
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = cache.ProgramCache(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hitAndMiss(self):
+        first = racython.runFile(self.source, env=dict(topLevelEnv), cache=self.cache)
+        second = racython.runFile(self.source, env=dict(topLevelEnv), cache=self.cache)
+        self.assertEqual(first, second)
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+        self.assertGreater(stats["bytes"], 0)
+        self.assertEqual(self.cache.load(self.source), [["define", "x", 3], ["+", "x", 4], ["list", 1, 2]])
+
+    def test_bypass(self):
+        # Only runs that ask for it touch the default cache
+        saved = cache.programs
+        cache.programs = self.cache
+        try:
+            racython.runFile(self.source, env=dict(topLevelEnv))
+            racython.runFile(self.source, env=dict(topLevelEnv), cache=False)
+            self.assertEqual(self.cache.stats(), {"hits": 0, "misses": 0, "entries": 0, "bytes": 0})
+            racython.runFile(self.source, env=dict(topLevelEnv), cache=True)
+            self.assertEqual(self.cache.stats()["entries"], 1)
+        finally:
+            cache.programs = saved
+
+    def test_failed_store(self):
+        # marshal can't write an object, and nothing is left behind
+        self.cache.store(self.source, [object()])
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_reader_version(self):
+        path = self.cache.path(self.source)
+        saved = cache.readerHash
+        cache.readerHash = "another reader"
+        try:
+            self.assertNotEqual(self.cache.path(self.source), path)
+        finally:
+            cache.readerHash = saved
+
+    def test_corrupt(self):
+        self.cache.store(self.source, [[1]])
+        with open(self.cache.path(self.source), "wb") as entry:
+            entry.write(b"\xff")
+        self.assertIsNone(self.cache.load(self.source))
+        self.assertEqual(racython.runFile(self.source, env=dict(topLevelEnv), cache=self.cache)[0], None)
+
+    def test_evict(self):
+        self.cache.maxBytes = 0
+        self.cache.store(self.source, [["+", 1, 2]])
+        self.assertEqual(self.cache.stats()["entries"], 0)
+        self.cache.maxBytes = cache.MAX_BYTES
+        for n in range(3):
+            self.cache.store(self.source + str(n), [n])
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()["bytes"], 0)
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,278 @@
+"""
+Bytecode compiler and stack machine for Racython.
+
+assemble turns a Resolved tree (see resolver) into a Code object and execute runs it in a single loop. Calls
+to compiled closures push a return record on an explicit call stack instead of recursing in Python, so how deep a
+program can recurse is only bounded by memory. Calls in tail position replace the current frame instead.
+
+A Code is a Code(instructions, arity, size, mutable, name), where the instructions are a flat list of
+opcode, operand pairs.
+
+python vm.py "<racket expression>" prints the disassembly of the expression.
+"""
+
+import sys
+import racython
+from resolver import Const, Local, Global, Free, If0, Fun, SetLocal, SetGlobal, With, Seqn, App, UNSET, capture, \
+    resolve
+
+CONST = 0
+LOCAL = 1
+GLOBAL = 2
+FREE = 3
+JUMP = 4
+JUMP_IF_FALSE = 5
+CLOSURE = 6
+SET_LOCAL = 7
+SET_GLOBAL = 8
+ENTER = 9
+ENTER_EMPTY = 10
+BIND = 11
+LEAVE = 12
+POP = 13
+CALL = 14
+TAIL_CALL = 15
+RETURN = 16
+
+OPNAMES = ["CONST", "LOCAL", "GLOBAL", "FREE", "JUMP", "JUMP_IF_FALSE", "CLOSURE", "SET_LOCAL", "SET_GLOBAL",
+           "ENTER", "ENTER_EMPTY", "BIND", "LEAVE", "POP", "CALL", "TAIL_CALL", "RETURN"]
+
+
+class Code(object):
+    """ The bytecode of a program or of a fun's body"""
+    __slots__ = ("instructions", "arity", "size", "mutable", "name")
+
+    def __init__(self, instructions, arity=0, size=0, mutable=(), name="<program>"):
+        self.instructions = instructions
+        self.arity = arity
+        self.size = size
+        self.mutable = mutable
+        self.name = name
+
+    def __repr__(self):
+        return "<code " + self.name + ">"
+
+
+class Closure(object):
+    """ A closure over a Frame running bytecode. Calling it from Python starts a new machine loop."""
+    __slots__ = ("code", "frame")
+
+    def __init__(self, code, frame):
+        self.code = code
+        self.frame = frame
+
+    def __call__(self, *args):
+        return execute(self.code, callFrame(self, args))
+
+
+def callFrame(closure, args):
+    """ Closure [ListOf Value] -> Frame
+        The frame a call to closure with args runs in"""
+    code = closure.code
+    frame = [closure.frame]
+    frame.extend(args[:code.arity])
+    if len(frame) <= code.size:
+        frame.extend([UNSET] * (code.size + 1 - len(frame)))
+    return frame
+
+
+def assemble(node, name="<program>"):
+    """ Resolved -> Code
+        Compiles a resolved program into bytecode"""
+    instructions = []
+    emit(node, instructions, True)
+    instructions.extend((RETURN, None))
+    return Code(instructions, name=name)
+
+
+def emit(node, code, tail):
+    """ Resolved [ListOf Instruction] Boolean -> None
+        Appends the bytecode for node to code, tail is whether node's value is what the current code returns"""
+    kind = type(node)
+    if kind is Const:
+        code.extend((CONST, node.value))
+    elif kind is Local:
+        code.extend((LOCAL, node))
+    elif kind is Global:
+        code.extend((GLOBAL, node))
+    elif kind is Free:
+        code.extend((FREE, node.name))
+    elif kind is If0:
+        emit(node.test, code, False)
+        code.extend((JUMP_IF_FALSE, None))
+        jumpToOther = len(code) - 1
+        emit(node.then, code, tail)
+        code.extend((JUMP, None))
+        jumpToEnd = len(code) - 1
+        code[jumpToOther] = len(code)
+        emit(node.other, code, tail)
+        code[jumpToEnd] = len(code)
+    elif kind is Fun:
+        body = []
+        emit(node.body, body, True)
+        body.extend((RETURN, None))
+        code.extend((CLOSURE, Code(body, node.arity, node.size, node.mutable, "<fun/%d>" % node.arity)))
+    elif kind is SetLocal:
+        emit(node.value, code, False)
+        code.extend((SET_LOCAL, node.index))
+    elif kind is SetGlobal:
+        emit(node.value, code, False)
+        code.extend((SET_GLOBAL, node.name))
+    elif kind is With:
+        if node.inner:
+            code.extend((ENTER_EMPTY, node.size))
+            emit(node.binding, code, False)
+            code.extend((BIND, None))
+        else:
+            emit(node.binding, code, False)
+            code.extend((ENTER, node.size))
+        # Returning restores the caller's frame anyway, so a with in tail position never needs to leave
+        emit(node.body, code, tail)
+        if not tail:
+            code.extend((LEAVE, None))
+    elif kind is Seqn:
+        emit(node.first, code, False)
+        code.extend((POP, None))
+        emit(node.second, code, tail)
+    elif kind is App:
+        emit(node.function, code, False)
+        for arg in node.args:
+            emit(arg, code, False)
+        code.extend((TAIL_CALL if tail else CALL, len(node.args)))
+    else:
+        raise racython.InternalRacythonException("Unknown resolved node " + repr(node))
+
+
+def fallback(node, frame):
+    """ Resolved Frame -> Value
+        Reads a variable whose innermost slot is unset, following its fallbacks outwards"""
+    while type(node) is Local:
+        target = frame
+        for _ in range(node.depth):
+            target = target[0]
+        value = target[node.index]
+        if value is not UNSET:
+            return value
+        node = node.fallback
+    if type(node) is Global:
+        return readGlobal(node, frame)
+    raise racython.FreeIdentifierError(node.name)
+
+
+def readGlobal(node, frame):
+    """ Global Frame -> Value
+        Reads a top level binding by name"""
+    for _ in range(node.depth):
+        frame = frame[0]
+    try:
+        return frame[node.name]
+    except KeyError:
+        raise racython.FreeIdentifierError(node.name)
+
+
+def execute(code, frame):
+    """ Code Frame -> Value
+        Runs code in frame until it returns"""
+    instructions = code.instructions
+    pc = 0
+    stack = []
+    calls = []
+    while True:
+        op = instructions[pc]
+        arg = instructions[pc + 1]
+        pc += 2
+        if op == LOCAL:
+            target = frame
+            for _ in range(arg.depth):
+                target = target[0]
+            value = target[arg.index]
+            if value is UNSET:
+                value = fallback(arg.fallback, frame)
+            stack.append(value)
+        elif op == CONST:
+            stack.append(arg)
+        elif op == GLOBAL:
+            stack.append(readGlobal(arg, frame))
+        elif op == CALL or op == TAIL_CALL:
+            if arg:
+                args = stack[-arg:]
+                del stack[-arg:]
+            else:
+                args = []
+            function = stack.pop()
+            if type(function) is Closure:
+                if op == CALL:
+                    calls.append((instructions, pc, frame))
+                frame = callFrame(function, args)
+                instructions = function.code.instructions
+                pc = 0
+            else:
+                stack.append(function(*args))
+                if op == TAIL_CALL:
+                    # A tail call to a primitive returns its value right away
+                    if not calls:
+                        return stack.pop()
+                    instructions, pc, frame = calls.pop()
+        elif op == JUMP_IF_FALSE:
+            if not stack.pop():
+                pc = arg
+        elif op == JUMP:
+            pc = arg
+        elif op == RETURN:
+            if not calls:
+                return stack.pop()
+            instructions, pc, frame = calls.pop()
+        elif op == CLOSURE:
+            stack.append(Closure(arg, capture(frame, arg.mutable)))
+        elif op == POP:
+            stack.pop()
+        elif op == ENTER:
+            frame = [frame, stack.pop()]
+            frame.extend([UNSET] * (arg - 1))
+        elif op == ENTER_EMPTY:
+            frame = [frame]
+            frame.extend([UNSET] * arg)
+        elif op == BIND:
+            frame[1] = stack.pop()
+        elif op == LEAVE:
+            frame = frame[0]
+        elif op == SET_LOCAL:
+            frame[arg] = stack.pop()
+            stack.append(None)
+        elif op == SET_GLOBAL:
+            frame[arg] = stack.pop()
+            stack.append(None)
+        elif op == FREE:
+            raise racython.FreeIdentifierError(arg)
+        else:
+            raise racython.InternalRacythonException("Unknown opcode " + repr(op))
+
+
+def disassemble(code):
+    """ Code -> String
+        A readable listing of code followed by the code of every fun inside it"""
+    lines = [code.name + " arity=%d size=%d" % (code.arity, code.size)]
+    nested = []
+    instructions = code.instructions
+    for pc in range(0, len(instructions), 2):
+        op, arg = instructions[pc], instructions[pc + 1]
+        if op == LOCAL:
+            operand = "%d.%d" % (arg.depth, arg.index)
+        elif op == GLOBAL:
+            operand = "%d.%s" % (arg.depth, arg.name)
+        elif op == CLOSURE:
+            nested.append(arg)
+            operand = repr(arg)
+        elif arg is None:
+            operand = ""
+        else:
+            operand = repr(arg)
+        lines.append("%6d %-14s %s" % (pc, OPNAMES[op], operand))
+    for inner in nested:
+        lines.append("")
+        lines.append(disassemble(inner))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    print(disassemble(assemble(resolve(racython.parser(sys.argv[1]))[0])))